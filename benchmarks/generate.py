@@ -0,0 +1,172 @@
+"""
+Generate synthetic python projects to benchmark pyrefactorlsp on.
+
+Modules only import from modules generated before them, so the project is a
+DAG. A fraction of the imports go to a few "hot" modules, which gives them a
+large fan-in, like the `utils` or `models` modules of real projects.
+"""
+
+import random
+import shutil
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+
+IMPORT_STYLES = ("absolute", "relative", "module", "aliased")
+"""
+* absolute: `from bench.pkg_0.mod_1 import f_0`
+* relative: `from ..pkg_0.mod_1 import f_0`
+* module: `import bench.pkg_0.mod_1`
+* aliased: `import bench.pkg_0.mod_1 as m_0`
+"""
+
+PACKAGE = "bench"
+
+
+@dataclass
+class ProjectSpec:
+    modules: int = 100
+    """Number of modules, excluding `__init__.py` files"""
+
+    modules_per_package: int = 50
+    """Modules of each `pkg_<n>` sub-package"""
+
+    fan_out: int = 5
+    """Number of modules each module imports from, when enough exist"""
+
+    hot_modules: int = 5
+    """Number of modules with a large fan-in"""
+
+    hot_fraction: float = 0.3
+    """Probability for an import to target a hot module"""
+
+    functions: int = 10
+    """Number of top-level functions of each module"""
+
+    function_lines: int = 5
+    """Number of lines of each function body, sets the file size"""
+
+    import_styles: Sequence[str] = IMPORT_STYLES
+    """Import styles, picked at random for each import"""
+
+    seed: int = 0
+
+
+@dataclass
+class SyntheticProject:
+    root: Path
+    modules: list[str] = field(default_factory=list)
+    """Full module names, in generation order"""
+
+    edges: set[tuple[str, str]] = field(default_factory=set)
+    """Dependencies between modules, as expected in the graph"""
+
+
+def module_name(index: int, spec: ProjectSpec) -> tuple[str, str]:
+    """Package and name of the module `index`"""
+    return f"{PACKAGE}.pkg_{index // spec.modules_per_package}", f"mod_{index}"
+
+
+def import_statement(
+    style: str, package: str, target_package: str, target: str, alias: str
+) -> tuple[str, str]:
+    """
+    Import `f_0` of module `target`.
+
+    Returns:
+        `tuple[str, str]`: import statement, and expression referring to `f_0`
+    """
+    if style == "absolute":
+        return f"from {target_package}.{target} import f_0 as {alias}", alias
+    if style == "relative":
+        if target_package == package:
+            return f"from .{target} import f_0 as {alias}", alias
+        subpackage = target_package.removeprefix(f"{PACKAGE}.")
+        return f"from ..{subpackage}.{target} import f_0 as {alias}", alias
+    if style == "module":
+        return f"import {target_package}.{target}", f"{target_package}.{target}.f_0"
+    if style == "aliased":
+        return f"import {target_package}.{target} as {alias}", f"{alias}.f_0"
+    raise ValueError(f"Unknown import style {style}")
+
+
+def module_source(
+    index: int, spec: ProjectSpec, targets: Sequence[int], rng: random.Random
+) -> str:
+    package, _ = module_name(index, spec)
+    imports: list[str] = []
+    references: list[str] = []
+    for number, target in enumerate(targets):
+        target_package, target_name = module_name(target, spec)
+        style = rng.choice(spec.import_styles)
+        statement, reference = import_statement(
+            style, package, target_package, target_name, f"dep_{number}"
+        )
+        imports.append(statement)
+        references.append(reference)
+
+    lines = [*sorted(set(imports)), "", ""]
+    for function in range(spec.functions):
+        lines.append(f"def f_{function}(x: int) -> int:")
+        lines.append(f'    """Function {function} of module {index}"""')
+        for line in range(spec.function_lines):
+            lines.append(f"    x = x * {line + 2} + {function}")
+        if references:
+            # dependencies are used by the functions, round robin
+            lines.append(f"    return {references[function % len(references)]}(x)")
+        else:
+            lines.append("    return x")
+        lines.extend(["", ""])
+    lines.append(f"class C_{index}:")
+    lines.append("    value = f_0(1)")
+    return "\n".join(lines) + "\n"
+
+
+def pick_targets(index: int, spec: ProjectSpec, rng: random.Random) -> list[int]:
+    if index == 0:
+        return []
+    targets: set[int] = set()
+    while len(targets) < min(spec.fan_out, index):
+        if rng.random() < spec.hot_fraction:
+            targets.add(rng.randrange(min(spec.hot_modules, index)))
+        else:
+            targets.add(rng.randrange(index))
+    return sorted(targets)
+
+
+def generate_project(path: Path, spec: ProjectSpec) -> SyntheticProject:
+    """
+    Write a synthetic project to `path`, removing its previous content.
+
+    Args:
+        path (`Path`): project root, gets a `pyproject.toml`
+        spec (`ProjectSpec`):
+
+    Returns:
+        `SyntheticProject`:
+    """
+    if path.exists():
+        shutil.rmtree(path)
+    package_dir = path / PACKAGE
+    package_dir.mkdir(parents=True)
+    (path / "pyproject.toml").write_text(
+        f'[tool.pyrefactor]\nfolders = ["{PACKAGE}"]\n'
+    )
+    (package_dir / "__init__.py").write_text("")
+
+    rng = random.Random(spec.seed)
+    project = SyntheticProject(root=path)
+    for index in range(spec.modules):
+        package, name = module_name(index, spec)
+        folder = path.joinpath(*package.split("."))
+        if not folder.exists():
+            folder.mkdir()
+            (folder / "__init__.py").write_text("")
+        targets = pick_targets(index, spec, rng)
+        (folder / f"{name}.py").write_text(module_source(index, spec, targets, rng))
+        project.modules.append(f"{package}.{name}")
+        for target in targets:
+            project.edges.add(
+                (f"{package}.{name}", ".".join(module_name(target, spec)))
+            )
+    return project
@@ -0,0 +1,216 @@
+"""
+Time the phases of pyrefactorlsp on synthetic projects, and compare results.
+
+    python -m benchmarks.run run --sizes 100,1000,10000 --output results.json
+    python -m benchmarks.run compare before.json after.json
+"""
+
+import ast
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, TypeVar
+
+import click
+
+from benchmarks.generate import (
+    IMPORT_STYLES,
+    ProjectSpec,
+    generate_project,
+    module_name,
+)
+from pyrefactorlsp.refactor.actions.move_symbol_source import move_symbol_source
+from pyrefactorlsp.refactor.actions.move_symbol_target import plan_move_symbol_target
+from pyrefactorlsp.refactor.diffs import get_text_edits
+from pyrefactorlsp.refactor.graph import Graph, build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.module import Module
+from pyrefactorlsp.version import __version__
+
+T = TypeVar("T")
+
+
+def timed(timings: dict[str, list[float]], phase: str, function: Callable[[], T]) -> T:
+    start = time.perf_counter()
+    result = function()
+    timings.setdefault(phase, []).append(time.perf_counter() - start)
+    return result
+
+
+def function_line(module: Module, name: str) -> int:
+    for statement in ast.parse(module.text).body:
+        if isinstance(statement, ast.FunctionDef) and statement.name == name:
+            return statement.lineno
+    raise ValueError(f"{name} not found in {module.full_mod_name}")
+
+
+def move_function(
+    graph: Graph, spec: ProjectSpec, timings: dict[str, list[float]], workers: int = 1
+) -> None:
+    """
+    Move `f_0` out of the first module, the one with the largest fan-in, to the
+    last one, and compute the text edits of every updated module.
+    """
+    source = graph.get_node(".".join(module_name(0, spec)))
+    target = graph.get_node(".".join(module_name(spec.modules - 1, spec)))
+    assert source is not None and target is not None
+    original_texts = {module.full_mod_name: module.text for module in graph.nodes}
+    line = function_line(source, "f_0")
+    move = timed(
+        timings, "move_symbol_source", lambda: move_symbol_source(source, line, 0)
+    )
+    # the graph and trees are left as they are, as when the server computes
+    # the edits of a move
+    planned = timed(
+        timings,
+        "move_symbol_target",
+        lambda: plan_move_symbol_target(
+            graph, target, move, len(target.text.splitlines()) + 1, workers
+        ),
+    )
+    assert planned is not None
+    timed(
+        timings,
+        "get_text_edits",
+        lambda: [
+            get_text_edits(original_texts[name], code)
+            for name, code in planned.codes.items()
+        ],
+    )
+
+
+def bench_size(spec: ProjectSpec, repeat: int, workers: int) -> dict[str, list[float]]:
+    timings: dict[str, list[float]] = {}
+    with tempfile.TemporaryDirectory() as folder:
+        root = Path(folder) / "project"
+        timed(timings, "generate", lambda: generate_project(root, spec))
+        config = get_project_config(root).model_copy(
+            update={"workers": workers, "cache_dir": ".pyrefactor"}
+        )
+        for _ in range(repeat):
+            graph = timed(
+                timings, "build_project_graph", lambda: build_project_graph(config)
+            )
+            # the move is only planned, the files stay the same for the next run
+            move_function(graph, spec, timings, workers)
+        timed(
+            timings,
+            "build_cold_cache",
+            lambda: build_project_graph(config, use_cache=True),
+        )
+        for _ in range(repeat):
+            timed(
+                timings,
+                "build_warm_cache",
+                lambda: build_project_graph(config, use_cache=True),
+            )
+    return timings
+
+
+def git_commit() -> str | None:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("run")
+@click.option("--sizes", default="100,1000,10000", help="Comma separated module counts")
+@click.option("--repeat", default=3, help="Runs of each phase, the fastest is kept")
+@click.option(
+    "--workers", default=1, help="Indexing and rewriting processes, 0 for all CPUs"
+)
+@click.option("--fan-out", default=5)
+@click.option("--hot-modules", default=5)
+@click.option("--hot-fraction", default=0.3)
+@click.option("--functions", default=10, help="Functions per module")
+@click.option("--function-lines", default=5, help="Lines per function")
+@click.option("--import-styles", default=",".join(IMPORT_STYLES))
+@click.option("--seed", default=0)
+@click.option("--output", type=click.Path(dir_okay=False, path_type=Path))
+def run(
+    sizes: str,
+    repeat: int,
+    workers: int,
+    fan_out: int,
+    hot_modules: int,
+    hot_fraction: float,
+    functions: int,
+    function_lines: int,
+    import_styles: str,
+    seed: int,
+    output: Path | None,
+):
+    """Benchmark every phase for each project size."""
+    results: list[dict[str, Any]] = []
+    specs: list[dict[str, Any]] = []
+    for size in (int(size) for size in sizes.split(",")):
+        spec = ProjectSpec(
+            modules=size,
+            fan_out=fan_out,
+            hot_modules=hot_modules,
+            hot_fraction=hot_fraction,
+            functions=functions,
+            function_lines=function_lines,
+            import_styles=import_styles.split(","),
+            seed=seed,
+        )
+        specs.append({**spec.__dict__, "import_styles": list(spec.import_styles)})
+        for phase, values in bench_size(spec, repeat, workers).items():
+            result = {
+                "modules": size,
+                "phase": phase,
+                "min": min(values),
+                "median": statistics.median(values),
+                "runs": len(values),
+            }
+            results.append(result)
+            click.echo(f"{size:>6} {phase:<20} {result['min']:10.4f}")
+    report = {
+        "commit": git_commit(),
+        "version": __version__,
+        "python": platform.python_version(),
+        "date": datetime.now(UTC).isoformat(),
+        "workers": workers,
+        "specs": specs,
+        "results": results,
+    }
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2))
+
+
+@cli.command("compare")
+@click.argument("before", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument("after", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def compare(before: Path, after: Path):
+    """Print the speedup of each phase between two result files."""
+    before_results = {
+        (result["modules"], result["phase"]): result["min"]
+        for result in json.loads(before.read_text())["results"]
+    }
+    for result in json.loads(after.read_text())["results"]:
+        key = (result["modules"], result["phase"])
+        if key not in before_results or not result["min"]:
+            continue
+        speedup = before_results[key] / result["min"]
+        click.echo(
+            f"{key[0]:>6} {key[1]:<20} {before_results[key]:10.4f} {result['min']:10.4f} {speedup:7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    cli()
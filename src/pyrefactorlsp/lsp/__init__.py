@@ -1,6 +1,6 @@
 import click
 
-from .server import serve
+from .server import attach, serve
 
 
 @click.group()
@@ -9,3 +9,4 @@ def root():
 
 
 root.add_command(serve)
+root.add_command(attach)
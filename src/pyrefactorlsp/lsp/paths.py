@@ -0,0 +1,95 @@
+import os
+from pathlib import PurePath
+from typing import Generic, TypeVar
+
+from pygls.uris import to_fs_path
+
+V = TypeVar("V")
+
+
+def uri_to_path(uri: str) -> str:
+    """
+    Normalized absolute path of a file uri. Plain paths are accepted too.
+
+    Args:
+        uri (`str`):
+
+    Returns:
+        `str`:
+    """
+    path = to_fs_path(uri) if uri.startswith("file://") else uri
+    return os.path.abspath(path or uri)
+
+
+class _TrieNode(Generic[V]):
+    __slots__ = ("children", "has_value", "value")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode[V]] = {}
+        self.value: V | None = None
+        self.has_value = False
+
+
+class PathTrie(Generic[V]):
+    """
+    Values keyed by folder, looked up with the folders containing a path.
+    Lookups walk the parts of the path once, whatever the number of folders.
+    Paths are normalized with `uri_to_path`.
+    """
+
+    def __init__(self):
+        self._root: _TrieNode[V] = _TrieNode()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __setitem__(self, folder: str, value: V) -> None:
+        node = self._root
+        for part in PurePath(uri_to_path(folder)).parts:
+            node = node.children.setdefault(part, _TrieNode())
+        if not node.has_value:
+            self._len += 1
+        node.value = value
+        node.has_value = True
+
+    def __delitem__(self, folder: str) -> None:
+        path: list[tuple[_TrieNode[V], str]] = []
+        node = self._root
+        for part in PurePath(uri_to_path(folder)).parts:
+            if part not in node.children:
+                raise KeyError(folder)
+            path.append((node, part))
+            node = node.children[part]
+        if not node.has_value:
+            raise KeyError(folder)
+        node.value = None
+        node.has_value = False
+        self._len -= 1
+        # prune the branches left without values
+        for parent, part in reversed(path):
+            child = parent.children[part]
+            if child.has_value or child.children:
+                break
+            del parent.children[part]
+
+    def find(self, path: str) -> list[V]:
+        """
+        Values of the folders containing a path, or equal to it.
+
+        Args:
+            path (`str`): file uri or path
+
+        Returns:
+            `list[V]`: from the outermost folder to the innermost one
+        """
+        values: list[V] = []
+        node = self._root
+        for part in PurePath(uri_to_path(path)).parts:
+            child = node.children.get(part)
+            if child is None:
+                break
+            node = child
+            if node.has_value:
+                values.append(node.value)  # type: ignore[arg-type]
+        return values
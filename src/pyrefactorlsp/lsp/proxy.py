@@ -0,0 +1,39 @@
+import socket
+import sys
+import threading
+from typing import BinaryIO
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _forward_input(stdin: BinaryIO, connection: socket.socket) -> None:
+    while chunk := stdin.read1(CHUNK_SIZE):  # type: ignore[attr-defined]
+        connection.sendall(chunk)
+    # the client closed its end, the server ends the session
+    connection.shutdown(socket.SHUT_WR)
+
+
+def proxy_stdio(
+    connection: socket.socket,
+    stdin: BinaryIO | None = None,
+    stdout: BinaryIO | None = None,
+) -> None:
+    """
+    Forward the LSP messages of a client talking over stdio to a server
+    connection, and the responses back, until the server closes it. Messages
+    are forwarded as bytes, the framing is left to both ends.
+
+    Args:
+        connection (`socket.socket`): connection to the server
+        stdin (`BinaryIO | None`): defaults to the standard input
+        stdout (`BinaryIO | None`): defaults to the standard output
+    """
+    stdin = stdin if stdin is not None else sys.stdin.buffer
+    stdout = stdout if stdout is not None else sys.stdout.buffer
+    threading.Thread(
+        target=_forward_input, args=(stdin, connection), daemon=True
+    ).start()
+    with connection:
+        while chunk := connection.recv(CHUNK_SIZE):
+            stdout.write(chunk)
+            stdout.flush()
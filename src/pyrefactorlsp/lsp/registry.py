@@ -0,0 +1,104 @@
+import asyncio
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+
+from pyrefactorlsp.constants import LOGGER
+from pyrefactorlsp.refactor.config import Config
+from pyrefactorlsp.refactor.format import FormatCache
+from pyrefactorlsp.refactor.graph import Graph
+from pyrefactorlsp.refactor.load import get_project_config
+
+
+@dataclass(eq=False)
+class WorkspaceIndex:
+    """
+    In-memory index of a workspace root, shared by all the client sessions
+    which opened it.
+    """
+
+    root: str
+    """Path to the workspace folder"""
+
+    config: Config
+
+    format_cache: FormatCache
+
+    graph: Graph | None = None
+    """Dependency graph, None until the project is indexed"""
+
+    progress: tuple[int, int] | None = (0, 0)
+    """Indexed and total number of files, None once indexing is over"""
+
+    sessions: set[Hashable] = field(default_factory=set)
+    """Sessions using the index, it is dropped when the last one leaves"""
+
+
+class IndexRegistry:
+    """
+    Reference counted indexes of the workspaces opened by client sessions.
+
+    The server process serves every client connected to it, so several
+    editors working on the same project index it once. Refactors modify the
+    shared graphs, so they run one at a time across sessions (`refactor_lock`).
+    """
+
+    def __init__(self):
+        self._indexes: dict[str, WorkspaceIndex] = {}
+        self.refactor_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def get(self, root: str) -> WorkspaceIndex | None:
+        return self._indexes.get(root)
+
+    def acquire(self, root: str, session: Hashable) -> tuple[WorkspaceIndex, bool]:
+        """
+        Index of a workspace, for a session. It is created if no session uses
+        it yet: the caller is then responsible for building its graph.
+
+        Args:
+            root (`str`): path to the workspace folder
+            session (`Hashable`):
+
+        Returns:
+            `tuple[WorkspaceIndex, bool]`: index, and whether it was created
+        """
+        index = self._indexes.get(root)
+        created = index is None
+        if index is None:
+            config = get_project_config(root)
+            index = WorkspaceIndex(
+                root=root,
+                config=config,
+                format_cache=FormatCache(
+                    config.format_cache_size, config.format_cache_bytes
+                ),
+            )
+            self._indexes[root] = index
+        index.sessions.add(session)
+        LOGGER.debug("%s used by %d sessions", root, len(index.sessions))
+        return index, created
+
+    def release(self, root: str, session: Hashable) -> None:
+        """
+        Stop using the index of a workspace. The index is dropped once no
+        session uses it.
+
+        Args:
+            root (`str`): path to the workspace folder
+            session (`Hashable`):
+        """
+        index = self._indexes.get(root)
+        if index is None:
+            return
+        index.sessions.discard(session)
+        if not index.sessions:
+            LOGGER.debug("%s is not used anymore, dropping its index", root)
+            del self._indexes[root]
+
+    def sessions(self) -> set[Hashable]:
+        """Sessions using any index"""
+        return {
+            session for index in self._indexes.values() for session in index.sessions
+        }
@@ -1,54 +1,345 @@
-from collections.abc import Generator, Sequence
-from dataclasses import dataclass
-from subprocess import PIPE, Popen
-from typing import Literal, cast
+import asyncio
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Generator, Sequence
+from concurrent.futures import Future
+from functools import partial
+from pathlib import Path
+from typing import Literal, TypeVar, cast
 
 import click
-import libcst
+from libcst import ParserSyntaxError
 from lsprotocol.types import (
+    CODE_ACTION_RESOLVE,
+    EXIT,
     INITIALIZED,
     TEXT_DOCUMENT_CODE_ACTION,
+    TEXT_DOCUMENT_DID_CHANGE,
     TEXT_DOCUMENT_DID_SAVE,
+    WORKSPACE_DID_CHANGE_WATCHED_FILES,
     CodeAction,
+    CodeActionDisabledType,
     CodeActionKind,
     CodeActionOptions,
     CodeActionParams,
     Command,
+    DidChangeTextDocumentParams,
+    DidChangeWatchedFilesParams,
+    DidChangeWatchedFilesRegistrationOptions,
     DidSaveTextDocumentParams,
+    FileSystemWatcher,
     InitializedParams,
+    MessageType,
     OptionalVersionedTextDocumentIdentifier,
     Position,
     Range,
+    Registration,
+    RegistrationParams,
     TextDocumentEdit,
     TextEdit,
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
     WorkspaceEdit,
 )
+from pygls.protocol import LanguageServerProtocol, lsp_method
 from pygls.server import LanguageServer
+from pygls.uris import from_fs_path
+from pygls.workspace import TextDocument
 
 from pyrefactorlsp import LOGGER, __version__
 from pyrefactorlsp.config import load_config
+from pyrefactorlsp.lsp.paths import PathTrie, uri_to_path
+from pyrefactorlsp.lsp.proxy import proxy_stdio
+from pyrefactorlsp.lsp.registry import IndexRegistry, WorkspaceIndex
 from pyrefactorlsp.refactor.actions.move_symbol_source import (
     MoveSymbolSource,
     move_symbol_source,
 )
-from pyrefactorlsp.refactor.actions.move_symbol_target import move_symbol_target
+from pyrefactorlsp.refactor.actions.move_symbol_target import (
+    MoveSymbolTarget,
+    apply_move_symbol_target,
+    plan_move_symbol_target,
+)
+from pyrefactorlsp.refactor.cancel import CancellationToken, RefactorCancelled
 from pyrefactorlsp.refactor.config import Config
-from pyrefactorlsp.refactor.diffs import get_text_edits
+from pyrefactorlsp.refactor.diffs import (
+    apply_edit_blocks,
+    blocks_to_text_edits,
+    get_module_edits,
+    get_text_edits,
+    replaced_spans,
+)
+from pyrefactorlsp.refactor.format import (
+    FormatCache,
+    reformat_modules,
+    reformat_ranges,
+)
 from pyrefactorlsp.refactor.graph import (
     Graph,
     build_project_graph,
-    get_module_dependencies,
+    update_module_dependencies,
+    update_project_files,
 )
-from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.index import SourceIndex, hash_text, index_source
 from pyrefactorlsp.refactor.module import Module
 
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable)
+
+PlannedMoves = list[tuple[Graph, MoveSymbolTarget]]
+"""Moves planned by `finish_move`, with the graphs they were planned with"""
+
+MAX_RESOLVED_EDITS = 16
+"""Number of resolved code action edits kept, see `resolve_code_action`"""
+
+
+def _report_indexing(index: WorkspaceIndex, done: int, total: int) -> None:
+    if index.progress is None:
+        return
+    index.progress = (done, total)
+    for session in index.sessions:
+        session = cast(RefactorServer, session)
+        session.report_progress(
+            session.indexing_tokens.get(index.root),
+            f"{done}/{total} files",
+            done * 100 // total if total else 100,
+        )
+
+
+def _finish_build(index: WorkspaceIndex, future: Future[Graph]) -> None:
+    if future.cancelled():
+        # the session building it left, another one takes over
+        if index.sessions:
+            cast(RefactorServer, next(iter(index.sessions)))._start_build(index)
+        return
+    index.progress = None
+    try:
+        index.graph = future.result()
+    except (OSError, ValueError, SyntaxError, ParserSyntaxError, RecursionError):
+        # unreadable files, or code neither ast nor libcst can parse
+        LOGGER.exception("Could not index %s", index.root)
+    for session in list(index.sessions):
+        cast(RefactorServer, session)._graph_ready(index.root)
+
+
+class SessionProtocol(LanguageServerProtocol):
+    """
+    Protocol of a client connected to the shared server. The process keeps
+    serving the other clients when a client exits or disconnects.
+    """
+
+    _server: "RefactorServer"
+
+    def connection_lost(self, exc):
+        LOGGER.info("Client disconnected")
+        self._server.close_session()
+
+    @lsp_method(EXIT)
+    def lsp_exit(self, *args) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
 
 class RefactorServer(LanguageServer):
-    def __init__(self, version: str):
-        super().__init__("pyrefactorlsp", version)
-        self.configs: dict[str, Config] = {}
-        self.dependency_graphs: dict[str, Graph] = {}
+    """
+    Server of a client session. The indexes of workspaces are shared with the
+    other sessions of the process through an `IndexRegistry`, while ongoing
+    moves, open documents and pending updates belong to the session.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        registry: IndexRegistry | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+        protocol_cls: type[LanguageServerProtocol] = LanguageServerProtocol,
+    ):
+        super().__init__("pyrefactorlsp", version, loop=loop, protocol_cls=protocol_cls)
+        self.registry = registry if registry is not None else IndexRegistry()
+        self.workspaces: dict[str, WorkspaceIndex] = {}
+        # the same indexes, looked up by the paths of their files
+        self.roots: PathTrie[WorkspaceIndex] = PathTrie()
+        # progress tokens of the workspaces being indexed
+        self.indexing_tokens: dict[str, str | None] = {}
         self.current_moves: dict[str, MoveSymbolSource] = {}
+        self.pending_updates: dict[str, asyncio.TimerHandle] = {}
+        self.indexed_hashes: dict[str, str] = {}
+        self.changed_files: set[str] = set()
+        self.files_update: asyncio.TimerHandle | None = None
+        # refactors run one at a time across sessions, graph updates wait for
+        # them
+        self.refactor_lock = self.registry.refactor_lock
+        self.deferred_indexes: dict[str, SourceIndex] = {}
+        # (uri, document version, id of the move, line) -> move, edit. The move
+        # is kept alive so that its id is not reused while the edit is.
+        self.resolved_edits: OrderedDict[
+            tuple[str, int, int, int], tuple[MoveSymbolSource, WorkspaceEdit]
+        ] = OrderedDict()
+
+    @property
+    def configs(self) -> dict[str, Config]:
+        return {root: index.config for root, index in self.workspaces.items()}
+
+    @property
+    def dependency_graphs(self) -> dict[str, Graph]:
+        """Graphs of the workspaces of the session which are indexed"""
+        return {
+            root: index.graph
+            for root, index in self.workspaces.items()
+            if index.graph is not None
+        }
+
+    @property
+    def format_caches(self) -> dict[str, FormatCache]:
+        return {root: index.format_cache for root, index in self.workspaces.items()}
+
+    @property
+    def indexing(self) -> dict[str, tuple[int, int]]:
+        """Progress of the workspaces of the session being indexed"""
+        return {
+            root: index.progress
+            for root, index in self.workspaces.items()
+            if index.progress is not None
+        }
+
+    def close_session(self) -> None:
+        """
+        Release the indexes used by the session, its pending updates and its
+        worker threads. A refactor or an indexing already running finishes.
+        """
+        for file_uri in list(self.pending_updates):
+            self.cancel_file_update(file_uri)
+        if self.files_update is not None:
+            self.files_update.cancel()
+            self.files_update = None
+        for root in self.workspaces:
+            self.registry.release(root, self)
+        self.workspaces = {}
+        self.roots = PathTrie()
+        self.current_moves = {}
+        self.deferred_indexes = {}
+        if self._thread_pool_executor is not None:
+            self._thread_pool_executor.shutdown(wait=False, cancel_futures=True)
+
+    def can_resolve_edits(self) -> bool:
+        """Whether the client resolves the edits of code actions lazily"""
+        code_action = self.client_capabilities.text_document
+        code_action = code_action.code_action if code_action is not None else None
+        if code_action is None or code_action.resolve_support is None:
+            return False
+        return "edit" in code_action.resolve_support.properties
+
+    async def run_refactor(
+        self, file_uri: str, refactor: Callable[[CancellationToken], T]
+    ) -> T | None:
+        """
+        Run a refactor in a worker thread, so that the server keeps handling
+        other messages meanwhile. Refactors run one at a time, and the updates
+        of the graphs are deferred until they finish.
+
+        When the request is cancelled, the refactor is cancelled at its next
+        checkpoint, which is awaited before the cancellation propagates. It is
+        also cancelled once the `Config.refactor_timeout` of the workspaces of
+        the file passed.
+
+        Args:
+            file_uri (`str`): module the refactor was requested from
+            refactor (`Callable[[CancellationToken], T]`):
+
+        Returns:
+            `T | None`: None if the refactor timed out
+        """
+        timeouts = [
+            timeout
+            for workspace, _, _ in self.get_mods(file_uri)
+            if (timeout := self.configs[workspace].refactor_timeout) is not None
+        ]
+        token = CancellationToken(min(timeouts) if timeouts else None)
+        try:
+            async with self.refactor_lock:
+                future = self.loop.run_in_executor(
+                    self.thread_pool_executor, refactor, token
+                )
+                try:
+                    return await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    token.cancel()
+                    # the graphs must not change until the refactor stopped
+                    await asyncio.wait([future])
+                    # its `RefactorCancelled` is expected, the request is gone
+                    future.exception()
+                    raise
+        except RefactorCancelled as error:
+            LOGGER.warning("%s: %s", file_uri, error)
+            self.show_message_log(f"{error}: {file_uri}", MessageType.Warning)
+            return None
+        finally:
+            if not self.refactor_lock.locked():
+                for session in self.registry.sessions() | {self}:
+                    cast(RefactorServer, session)._apply_deferred_updates()
+
+    def _apply_deferred_updates(self) -> None:
+        deferred, self.deferred_indexes = self.deferred_indexes, {}
+        for file_uri, index in deferred.items():
+            self.apply_source_index(file_uri, index)
+        if self.changed_files and self.files_update is None:
+            self.schedule_files_update([])
+
+    def open_document_uris(self) -> dict[str, str]:
+        """Uris of the open documents, by path (see `uri_to_path`)"""
+        return {uri_to_path(uri): uri for uri in self.workspace.text_documents}
+
+    def get_module_document(
+        self, module: Module, open_uris: dict[str, str] | None = None
+    ) -> TextDocument:
+        """
+        Document of a module: the one open in the client, with its unsaved
+        changes and version, or the file on disk. Open documents are looked up
+        by path, as clients may encode their uris differently.
+
+        Args:
+            module (`Module`):
+            open_uris (`dict[str, str] | None`): see `open_document_uris`
+
+        Returns:
+            `TextDocument`:
+        """
+        open_uris = open_uris if open_uris is not None else self.open_document_uris()
+        path = uri_to_path(str(module.url))
+        uri = open_uris.get(path) or from_fs_path(path)
+        return self.workspace.get_text_document(cast(str, uri))
+
+    def document_versions(self) -> dict[str, int | None]:
+        """Versions of the open documents, by path (see `uri_to_path`)"""
+        return {
+            uri_to_path(uri): document.version
+            for uri, document in self.workspace.text_documents.items()
+        }
+
+    def drop_stale_edits(
+        self, versions: dict[str, int | None], document_edits: list[TextDocumentEdit]
+    ) -> bool:
+        """
+        Check whether documents edited by a refactor changed while it ran. The
+        edits are then dropped, the graphs were not updated by the refactor.
+
+        Args:
+            versions (`dict[str, int | None]`): versions of the open documents
+                when the refactor started, see `document_versions`
+            document_edits (`list[TextDocumentEdit]`): edits of the refactor
+
+        Returns:
+            `bool`: whether the edits are stale
+        """
+        current = self.document_versions()
+        paths = [uri_to_path(edit.text_document.uri) for edit in document_edits]
+        if all(current.get(path) == versions.get(path) for path in paths):
+            return False
+        LOGGER.info("Documents changed during the refactor, dropping its edits")
+        return True
 
     def get_ongoing_moves(
         self, file_uri: str
@@ -62,10 +353,10 @@ class RefactorServer(LanguageServer):
         Returns:
             `Generator[tuple[str, MoveSymbolSource], None, None]`:
         """
-        file_uri = file_uri.removeprefix("file://")
-        for workspace, move in self.current_moves.items():
-            if file_uri.startswith(workspace):
-                yield workspace, move
+        for index in self.roots.find(file_uri):
+            move = self.current_moves.get(index.root)
+            if move is not None:
+                yield index.root, move
 
     def add_move(self, file_uri: str, move: MoveSymbolSource):
         """
@@ -75,10 +366,8 @@ class RefactorServer(LanguageServer):
             file_uri (`str`): path to source module
             move (`MoveSymbolSource`): the move object
         """
-        file_uri = file_uri.removeprefix("file://")
-        for workspace in self.configs:
-            if file_uri.startswith(workspace):
-                self.current_moves[workspace] = move
+        for index in self.roots.find(file_uri):
+            self.current_moves[index.root] = move
 
     def del_move(self, file_uri: str) -> None:
         """
@@ -87,66 +376,277 @@ class RefactorServer(LanguageServer):
         Args:
             file_uri (`str`): Path to the source file
         """
-        file_uri = file_uri.removeprefix("file://")
-        for workspace in self.configs:
-            if file_uri.startswith(workspace) and workspace in self.current_moves:
-                del self.current_moves[workspace]
+        for index in self.roots.find(file_uri):
+            self.current_moves.pop(index.root, None)
 
     def build_graph(self, workspace_uri: str) -> None:
         """
-        Build dependency graph of the given folder
+        Start building the dependency graph of the given folder in a worker
+        thread. Progress is reported to the client, and the graph is only
+        used once it is complete. The index of a folder already opened by
+        another session is shared instead.
 
         Args:
             workspace_uri (`str`): path to folder
         """
         if not workspace_uri.startswith("file://"):
             return
-        workspace_uri = workspace_uri.removeprefix("file://")
-        if workspace_uri not in self.configs:
-            config = get_project_config(workspace_uri)
-            self.configs[workspace_uri] = config
-            self.dependency_graphs[workspace_uri] = build_project_graph(config)
+        workspace_uri = uri_to_path(workspace_uri)
+        if workspace_uri in self.workspaces:
+            return
+        index, created = self.registry.acquire(workspace_uri, self)
+        self.workspaces[workspace_uri] = index
+        self.roots[workspace_uri] = index
+        if index.progress is None:
+            self._graph_ready(workspace_uri)
+            return
+        config = index.config
+        self.indexing_tokens[workspace_uri] = self.begin_progress(
+            f"Indexing {config.project_name}"
+        )
+        if created:
+            self._start_build(index)
+
+    def _start_build(self, index: WorkspaceIndex) -> None:
+        """Build the graph of an index in the worker threads of the session"""
+        config = index.config
+        reported_percentage = -1
+
+        def progress(done: int, total: int) -> None:
+            # called from the worker thread, for every file
+            nonlocal reported_percentage
+            percentage = done * 100 // total if total else 100
+            if percentage != reported_percentage:
+                reported_percentage = percentage
+                self.loop.call_soon_threadsafe(_report_indexing, index, done, total)
+
+        future = self.thread_pool_executor.submit(
+            build_project_graph, config, config.cache, progress
+        )
+
+        def done(future: Future[Graph]) -> None:
+            self.loop.call_soon_threadsafe(_finish_build, index, future)
+
+        future.add_done_callback(done)
+
+    def _graph_ready(self, workspace_uri: str) -> None:
+        index = self.workspaces[workspace_uri]
+        token = self.indexing_tokens.pop(workspace_uri, None)
+        if index.graph is None:
+            self.end_progress(token, "Indexing failed")
+            return
+        self.end_progress(token, f"{len(index.graph.nodes)} modules")
+        # edits and file changes received while indexing
+        for file_uri in list(self.workspace.text_documents):
+            if index in self.roots.find(file_uri):
+                self.update_file_deps(file_uri)
+        if self.changed_files:
+            self.schedule_files_update([])
+
+    def get_indexing_state(self, file_uri: str) -> tuple[int, int] | None:
+        """
+        Indexing progress of the workspace of a file.
+
+        Args:
+            file_uri (`str`): path to module
+
+        Returns:
+            `tuple[int, int] | None`: indexed and total number of files, None
+                if no workspace of the file is being indexed
+        """
+        for index in self.roots.find(file_uri):
+            if index.progress is not None:
+                return index.progress
+        return None
+
+    def begin_progress(self, title: str) -> str | None:
+        """
+        Create a work done progress, if the client supports it.
+
+        Args:
+            title (`str`): title shown by the client
+
+        Returns:
+            `str | None`: progress token
+        """
+        capabilities = self.client_capabilities.window
+        if capabilities is None or not capabilities.work_done_progress:
+            return None
+        token = str(uuid.uuid4())
+
+        def begin(*args) -> None:
+            self.progress.begin(token, WorkDoneProgressBegin(title=title, percentage=0))
+
+        self.progress.create(token, begin)
+        return token
+
+    def report_progress(self, token: str | None, message: str, percentage: int) -> None:
+        # tokens are registered once the client acknowledged them
+        if token is not None and token in self.progress.tokens:
+            self.progress.report(
+                token, WorkDoneProgressReport(message=message, percentage=percentage)
+            )
+
+    def end_progress(self, token: str | None, message: str) -> None:
+        if token is not None and token in self.progress.tokens:
+            self.progress.end(token, WorkDoneProgressEnd(message=message))
 
     def update_file_deps(self, file_uri: str) -> None:
         """
-        Update the dependencies of a given file
+        Update the dependencies of a given file now, without waiting for
+        `Config.reindex_delay`. Parsing happens in a worker thread.
 
         Args:
             file_uri (`str`): path to module
         """
-        if not file_uri.endswith(".py"):
+        self.cancel_file_update(file_uri)
+        self._start_file_update(file_uri)
+
+    def schedule_file_update(self, file_uri: str) -> None:
+        """
+        Update the dependencies of a given file once it has not been edited for
+        `Config.reindex_delay` seconds. Parsing happens in a worker thread.
+
+        Args:
+            file_uri (`str`): path to module
+        """
+        delays = [
+            self.configs[workspace].reindex_delay
+            for workspace, _, _ in self.get_mods(file_uri)
+        ]
+        if not delays:
             return
-        if not file_uri.startswith("file://"):
+        self.cancel_file_update(file_uri)
+        self.pending_updates[file_uri] = self.loop.call_later(
+            min(delays), self._start_file_update, file_uri
+        )
+
+    def cancel_file_update(self, file_uri: str) -> None:
+        handle = self.pending_updates.pop(file_uri, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _start_file_update(self, file_uri: str) -> None:
+        self.pending_updates.pop(file_uri, None)
+        document = self.workspace.get_text_document(file_uri)
+        source = document.source
+        if self.indexed_hashes.get(file_uri) == hash_text(source):
             return
-        file_uri = file_uri.removeprefix("file://")
-        cst: None | libcst.Module = None
-        for workspace_uri, graph in self.dependency_graphs.items():
-            if not file_uri.startswith(workspace_uri):
-                continue
-            file_package = (
-                file_uri.removeprefix(workspace_uri)
-                .removeprefix("/")
-                .removesuffix(".py")
-                .replace("/", ".")
+        version = document.version
+        future = self.thread_pool_executor.submit(index_source, source)
+
+        def done(future: Future[SourceIndex | None]) -> None:
+            self.loop.call_soon_threadsafe(
+                self._finish_file_update, file_uri, version, future
             )
-            for mod in graph.nodes:
-                if mod.full_mod_name == file_package:
-                    if cst is None:
-                        cst = libcst.parse_module(
-                            self.workspace.get_document(file_uri).source
-                        )
-                    mod.cst = cst.deep_clone()
-                    graph.reset_dependencies(mod)
-                    dependencies = get_module_dependencies(graph, mod)
-                    for dependency in dependencies:
-                        graph.add_edge((mod, dependency))
+
+        future.add_done_callback(done)
+
+    def _finish_file_update(
+        self, file_uri: str, version: int | None, future: Future[SourceIndex | None]
+    ) -> None:
+        if self.workspace.get_text_document(file_uri).version != version:
+            # the document changed again, a newer update is scheduled
+            return
+        try:
+            index = future.result()
+        except (ValueError, RecursionError):
+            # null bytes, or code nested too deeply for ast
+            LOGGER.exception("Could not index %s", file_uri)
+            # indexed again on the next update, whatever its content
+            self.indexed_hashes.pop(file_uri, None)
+            return
+        # the dependencies of invalid code are kept until it can be parsed
+        if index is not None:
+            self.apply_source_index(file_uri, index)
+
+    def apply_source_index(self, file_uri: str, index: SourceIndex) -> None:
+        """
+        Replace the text and outgoing edges of a module in every graph it is
+        part of. Other modules are not rescanned. While a refactor runs, the
+        update is deferred until it finishes.
+
+        Args:
+            file_uri (`str`): path to module
+            index (`SourceIndex`): new source of the module and its imports
+        """
+        if self.refactor_lock.locked():
+            self.deferred_indexes[file_uri] = index
+            return
+        for _, graph, mod in self.get_mods(file_uri):
+            mod.text = index.text
+            mod.definitions = index.definitions
+            mod.spans = index.spans
+            update_module_dependencies(graph, mod, index.imports)
+        self.indexed_hashes[file_uri] = index.sha256
+
+    def schedule_files_update(self, file_uris: Sequence[str]) -> None:
+        """
+        Apply created, changed and deleted files to the graphs. Changes are
+        batched until none happens for `Config.reindex_delay` seconds, since
+        operations like a `git checkout` are reported over many notifications.
+
+        Args:
+            file_uris (`Sequence[str]`): changed files
+        """
+        self.changed_files.update(file_uris)
+        if not self.configs:
+            return
+        if self.files_update is not None:
+            self.files_update.cancel()
+        delay = min(config.reindex_delay for config in self.configs.values())
+        self.files_update = self.loop.call_later(delay, self.update_files)
+
+    def update_files(self) -> None:
+        """Apply the file changes batched by `schedule_files_update`"""
+        self.files_update = None
+        if self.refactor_lock.locked():
+            # applied once the refactor finishes
+            return
+        paths: list[Path] = []
+        pending: set[str] = set()
+        open_uris: dict[Path, str] = {}
+        for file_uri in sorted(self.changed_files):
+            if self.get_indexing_state(file_uri) is not None:
+                # applied once the graph is built
+                pending.add(file_uri)
+                continue
+            self.indexed_hashes.pop(file_uri, None)
+            path = Path(uri_to_path(file_uri))
+            if file_uri in self.workspace.text_documents and path.is_file():
+                open_uris[path] = file_uri
+            paths.append(path)
+        self.changed_files = pending
+        for workspace_uri, graph in self.dependency_graphs.items():
+            # the dependencies of open documents follow their unsaved content,
+            # only the ones which are not modules of the graph yet are added
+            workspace_paths = [
+                path
+                for path in paths
+                if path.is_relative_to(workspace_uri)
+                and (path not in open_uris or graph.node_from_file(path) is None)
+            ]
+            if workspace_paths:
+                updated = update_project_files(
+                    graph, self.configs[workspace_uri], workspace_paths
+                )
+                LOGGER.debug(
+                    "%d files changed, %d modules updated",
+                    len(workspace_paths),
+                    len(updated),
+                )
+        # modules added from the files of open documents follow their content
+        for file_uri in open_uris.values():
+            self.update_file_deps(file_uri)
 
     def get_mods(
         self, file_uri: str
     ) -> Generator[tuple[str, Graph, Module], None, None]:
         """
         Yields the dependency graph and module dataclass of the given module
-        uri for each registered dependency graph the module is part of.
+        uri for each registered dependency graph the module is part of. The
+        lookup only depends on the depth of the path, not on the number of
+        workspaces and modules.
 
         Args:
             file_uri (`str`): module path
@@ -158,76 +658,150 @@ class RefactorServer(LanguageServer):
             return None
         if not file_uri.startswith("file://"):
             return None
-        file_uri = file_uri.removeprefix("file://")
-        for workspace_uri, graph in self.dependency_graphs.items():
-            if not file_uri.startswith(workspace_uri):
+        path = uri_to_path(file_uri)
+        for index in self.roots.find(path):
+            if index.graph is None:
                 continue
-            file_package = (
-                file_uri.removeprefix(workspace_uri)
-                .removeprefix("/")
-                .removesuffix(".py")
-                .replace("/", ".")
-            )
-            for mod in graph.nodes:
-                if mod.full_mod_name == file_package:
-                    yield (workspace_uri, graph, mod)
-                    break
+            mod = index.graph.node_from_file(path)
+            if mod is not None:
+                yield (index.root, index.graph, mod)
+
+
+_FEATURES: list[tuple[str, object, Callable]] = []
+_COMMANDS: list[tuple[str, Callable]] = []
+
+
+def feature(name: str, options: object = None) -> Callable[[F], F]:
+    """Register an LSP feature on every session server, see `create_server`"""
 
+    def decorator(handler: F) -> F:
+        _FEATURES.append((name, options, handler))
+        return handler
 
-server = RefactorServer(f"v{__version__}")
+    return decorator
 
 
-@server.feature(INITIALIZED)
-def did_initialized(ls: LanguageServer, params: InitializedParams):
+def command(name: str) -> Callable[[F], F]:
+    """Register a command on every session server, see `create_server`"""
+
+    def decorator(handler: F) -> F:
+        _COMMANDS.append((name, handler))
+        return handler
+
+    return decorator
+
+
+@feature(INITIALIZED)
+def did_initialized(ls: RefactorServer, params: InitializedParams):
     LOGGER.debug("Did initialized: %s", params)
     for folder in ls.workspace.folders:
-        server.build_graph(folder)
+        ls.build_graph(folder)
+    capabilities = ls.client_capabilities.workspace
+    if (
+        capabilities is not None
+        and capabilities.did_change_watched_files is not None
+        and capabilities.did_change_watched_files.dynamic_registration
+    ):
+        ls.register_capability(
+            RegistrationParams(
+                registrations=[
+                    Registration(
+                        id="pyrefactorlsp-watched-files",
+                        method=WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                        register_options=DidChangeWatchedFilesRegistrationOptions(
+                            watchers=[FileSystemWatcher(glob_pattern="**/*.py")]
+                        ),
+                    )
+                ]
+            )
+        )
 
 
-@server.feature(TEXT_DOCUMENT_DID_SAVE)
-def did_save(ls: LanguageServer, params: DidSaveTextDocumentParams):
+@feature(TEXT_DOCUMENT_DID_CHANGE)
+def did_change(ls: RefactorServer, params: DidChangeTextDocumentParams):
+    """Text document did change notification."""
+    ls.schedule_file_update(params.text_document.uri)
+
+
+@feature(TEXT_DOCUMENT_DID_SAVE)
+def did_save(ls: RefactorServer, params: DidSaveTextDocumentParams):
     """Text document did save notification."""
     LOGGER.debug("TEXT_DOCUMENT_DID_SAVE: %s", params)
-    server.update_file_deps(params.text_document.uri)
+    ls.update_file_deps(params.text_document.uri)
+
 
+@feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
+def did_change_watched_files(ls: RefactorServer, params: DidChangeWatchedFilesParams):
+    """Files created, changed or deleted outside of the editor."""
+    LOGGER.debug("WORKSPACE_DID_CHANGE_WATCHED_FILES: %s", params)
+    ls.schedule_files_update([change.uri for change in params.changes])
 
-@server.feature(
+
+@feature(
     TEXT_DOCUMENT_CODE_ACTION,
-    CodeActionOptions(code_action_kinds=[CodeActionKind.Refactor]),
+    CodeActionOptions(
+        code_action_kinds=[CodeActionKind.Refactor], resolve_provider=True
+    ),
 )
-def code_actions(params: CodeActionParams) -> list[CodeAction]:
+def code_actions(ls: RefactorServer, params: CodeActionParams) -> list[CodeAction]:
     LOGGER.debug("TEXT_DOCUMENT_CODE_ACTION: %s", params)
-    for _ in server.get_mods(params.text_document.uri):
-        actions = [
+    indexing_state = ls.get_indexing_state(params.text_document.uri)
+    if indexing_state is not None:
+        done, total = indexing_state
+        reason = "Indexing the workspace"
+        if total:
+            reason += f" ({done}/{total} files)"
+        return [
             CodeAction(
                 title="Move symbol",
                 kind="refactor.move",
-                command=Command(
-                    title="Start moving symbol",
-                    command="codeAction.moveSymbol",
-                    arguments=[params.text_document.uri, params.range],
-                ),
-            ),
+                disabled=CodeActionDisabledType(reason=reason),
+            )
         ]
-        for _, move in server.get_ongoing_moves(params.text_document.uri):
+    uri = params.text_document.uri
+    for _, _, mod in ls.get_mods(uri):
+        actions = []
+        span = mod.definition_at(params.range.start.line + 1)
+        if span is not None:
             actions.append(
                 CodeAction(
-                    title=f"Finish moving {move.symbol_name} here",
+                    title=f"Move {span.name}",
                     kind="refactor.move",
                     command=Command(
-                        title="Finish moving symbol",
-                        command="codeAction.finishMoveSymbol",
+                        title="Start moving symbol",
+                        command="codeAction.moveSymbol",
                         arguments=[params.text_document.uri, params.range],
                     ),
                 )
             )
+        for _, move in ls.get_ongoing_moves(uri):
+            action = CodeAction(
+                title=f"Finish moving {move.symbol_name} here",
+                kind="refactor.move",
+            )
+            if ls.can_resolve_edits():
+                # the edit is computed when the action is chosen, see
+                # `resolve_code_action`
+                action.data = {
+                    "uri": uri,
+                    "version": ls.workspace.get_text_document(uri).version,
+                    "move": id(move),
+                    "line": params.range.start.line,
+                }
+            else:
+                action.command = Command(
+                    title="Finish moving symbol",
+                    command="codeAction.finishMoveSymbol",
+                    arguments=[uri, params.range],
+                )
+            actions.append(action)
             break
         return actions
     return []
 
 
-@server.command("codeAction.test")
-def test_edits(ls: LanguageServer, arguments):
+@command("codeAction.test")
+def test_edits(ls: RefactorServer, arguments):
     document = ls.workspace.get_text_document(arguments[0])
     edit = TextDocumentEdit(
         text_document=OptionalVersionedTextDocumentIdentifier(
@@ -253,91 +827,296 @@ def test_edits(ls: LanguageServer, arguments):
     ls.apply_edit(WorkspaceEdit(document_changes=[edit]))
 
 
-@server.command("codeAction.moveSymbol")
-def move_symbol_command(ls: LanguageServer, args):
+@command("codeAction.moveSymbol")
+async def move_symbol_command(ls: RefactorServer, args):
     uri = cast(str, args[0])
     location = cast(
         dict[Literal["start", "end"], dict[Literal["line", "character"], int]], args[1]
     )
     LOGGER.debug("codeAction.moveSymbol: %s", args)
-    for _, _, mod in server.get_mods(uri):
-        move_source = move_symbol_source(
-            mod, location["start"]["line"] + 1, location["start"]["character"]
+
+    def start_moves(token: CancellationToken) -> list[MoveSymbolSource]:
+        moves = []
+        for _, _, mod in ls.get_mods(uri):
+            token.check()
+            moves.append(
+                move_symbol_source(
+                    mod, location["start"]["line"] + 1, location["start"]["character"]
+                )
+            )
+        return moves
+
+    for move_source in await ls.run_refactor(uri, start_moves) or []:
+        LOGGER.debug("Moving %s from %s", move_source.symbol_name, uri)
+        ls.add_move(uri, move_source)
+
+
+def finish_move(
+    ls: RefactorServer,
+    uri: str,
+    line: int,
+    token: CancellationToken,
+    moves: Sequence[MoveSymbolSource] | None = None,
+) -> tuple[list[TextDocumentEdit], PlannedMoves]:
+    """
+    Plan the ongoing moves to a module, and compute the edits of the updated
+    documents. The graphs and syntax trees are left unchanged: the planned
+    moves are applied once the client applied the edits, see `apply_moves`.
+    Runs in a worker thread, see `RefactorServer.run_refactor`.
+
+    Args:
+        ls (`LanguageServer`):
+        uri (`str`): target module
+        line (`int`): line to move the symbol to, starting at 0
+        token (`CancellationToken`): checked between modules
+        moves (`Sequence[MoveSymbolSource] | None`): moves to finish, all
+            the ongoing ones by default
+
+    Returns:
+        `tuple[list[TextDocumentEdit], PlannedMoves]`: edits, and the moves
+            to apply with the graphs they were planned with
+    """
+    document_edits: list[TextDocumentEdit] = []
+    planned_moves: PlannedMoves = []
+    open_uris = ls.open_document_uris()
+    mods = {workspace: (graph, mod) for workspace, graph, mod in ls.get_mods(uri)}
+    for workspace, move in ls.get_ongoing_moves(uri):
+        if workspace not in mods:
+            continue
+        if moves is not None and all(move is not other for other in moves):
+            continue
+        graph, mod = mods[workspace]
+        config = ls.configs[workspace]
+        planned_move = plan_move_symbol_target(
+            graph, mod, move, line + 1, config.workers, token
         )
-        print(uri, move_source.symbol_name)
-        server.add_move(uri, move_source)
+        if planned_move is None:
+            continue
+        planned_moves.append((graph, planned_move))
+        encoding = ls.workspace.position_encoding or "utf-16"
+        formatted: dict[str, str] = {}
+        if config.format_edits == "full":
+            format_cache = ls.format_caches[workspace]
+            formatted = reformat_modules(planned_move.codes, config.root, format_cache)
+            LOGGER.debug(
+                "Format cache: %d hits, %d misses",
+                format_cache.hits,
+                format_cache.misses,
+            )
+        for module, tree in planned_move.trees:
+            # the edits of the modules are only sent once all are computed
+            token.check()
+            document = ls.get_module_document(module, open_uris)
+            if config.format_edits == "none":
+                blocks = get_module_edits(
+                    module, document.source, config.diff_max_cost, tree
+                )
+                edits = blocks_to_text_edits(document.source, blocks, encoding)
+            elif config.format_edits == "range":
+                blocks = get_module_edits(
+                    module, document.source, config.diff_max_cost, tree
+                )
+                updated_code = reformat_ranges(
+                    module.full_mod_name,
+                    apply_edit_blocks(document.source, blocks),
+                    replaced_spans(blocks),
+                    config.root,
+                )
+                edits = get_text_edits(
+                    document.source, updated_code, encoding, config.diff_max_cost
+                )
+            else:
+                edits = get_text_edits(
+                    document.source,
+                    formatted[module.full_mod_name],
+                    encoding,
+                    config.diff_max_cost,
+                )
+            document_edits.append(
+                TextDocumentEdit(
+                    text_document=OptionalVersionedTextDocumentIdentifier(
+                        uri=document.uri, version=document.version
+                    ),
+                    edits=edits,
+                )
+            )
+    return document_edits, planned_moves
 
 
-@dataclass
-class ProcessOutput:
-    stdout: str
-    stderr: str
-    statuscode: int
+def apply_moves(planned_moves: PlannedMoves, token: CancellationToken) -> None:
+    """
+    Apply moves planned by `finish_move` to the trees and graphs, once the
+    client applied their edits. Runs in a worker thread, see
+    `RefactorServer.run_refactor`, so that no other refactor reads the graphs
+    meanwhile.
 
+    Args:
+        planned_moves (`PlannedMoves`):
+        token (`CancellationToken`): unused, applying a move is not cancelled
+    """
+    for graph, planned_move in planned_moves:
+        apply_move_symbol_target(graph, planned_move)
 
-def execute_ruff(args: Sequence[str], source: str) -> ProcessOutput:
-    process = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (out, err) = process.communicate(bytes(source, encoding="utf-8"))
-    code = process.wait()
-    return ProcessOutput(
-        statuscode=code, stdout=bytes.decode(out), stderr=bytes.decode(err)
-    )
 
+def workspace_edit(
+    ls: RefactorServer, document_edits: list[TextDocumentEdit]
+) -> WorkspaceEdit:
+    """
+    Single edit of all the updated documents of a refactor, so that the client
+    applies it in one round trip. Clients which do not support
+    `documentChanges` get the edits by uri, without the document versions.
 
-def reformat_code(document_uri: str, source: str) -> str:
-    # ruff check --stdin-filename "azsqdf.py" --fix --fix-only --select I --quiet
-    # ruff format --stdin-filename "azsqdf.py"
-    reformat_out = execute_ruff(
-        [
-            "ruff",
-            "format",
-            "--stdin-filename",
-            document_uri,
-        ],
-        source,
-    )
-    return execute_ruff(
-        [
-            "ruff",
-            "check",
-            "--fix-only",
-            "--quiet",
-            "--select",
-            "I",
-            "--stdin-filename",
-            document_uri,
-        ],
-        reformat_out.stdout,
-    ).stdout
+    Args:
+        ls (`LanguageServer`):
+        document_edits (`list[TextDocumentEdit]`):
+
+    Returns:
+        `WorkspaceEdit`:
+    """
+    workspace = ls.client_capabilities.workspace
+    capabilities = workspace.workspace_edit if workspace is not None else None
+    if capabilities is not None and capabilities.document_changes is False:
+        return WorkspaceEdit(
+            changes={
+                edit.text_document.uri: list(edit.edits) for edit in document_edits
+            }
+        )
+    return WorkspaceEdit(document_changes=document_edits)
 
 
-@server.command("codeAction.finishMoveSymbol")
-def finish_move_symbol_command(ls: LanguageServer, args):
+@command("codeAction.finishMoveSymbol")
+async def finish_move_symbol_command(ls: RefactorServer, args):
     uri = cast(str, args[0])
     location = cast(
         dict[Literal["start", "end"], dict[Literal["line", "character"], int]], args[1]
     )
     LOGGER.debug("codeAction.finishMoveSymbol: %s", args)
-    mods = {workspace: (graph, mod) for workspace, graph, mod in server.get_mods(uri)}
-    for workspace, move in server.get_ongoing_moves(uri):
-        if workspace not in mods:
+    start = time.perf_counter()
+    versions = ls.document_versions()
+    result = await ls.run_refactor(
+        uri, partial(finish_move, ls, uri, location["start"]["line"])
+    )
+    computed = time.perf_counter()
+    if result is None:
+        return None
+    document_edits, planned_moves = result
+    if not document_edits or ls.drop_stale_edits(versions, document_edits):
+        return None
+    response = await ls.apply_edit_async(
+        workspace_edit(ls, document_edits), label="Move symbol"
+    )
+    applied = time.perf_counter()
+    if response.applied:
+        await ls.run_refactor(uri, partial(apply_moves, planned_moves))
+        ls.del_move(uri)
+    message = (
+        f"Moved symbol: {len(document_edits)} modules edited, computed in "
+        f"{computed - start:.3f}s, applied by the client in {applied - computed:.3f}s"
+    )
+    if not response.applied:
+        message = f"Client did not apply the move: {response.failure_reason}"
+    LOGGER.info(message)
+    ls.show_message_log(message)
+    return {
+        "applied": response.applied,
+        "modules": len(document_edits),
+        "compute_seconds": computed - start,
+        "apply_seconds": applied - computed,
+    }
+
+
+@feature(CODE_ACTION_RESOLVE)
+async def resolve_code_action(ls: RefactorServer, action: CodeAction) -> CodeAction:
+    """
+    Compute the edit of a "Finish moving" action chosen by the client. Edits
+    are memoized per document version, move and line, as clients may resolve
+    an action to preview it, then again to apply it.
+
+    The edit is computed without updating the graphs, and the move is over
+    once resolved. The client applies the edit itself, and the edited modules
+    are indexed again from the changes it then notifies.
+    """
+    LOGGER.debug("CODE_ACTION_RESOLVE: %s", action)
+    data = action.data
+    if not isinstance(data, dict) or "line" not in data:
+        return action
+    uri = data["uri"]
+    versions = ls.document_versions()
+    if versions.get(uri_to_path(uri)) != data["version"]:
+        # the action was computed for an older version of the document
+        return action
+    key = (uri, data["version"], data["move"], data["line"])
+    if key in ls.resolved_edits:
+        action.edit = ls.resolved_edits[key][1]
+        return action
+    for _, move in ls.get_ongoing_moves(uri):
+        if id(move) != data["move"]:
             continue
-        graph, mod = mods[workspace]
-        updated_mods = move_symbol_target(
-            graph, mod, move, location["start"]["line"] + 1
+        result = await ls.run_refactor(
+            uri, partial(finish_move, ls, uri, data["line"], moves=[move])
         )
-        for mod in updated_mods:
-            updated_code = reformat_code(mod.full_mod_name, mod.cst.code)
-            # updated_code = mod.cst.code
-            document = ls.workspace.get_text_document(str(mod.url.resolve()))
-            edits = get_text_edits(document.source, updated_code)
-            edit = TextDocumentEdit(
-                text_document=OptionalVersionedTextDocumentIdentifier(
-                    uri=f"file://{document.uri}", version=document.version
-                ),
-                edits=edits,
-            )
-            ls.apply_edit(WorkspaceEdit(document_changes=[edit]))
+        if result is None or ls.drop_stale_edits(versions, result[0]):
+            return action
+        ls.del_move(uri)
+        action.edit = workspace_edit(ls, result[0])
+        ls.resolved_edits[key] = (move, action.edit)
+        while len(ls.resolved_edits) > MAX_RESOLVED_EDITS:
+            ls.resolved_edits.popitem(last=False)
+        break
+    return action
+
+
+def create_server(
+    registry: IndexRegistry | None = None,
+    loop: asyncio.AbstractEventLoop | None = None,
+    protocol_cls: type[LanguageServerProtocol] = LanguageServerProtocol,
+) -> RefactorServer:
+    """
+    Server of a client session, with all the features and commands registered.
+
+    Args:
+        registry (`IndexRegistry | None`): indexes shared with other sessions
+        loop (`asyncio.AbstractEventLoop | None`): event loop of the process
+        protocol_cls (`type[LanguageServerProtocol]`):
+
+    Returns:
+        `RefactorServer`:
+    """
+    ls = RefactorServer(f"v{__version__}", registry, loop, protocol_cls)
+    for name, options, handler in _FEATURES:
+        ls.feature(name, options)(handler)
+    for name, handler in _COMMANDS:
+        ls.command(name)(handler)
+    return ls
+
+
+def start_shared_server(host: str, port: int) -> None:
+    """
+    Serve every client connecting to a TCP port from one process. Each
+    connection gets its own session server, and the sessions share the
+    indexes of their workspaces.
+
+    Args:
+        host (`str`):
+        port (`int`):
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    registry = IndexRegistry()
+
+    def connect() -> LanguageServerProtocol:
+        LOGGER.info("Client connected")
+        return create_server(registry, loop, SessionProtocol).lsp
+
+    tcp_server = loop.run_until_complete(loop.create_server(connect, host, port))
+    try:
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        tcp_server.close()
+        loop.run_until_complete(tcp_server.wait_closed())
+        loop.close()
 
 
 @click.command("serve")
@@ -345,4 +1124,21 @@ def serve():
     config = load_config()
 
     print(f"Start server at {config.server_url}:{config.server_port}")
-    server.start_tcp(config.server_url, config.server_port)
+    start_shared_server(config.server_url, config.server_port)
+
+
+@click.command("attach")
+def attach():
+    """
+    Talk LSP over stdio through the server listening on the configured port,
+    so that all editors share its indexes. Without a server, the client is
+    served by this process.
+    """
+    config = load_config()
+    try:
+        connection = socket.create_connection((config.server_url, config.server_port))
+    except OSError:
+        LOGGER.info("No server at %s:%s", config.server_url, config.server_port)
+        create_server().start_io()
+        return
+    proxy_stdio(connection)
@@ -4,9 +4,7 @@ import libcst
 from libcst import (
     Attribute,
     ClassDef,
-    CSTTransformer,
     FunctionDef,
-    MetadataWrapper,
     Name,
     RemovalSentinel,
     RemoveFromParent,
@@ -16,6 +14,7 @@ from libcst.metadata import CodeRange, PositionProvider, QualifiedNameSource
 from libcst.metadata.name_provider import QualifiedNameProvider
 
 from pyrefactorlsp.refactor.module import Module
+from pyrefactorlsp.refactor.transformer import KeepUnchangedTransformer
 
 
 def get_attr_base(node: Attribute) -> str:
@@ -32,10 +31,11 @@ class ImportPath:
     alias: str | None = None
 
 
-class RemoveSymbolFromSource(CSTTransformer):
+class RemoveSymbolFromSource(KeepUnchangedTransformer):
     METADATA_DEPENDENCIES = (PositionProvider, QualifiedNameProvider)
 
     def __init__(self, lineno: int, colno: int):
+        super().__init__()
         self.lineno = lineno
         self.colno = colno
 
@@ -186,19 +186,30 @@ def move_symbol_source(source: Module, line: int, col: int) -> MoveSymbolSource:
     * Removes it from the module
     * Gets imports that will need to be added in the target file.
 
+    The symbol is the top-level function or class containing the line, looked
+    up in `Module.spans`. The module is not traversed when there is none.
+
     Args:
         source (`Module`): source file
         line (`int`): line number of the symbol to move
-        col (`int`): col numner of the symbol to move
+        col (`int`): column of the cursor, any column of the definition selects it
     Returns:
         `MoveSymbolSource`: metadata of the current move. Note that nothing is
         actually saved at this point.
     """
-    wrapper = MetadataWrapper(source.cst)
-    symbol_remover = RemoveSymbolFromSource(line, col)
-    updated_source = wrapper.visit(symbol_remover)
+    span = source.definition_at(line)
+    if span is None:
+        return MoveSymbolSource(
+            needed_imports=frozenset(),
+            symbol=None,
+            symbol_name=None,
+            updated_source=source.cst,
+            source_mod=source,
+        )
+    # top-level definitions start at the first column of their keyword line
+    symbol_remover = RemoveSymbolFromSource(span.line, 0)
+    updated_source = source.metadata.visit(symbol_remover)
     local_mod = f"{source.package}.{source.name}"
-    print(symbol_remover.needed_imports)
 
     needed_imports = frozenset(
         {
@@ -1,13 +1,19 @@
+import multiprocessing
+import threading
 from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from typing import Union
 
+import libcst
 import libcst.matchers as m
 from libcst import (
     AsName,
     Attribute,
     BaseCompoundStatement,
     ClassDef,
-    CSTTransformer,
+    Dot,
     FunctionDef,
     Import,
     ImportAlias,
@@ -33,9 +39,12 @@ from pyrefactorlsp.refactor.actions.move_symbol_source import (
     ImportPath,
     MoveSymbolSource,
 )
-from pyrefactorlsp.refactor.graph import Graph
+from pyrefactorlsp.refactor.cancel import CancellationToken
+from pyrefactorlsp.refactor.graph import Graph, move_symbol_imports
 from pyrefactorlsp.refactor.imports import get_module_name
+from pyrefactorlsp.refactor.index import resolve_workers
 from pyrefactorlsp.refactor.module import Module
+from pyrefactorlsp.refactor.transformer import KeepUnchangedTransformer
 
 
 def seq_to_attr(name: Sequence[str]) -> Attribute | Name:
@@ -51,7 +60,9 @@ def seq_to_attr(name: Sequence[str]) -> Attribute | Name:
     head, tail = name[:-1], name[-1]
     if not len(head):
         return Name(tail)
-    return Attribute(seq_to_attr(head), Name(tail))
+    # the default `dot` is a single node shared by all attributes, see
+    # `KeepUnchangedTransformer`
+    return Attribute(seq_to_attr(head), Name(tail), dot=Dot())
 
 
 def seq_to_attr_matcher(name: Sequence[str]) -> Union[m.Attribute, m.Name]:
@@ -65,13 +76,13 @@ def join_attrs(x: Attribute | Name | None, y: Attribute | Name) -> Attribute | N
     if x is None:
         return y
     if isinstance(y, Name):
-        return Attribute(x, y)
+        return Attribute(x, y, dot=Dot())
     if isinstance(y.value, (Attribute, Name)):
-        return Attribute(join_attrs(x, y.value), y.attr)
+        return Attribute(join_attrs(x, y.value), y.attr, dot=Dot())
     raise ValueError("Can't join attrs for given inputs")
 
 
-class ReplaceImports(CSTTransformer):
+class ReplaceImports(KeepUnchangedTransformer):
     METADATA_DEPENDENCIES = (QualifiedNameProvider,)
 
     def __init__(
@@ -80,6 +91,7 @@ class ReplaceImports(CSTTransformer):
         add_imports: Iterable[ImportPath] | None = None,
         remove_imports: Iterable[str] | None = None,
     ):
+        super().__init__()
         self.imported_symbols: set[str] = set()
 
         self._replace_import_map = replace_imports
@@ -195,18 +207,22 @@ class ReplaceImports(CSTTransformer):
                         if not m.matches(import_alias.name, m.Name(value=obj)):
                             import_aliases.append(import_alias)
                             import_names.append(get_module_name(import_alias.name))
-                    self._imports_to_add[frozenset(import_names)] = node.with_changes(
-                        names=import_aliases
-                    )
-                    import_alias = [
+                    if len(import_aliases):
+                        import_aliases[-1] = import_aliases[-1].with_changes(
+                            comma=MaybeSentinel.DEFAULT
+                        )
+                        self._imports_to_add[frozenset(import_names)] = (
+                            node.with_changes(names=import_aliases)
+                        )
+                    moved_aliases = [
                         import_alias.with_changes(comma=MaybeSentinel.DEFAULT)
                         for import_alias in node.names
                         if m.matches(import_alias.name, m.Name(value=obj))
                     ]
-                    if len(import_alias):
+                    if len(moved_aliases):
                         self._imports_to_add[frozenset([obj])] = ImportFrom(
                             module=attr_to,
-                            names=import_aliases,
+                            names=moved_aliases,
                         )
                 else:
                     self._imports_to_add[frozenset([obj])] = ImportFrom(
@@ -240,12 +256,13 @@ class ReplaceImports(CSTTransformer):
         return updated_node.with_changes(body=new_body)
 
 
-class AddSymbol(CSTTransformer):
+class AddSymbol(KeepUnchangedTransformer):
     METADATA_DEPENDENCIES = (PositionProvider,)
 
     def __init__(
         self, lineno: int, symbol: FunctionDef | ClassDef | SimpleStatementLine
     ):
+        super().__init__()
         self.lineno = lineno
 
         self.symbol = symbol
@@ -269,7 +286,6 @@ class AddSymbol(CSTTransformer):
         is_added = False
         for line in updated_node.body:
             if not is_added and self._is_after(line):
-                print("ADDDDING!!!")
                 new_body.append(self.symbol)
                 is_added = True
             new_body.append(line)
@@ -279,50 +295,274 @@ class AddSymbol(CSTTransformer):
         return updated_node.with_changes(body=new_body)
 
 
-def move_symbol_target(
+PARALLEL_REWRITE_MIN_MODULES = 32
+"""Number of modules to rewrite above which the process pool is used"""
+
+_rewrite_executor: ProcessPoolExecutor | None = None
+_rewrite_workers = 0
+_rewrite_executor_lock = threading.Lock()
+
+
+def get_rewrite_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool rewriting the users of moved symbols. It is started on first
+    use and kept for the next moves, unless the number of workers changes.
+
+    Args:
+        workers (`int`): number of processes
+
+    Returns:
+        `ProcessPoolExecutor`:
+    """
+    global _rewrite_executor, _rewrite_workers
+    with _rewrite_executor_lock:
+        if _rewrite_executor is None or _rewrite_workers != workers:
+            if _rewrite_executor is not None:
+                _rewrite_executor.shutdown(wait=False, cancel_futures=True)
+            # spawn: the server is multi-threaded and forking it is not safe
+            context = multiprocessing.get_context("spawn")
+            _rewrite_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context
+            )
+            _rewrite_workers = workers
+        return _rewrite_executor
+
+
+def _drop_rewrite_executor(executor: ProcessPoolExecutor) -> None:
+    global _rewrite_executor
+    with _rewrite_executor_lock:
+        if _rewrite_executor is executor:
+            _rewrite_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _replace_imports_in_code(
+    codes: list[str], source_name: str, target_name: str
+) -> list[str]:
+    rewritten: list[str] = []
+    for code in codes:
+        wrapper = MetadataWrapper(libcst.parse_module(code), unsafe_skip_copy=True)
+        rewritten.append(wrapper.visit(ReplaceImports({source_name: target_name})).code)
+    return rewritten
+
+
+def replace_imports_in_modules(
+    modules: Sequence[Module],
+    source_name: str,
+    target_name: str,
+    workers: int = 1,
+    token: CancellationToken | None = None,
+) -> list[CSTModule | str]:
+    """
+    Rewrite the trees of modules to import a symbol from its new location.
+    The modules themselves are left unchanged.
+
+    With more than one worker and enough modules, the modules are rewritten in
+    a process pool (see `get_rewrite_executor`): their code is sent to the
+    workers, which send the rewritten code back. It is not parsed again here,
+    its edits are computed by diffing it (see `get_module_edits`).
+
+    Args:
+        modules (`Sequence[Module]`): modules using the symbol
+        source_name (`str`): previous qualified name of the symbol
+        target_name (`str`): new qualified name of the symbol
+        workers (`int`): number of processes. 0 uses all CPUs.
+        token (`CancellationToken | None`): checked after each module, or each
+            chunk of modules sent to the process pool
+
+    Returns:
+        `list[CSTModule | str]`: rewritten trees, or code when rewritten by
+            the process pool, in the order of `modules`
+    """
+    token = token if token is not None else CancellationToken()
+    workers = min(resolve_workers(workers), len(modules))
+    if workers <= 1 or len(modules) < PARALLEL_REWRITE_MIN_MODULES:
+        trees: list[CSTModule | str] = []
+        for module in modules:
+            token.check()
+            import_replacer = ReplaceImports({source_name: target_name})
+            trees.append(module.metadata.visit(import_replacer))
+        return trees
+    executor = get_rewrite_executor(workers)
+    chunksize = max(1, len(modules) // (workers * 4))
+    futures = [
+        executor.submit(
+            _replace_imports_in_code,
+            [module.code for module in modules[start : start + chunksize]],
+            source_name,
+            target_name,
+        )
+        for start in range(0, len(modules), chunksize)
+    ]
+    codes: list[CSTModule | str] = []
+    try:
+        for future in futures:
+            token.check()
+            codes.extend(future.result())
+    except BrokenProcessPool:
+        # a worker died, the next move starts a new pool
+        _drop_rewrite_executor(executor)
+        raise
+    finally:
+        # pending chunks of a cancelled refactor are dropped
+        for future in futures:
+            future.cancel()
+    return codes
+
+
+@dataclass
+class MoveSymbolTarget:
+    """
+    Trees of the modules edited by a move, computed without modifying the
+    modules or the graph, see `apply_move_symbol_target`.
+    """
+
+    move_source: MoveSymbolSource
+    target: Module
+    source_name: str
+    """Previous qualified name of the symbol"""
+
+    target_name: str
+    """New qualified name of the symbol"""
+
+    trees: list[tuple[Module, CSTModule | str]]
+    """
+    Edited modules and their new trees: source, target, then the users. Users
+    rewritten by the process pool only have their code, see
+    `replace_imports_in_modules`.
+    """
+
+    @property
+    def modules(self) -> list[Module]:
+        return [module for module, _ in self.trees]
+
+    @property
+    def codes(self) -> dict[str, str]:
+        """New code of the edited modules, by full name"""
+        return {
+            module.full_mod_name: tree if isinstance(tree, str) else tree.code
+            for module, tree in self.trees
+        }
+
+
+def plan_move_symbol_target(
     graph: Graph,
     target: Module,
     move_source: MoveSymbolSource,
     line: int,
-) -> list[Module]:
+    workers: int = 1,
+    token: CancellationToken | None = None,
+) -> MoveSymbolTarget | None:
     """
-    Finish moving a module
+    Compute the trees of the modules edited by moving a symbol. The modules and
+    the graph are left unchanged, so a cancelled or discarded move needs no
+    cleanup.
 
     Args:
         graph (`Graph`): dependency graph
         target (`Module`):
         move_source (`MoveSymbolSource`):
         line (`int`): line to add the element to
+        workers (`int`): processes rewriting the users of the symbol, see
+            `replace_imports_in_modules`
+        token (`CancellationToken | None`): checked between modules
     Returns:
-        `list[Module]`: list of edited modules
+        `MoveSymbolTarget | None`: None if there is no symbol to move
     """
     if move_source.symbol_name is None or move_source.symbol is None:
-        return []
+        return None
+    token = token if token is not None else CancellationToken()
     source_name = move_source.source_mod.full_mod_name + "." + move_source.symbol_name
     target_name = target.full_mod_name + "." + move_source.symbol_name
-    wrapper = MetadataWrapper(target.cst)
+    # trees are not copied, so that untouched statements keep their identity
+    # (see `KeepUnchangedTransformer` and `get_statement_edits`)
     import_replacer = ReplaceImports({}, move_source.needed_imports, {source_name})
-    updated_target = wrapper.visit(import_replacer)
-    wrapper = MetadataWrapper(updated_target)
+    updated_target = target.metadata.visit(import_replacer)
+    wrapper = MetadataWrapper(updated_target, unsafe_skip_copy=True)
     add_symbol = AddSymbol(line, move_source.symbol)
-    target.cst = wrapper.visit(add_symbol)
-    move_source.source_mod.cst = move_source.updated_source
+    updated_target = wrapper.visit(add_symbol)
     edited_modules = [move_source.source_mod, target]
 
-    for new_dep in move_source.needed_imports:
+    # only the modules using the symbol are rewritten, other importers of the
+    # source module are left untouched
+    users = [
+        module
+        for module in graph.symbol_users(source_name)
+        if module not in edited_modules
+    ]
+    user_trees = replace_imports_in_modules(
+        users, source_name, target_name, workers, token
+    )
+    token.check()
+    return MoveSymbolTarget(
+        move_source=move_source,
+        target=target,
+        source_name=source_name,
+        target_name=target_name,
+        trees=[
+            (move_source.source_mod, move_source.updated_source),
+            (target, updated_target),
+            *zip(users, user_trees),
+        ],
+    )
+
+
+def apply_move_symbol_target(graph: Graph, move: MoveSymbolTarget) -> list[Module]:
+    """
+    Replace the trees of the modules edited by a move, and update the graph.
+
+    Args:
+        graph (`Graph`): dependency graph the move was planned with
+        move (`MoveSymbolTarget`):
+
+    Returns:
+        `list[Module]`: list of edited modules
+    """
+    for module, tree in move.trees:
+        if isinstance(tree, str):
+            # parsed again on demand
+            module.text = tree
+        else:
+            module.cst = tree
+    for new_dep in move.move_source.needed_imports:
         new_dep_pkg, _, _ = new_dep.path.rpartition(".")
         new_dep_mod = graph.node_from_path(new_dep_pkg)
         if new_dep_mod is None:
             continue
-        graph.add_edge((target, new_dep_mod))
-    graph.remove_edge((move_source.source_mod, target))
-
-    for dependending_mod in graph.parents(move_source.source_mod):
-        wrapper = MetadataWrapper(dependending_mod.cst)
-        import_replacer = ReplaceImports({source_name: target_name})
-        dependending_mod.cst = wrapper.visit(import_replacer)
-        graph.remove_edge((dependending_mod, move_source.source_mod))
-        graph.add_edge((dependending_mod, target))
-        if dependending_mod not in edited_modules:
-            edited_modules.append(dependending_mod)
-    return edited_modules
+        graph.add_edge((move.target, new_dep_mod))
+    graph.remove_edge((move.move_source.source_mod, move.target))
+    for module in move.modules[2:]:
+        move_symbol_imports(graph, module, move.source_name, move.target_name)
+    return move.modules
+
+
+def move_symbol_target(
+    graph: Graph,
+    target: Module,
+    move_source: MoveSymbolSource,
+    line: int,
+    workers: int = 1,
+    token: CancellationToken | None = None,
+) -> list[Module]:
+    """
+    Finish moving a module
+
+    The trees of all the edited modules are computed before any module or the
+    graph is modified, so a cancelled move leaves them unchanged, see
+    `plan_move_symbol_target` and `apply_move_symbol_target`.
+
+    Args:
+        graph (`Graph`): dependency graph
+        target (`Module`):
+        move_source (`MoveSymbolSource`):
+        line (`int`): line to add the element to
+        workers (`int`): processes rewriting the users of the symbol, see
+            `replace_imports_in_modules`
+        token (`CancellationToken | None`): checked between modules
+    Returns:
+        `list[Module]`: list of edited modules
+    """
+    move = plan_move_symbol_target(graph, target, move_source, line, workers, token)
+    if move is None:
+        return []
+    return apply_move_symbol_target(graph, move)
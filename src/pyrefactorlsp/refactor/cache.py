@@ -0,0 +1,220 @@
+import hashlib
+import importlib.metadata
+import os
+from collections.abc import Sequence
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError
+
+from pyrefactorlsp.constants import LOGGER
+from pyrefactorlsp.refactor.config import Config
+from pyrefactorlsp.refactor.index import (
+    ModuleIndex,
+    ProgressCallback,
+    hash_text,
+    index_modules,
+)
+from pyrefactorlsp.refactor.module import DefinitionSpan, Module
+from pyrefactorlsp.version import __version__
+
+CACHE_FORMAT_VERSION = 3
+
+
+class CachedModule(BaseModel):
+    package: str
+    mtime_ns: int
+    size: int
+    sha256: str
+    imports: list[str]
+    definitions: list[str]
+    spans: list[DefinitionSpan]
+
+
+class IndexCache(BaseModel):
+    """
+    On-disk index of a project. It is only valid for the format version,
+    pyrefactorlsp version, libcst version and project config it was written
+    with.
+    """
+
+    format_version: int = CACHE_FORMAT_VERSION
+    pyrefactorlsp_version: str = __version__
+    libcst_version: str
+    config_hash: str
+    modules: dict[str, CachedModule] = {}
+
+    def lookup(self, path: Path, package: str) -> ModuleIndex | None:
+        """
+        Get the cached index of a file if the file did not change since it was
+        cached. The mtime and size are checked first, and the content hash if
+        they differ.
+
+        Args:
+            path (`Path`): path to the module
+            package (`str`): package of the module
+
+        Returns:
+            `ModuleIndex | None`: None if the file is not cached or changed
+        """
+        entry = self.modules.get(str(path))
+        if entry is None or entry.package != package:
+            return None
+        try:
+            stat = path.stat()
+            with open(path, "r") as f:
+                text = f.read()
+        except OSError:
+            return None
+        is_touched = (stat.st_mtime_ns, stat.st_size) != (entry.mtime_ns, entry.size)
+        if is_touched and hash_text(text) != entry.sha256:
+            return None
+        module = Module(
+            url=path,
+            package=package,
+            name=path.stem,
+            text=text,
+            definitions=list(entry.definitions),
+            spans=list(entry.spans),
+        )
+        return ModuleIndex(
+            module=module,
+            imports=set(entry.imports),
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            sha256=entry.sha256,
+        )
+
+
+INDEX_CONFIG_FIELDS = {"root", "folders", "project_name", "fast_imports"}
+"""Fields of `Config` the indexes depend on, changing others keeps the cache"""
+
+
+def get_config_hash(config: Config) -> str:
+    fields = config.model_dump_json(include=INDEX_CONFIG_FIELDS)
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+def get_cache_path(config: Config) -> Path:
+    """
+    Location of the index cache of a project: in `Config.cache_dir` if set
+    (relative to the project root), in the XDG cache dir otherwise.
+
+    Args:
+        config (`Config`):
+
+    Returns:
+        `Path`:
+    """
+    if config.cache_dir is not None:
+        return Path(config.root) / config.cache_dir / "index.json"
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    root_hash = hashlib.sha256(config.root.encode("utf-8")).hexdigest()[:16]
+    return Path(cache_home) / "pyrefactorlsp" / f"{root_hash}.json"
+
+
+def empty_index_cache(config: Config) -> IndexCache:
+    return IndexCache(
+        libcst_version=importlib.metadata.version("libcst"),
+        config_hash=get_config_hash(config),
+    )
+
+
+def load_index_cache(config: Config) -> IndexCache:
+    """
+    Load the index cache of a project. Returns an empty cache if there is none,
+    if it cannot be read or if it was written for another format, version or
+    config.
+
+    Args:
+        config (`Config`):
+
+    Returns:
+        `IndexCache`:
+    """
+    empty_cache = empty_index_cache(config)
+    path = get_cache_path(config)
+    try:
+        with open(path, "rb") as f:
+            cache = IndexCache.model_validate_json(f.read())
+    except (OSError, ValidationError) as e:
+        LOGGER.debug("Index cache %s not loaded: %s", path, e)
+        return empty_cache
+    if (
+        cache.format_version != empty_cache.format_version
+        or cache.pyrefactorlsp_version != empty_cache.pyrefactorlsp_version
+        or cache.libcst_version != empty_cache.libcst_version
+        or cache.config_hash != empty_cache.config_hash
+    ):
+        LOGGER.debug("Index cache %s is outdated", path)
+        return empty_cache
+    return cache
+
+
+def save_index_cache(config: Config, indexes: Sequence[ModuleIndex]) -> None:
+    """
+    Write the index cache of a project. The file is replaced atomically.
+
+    Args:
+        config (`Config`):
+        indexes (`Sequence[ModuleIndex]`): index of every module of the project
+    """
+    cache = empty_index_cache(config)
+    for index in indexes:
+        cache.modules[str(index.module.url)] = CachedModule(
+            package=index.module.package,
+            mtime_ns=index.mtime_ns,
+            size=index.size,
+            sha256=index.sha256,
+            imports=sorted(index.imports),
+            definitions=index.module.definitions,
+            spans=index.module.spans,
+        )
+    path = get_cache_path(config)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            f.write(cache.model_dump_json())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        LOGGER.warning("Could not write index cache %s: %s", path, e)
+
+
+def index_modules_cached(
+    config: Config,
+    files: Sequence[tuple[Path, str]],
+    progress: ProgressCallback | None = None,
+) -> list[ModuleIndex]:
+    """
+    Same as `index_modules`, but only files that changed since the last run
+    are parsed. The cache is updated afterwards.
+
+    Args:
+        config (`Config`):
+        files (`Sequence[tuple[Path, str]]`): (path, package) of each module
+        progress (`ProgressCallback | None`): called after each indexed file,
+            cached files count as indexed at once
+
+    Returns:
+        `list[ModuleIndex]`:
+    """
+    cache = load_index_cache(config)
+    cached = [cache.lookup(path, package) for path, package in files]
+    missing = [file for file, index in zip(files, cached) if index is None]
+    LOGGER.debug(
+        "Index cache: %d hits, %d misses", len(files) - len(missing), len(missing)
+    )
+    hits = len(files) - len(missing)
+    missing_progress: ProgressCallback | None = None
+    if progress is not None:
+        progress(hits, len(files))
+
+        def missing_progress(done: int, total: int) -> None:
+            progress(hits + done, len(files))
+
+    fresh = iter(
+        index_modules(missing, config.workers, config.fast_imports, missing_progress)
+    )
+    indexes = [index if index is not None else next(fresh) for index in cached]
+    save_index_cache(config, indexes)
+    return indexes
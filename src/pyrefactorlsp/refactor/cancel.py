@@ -0,0 +1,43 @@
+import time
+
+
+class RefactorCancelled(Exception):
+    """Raised at a checkpoint of a refactor which was cancelled or timed out"""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a refactor running in a worker thread.
+
+    The server cancels the token when the client cancels the request, and the
+    refactor raises `RefactorCancelled` at its next checkpoint (`check`), or
+    once its deadline passed. Refactors only modify trees and graphs after
+    their last checkpoint, so a cancelled refactor leaves them unchanged.
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the refactor was cancelled, or its deadline passed"""
+        if self._cancelled:
+            return True
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check(self) -> None:
+        """
+        Checkpoint of a refactor.
+
+        Raises:
+            `RefactorCancelled`: if the refactor was cancelled, or its deadline
+                passed
+        """
+        if self._cancelled:
+            raise RefactorCancelled("Refactor cancelled")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise RefactorCancelled("Refactor deadline exceeded")
@@ -1,4 +1,5 @@
 from collections.abc import Sequence
+from typing import Literal
 
 from pydantic import BaseModel
 
@@ -7,3 +8,50 @@ class Config(BaseModel):
     root: str
     folders: Sequence[str] | None = None
     project_name: str
+
+    workers: int = 1
+    """
+    Number of processes used to index the project, and to rewrite the modules
+    edited by a refactor. 0 uses all CPUs.
+    """
+
+    fast_imports: bool = True
+    """Extract imports with the stdlib ast instead of libcst's qualified names"""
+
+    cache: bool = True
+    """Whether the server keeps an on-disk index cache of the project"""
+
+    cache_dir: str | None = None
+    """Index cache folder, relative to the root. Defaults to the XDG cache dir."""
+
+    reindex_delay: float = 0.3
+    """Seconds without edits before an edited module is indexed again"""
+
+    refactor_timeout: float | None = 30.0
+    """Seconds after which a refactor is cancelled. None for no limit."""
+
+    diff_max_cost: int = 1000
+    """Changed lines above which edits replace the whole changed region"""
+
+    format_edits: Literal["full", "range", "none"] = "full"
+    """
+    Formatting of modules edited by a refactor. "full" formats them with ruff
+    and diffs the result against the document. "range" only formats the
+    statements the refactor changed. "none" sends the changed statements as
+    they are, without diffing the rest of the module.
+    """
+
+    format_cache_size: int | None = 256
+    """Maximum number of formatted modules kept in memory. 0 disables it."""
+
+    format_cache_bytes: int | None = 64 * 1024 * 1024
+    """Maximum size of the formatted code kept in memory. None for no limit."""
+
+    tree_cache_size: int | None = 512
+    """Maximum number of syntax trees kept in memory. None for no limit."""
+
+    tree_cache_bytes: int | None = None
+    """Maximum estimated memory used by syntax trees. None for no limit."""
+
+    tree_cache_keep_text: bool = True
+    """Keep the text of modules whose tree was released, or read it again"""
@@ -2,65 +2,429 @@ from collections import namedtuple
 from collections.abc import Sequence
 from difflib import SequenceMatcher
 
-from lsprotocol.types import AnnotatedTextEdit, Position, Range, TextEdit
+import libcst
+from libcst.metadata import MetadataWrapper, WhitespaceInclusivePositionProvider
+from lsprotocol.types import AnnotatedTextEdit, PositionEncodingKind, Range, TextEdit
+
+from pyrefactorlsp.refactor.lines import LineIndex
+from pyrefactorlsp.refactor.module import Module
 
 EditBlock = namedtuple("EditBlock", ["start", "length", "replacement"])
 
 
-def get_diffs(original: str, updated: str) -> list[EditBlock]:
+DIFF_MAX_COST = 1000
+"""Number of changed lines above which a diff is a single replacement"""
+
+REFINE_MAX_SIZE = 1_000_000
+"""Largest product of the lengths of a changed hunk, in characters, that is
+diffed again at the character level"""
+
+
+def get_diffs(
+    original: str, updated: str, max_cost: int = DIFF_MAX_COST
+) -> list[EditBlock]:
+    """
+    Blocks of `original` to replace to get `updated`.
+
+    Lines are diffed first, with Myers' algorithm, and each changed hunk is
+    then diffed at the character level. When more than `max_cost` lines are
+    inserted or deleted, the whole changed region is replaced at once.
+
+    Args:
+        original (`str`): original text
+        updated (`str`): updated text
+        max_cost (`int`): maximum number of inserted and deleted lines
+
+    Returns:
+        `list[EditBlock]`: non-overlapping blocks, sorted by start
+    """
+    a = original.splitlines(keepends=True)
+    b = updated.splitlines(keepends=True)
+    # lines are compared as integers
+    line_ids: dict[str, int] = {}
+    a_ids = [line_ids.setdefault(line, len(line_ids)) for line in a]
+    b_ids = [line_ids.setdefault(line, len(line_ids)) for line in b]
+
+    # most edits are local, skip the common head and tail of both texts
+    head = 0
+    while head < len(a) and head < len(b) and a_ids[head] == b_ids[head]:
+        head += 1
+    tail = 0
+    while (
+        tail < len(a) - head
+        and tail < len(b) - head
+        and a_ids[-1 - tail] == b_ids[-1 - tail]
+    ):
+        tail += 1
+
+    hunks = myers_hunks(
+        a_ids[head : len(a) - tail], b_ids[head : len(b) - tail], max_cost
+    )
+    a_starts = [0]
+    for line in a:
+        a_starts.append(a_starts[-1] + len(line))
+    if hunks is None:
+        start = a_starts[head]
+        return [
+            EditBlock(
+                start,
+                a_starts[len(a) - tail] - start,
+                "".join(b[head : len(b) - tail]),
+            )
+        ]
+
+    blocks: list[EditBlock] = []
+    for a_start, a_end, b_start, b_end in hunks:
+        start = a_starts[head + a_start]
+        blocks.extend(
+            refine_hunk(
+                start,
+                original[start : a_starts[head + a_end]],
+                "".join(b[head + b_start : head + b_end]),
+            )
+        )
+    return blocks
+
+
+def myers_hunks(
+    a: Sequence[int], b: Sequence[int], max_cost: int
+) -> list[tuple[int, int, int, int]] | None:
+    """
+    Shortest edit script between two sequences, with Myers' O(ND) algorithm.
+
+    Args:
+        a (`Sequence[int]`): original sequence
+        b (`Sequence[int]`): updated sequence
+        max_cost (`int`): maximum number of insertions and deletions
+
+    Returns:
+        `list[tuple[int, int, int, int]] | None`: `(a_start, a_end, b_start,
+            b_end)` hunks replacing `a[a_start:a_end]` by `b[b_start:b_end]`,
+            None if the script is longer than `max_cost`
+    """
+    n, m = len(a), len(b)
+    max_d = min(n + m, max_cost)
+    offset = max_d + 1
+    # furthest x reached on each diagonal k = x - y, at index k + offset
+    v = [0] * (2 * max_d + 3)
+    # v[-d - 1 : d + 2] before each round d, to backtrack
+    trace: list[list[int]] = []
+    for d in range(max_d + 1):
+        trace.append(v[offset - d - 1 : offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(
+    trace: list[list[int]], n: int, m: int
+) -> list[tuple[int, int, int, int]]:
+    hunks: list[tuple[int, int, int, int]] = []
+    x, y = n, m
+    # end of the hunk being built, going backwards
+    hunk_end: tuple[int, int] | None = None
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d + 1] if d > 0 else 0
+        prev_y = prev_x - prev_k if d > 0 else 0
+        # diagonal: equal items
+        snake = min(x - prev_x, y - prev_y) if d > 0 else x
+        if snake and hunk_end is not None:
+            hunks.append((x, hunk_end[0], y, hunk_end[1]))
+            hunk_end = None
+        x, y = x - snake, y - snake
+        if d > 0 and hunk_end is None:
+            hunk_end = (x, y)
+        x, y = prev_x, prev_y
+    if hunk_end is not None:
+        hunks.append((0, hunk_end[0], 0, hunk_end[1]))
+    hunks.reverse()
+    return hunks
+
+
+def refine_hunk(start: int, original: str, updated: str) -> list[EditBlock]:
+    """
+    Character level diff of a changed hunk.
+
+    Args:
+        start (`int`): offset of the hunk in the original text
+        original (`str`): original text of the hunk
+        updated (`str`): updated text of the hunk
+
+    Returns:
+        `list[EditBlock]`:
+    """
+    if len(original) * len(updated) > REFINE_MAX_SIZE:
+        return [EditBlock(start, len(original), updated)]
     matcher = SequenceMatcher(None, original, updated, False)
-    matching_blocks = matcher.get_matching_blocks()
-    unmatched_blocks: list[EditBlock] = []
-    start = 0
-    start_updated = 0
-    for match in matching_blocks:
-        if start == len(original):
-            break
-        replacement = updated[start_updated : match.b]
-        length = match.a - start
-        unmatched_blocks.append(EditBlock(start, length, replacement))
-        start = match.a + match.size
-        start_updated = match.b + match.size
-    return unmatched_blocks
+    return [
+        EditBlock(start + i1, i2 - i1, updated[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def get_statement_edits(
+    original_text: str, original: libcst.Module, updated: libcst.Module
+) -> list[EditBlock] | None:
+    """
+    Blocks of `original_text` to replace to get the code of `updated`, from
+    the top-level statements a refactor replaced, inserted or removed.
+
+    Refactors keep the statements they did not change as is (see
+    `KeepUnchangedTransformer`), so statements are matched by identity: the
+    code of untouched statements is neither generated nor diffed. Changed
+    statements are located with `WhitespaceInclusivePositionProvider`, and
+    their new code is refined at the character level (see `refine_hunk`).
+
+    When no statement is shared, as for a tree parsed again from rewritten
+    code, statements are matched by code instead.
+
+    Args:
+        original_text (`str`): text `original` was parsed from
+        original (`libcst.Module`): tree before the refactor
+        updated (`libcst.Module`): tree after the refactor
+
+    Returns:
+        `list[EditBlock] | None`: None if the module header, footer or
+            formatting changed, or if it does not end with a newline. The
+            whole code has to be diffed then.
+    """
+    if (
+        not _same_code(original, original.header, updated, updated.header)
+        or not _same_code(original, original.footer, updated, updated.footer)
+        or updated.encoding != original.encoding
+        or updated.default_indent != original.default_indent
+        or updated.default_newline != original.default_newline
+        # the last statement is generated with a newline, then stripped
+        or not original.has_trailing_newline
+        or not updated.has_trailing_newline
+    ):
+        return None
+    original_keys = [id(statement) for statement in original.body]
+    updated_keys = [id(statement) for statement in updated.body]
+    shares_statements = not set(original_keys).isdisjoint(updated_keys)
+    if shares_statements:
+        hunks = myers_hunks(
+            original_keys, updated_keys, len(original_keys) + len(updated_keys)
+        )
+        if not hunks:
+            return []
+
+    # skip the copy, to keep the identity of the statements
+    wrapper = MetadataWrapper(original, unsafe_skip_copy=True)
+    positions = wrapper.resolve(WhitespaceInclusivePositionProvider)
+    line_starts = LineIndex(original_text).line_starts
+
+    def offset(line: int, column: int) -> int:
+        return line_starts[line - 1] + column
+
+    if not shares_statements:
+        codes: dict[str, int] = {}
+        original_keys = []
+        for statement in original.body:
+            code_range = positions[statement]
+            start = offset(code_range.start.line, code_range.start.column)
+            end = offset(code_range.end.line, code_range.end.column)
+            original_keys.append(codes.setdefault(original_text[start:end], len(codes)))
+        updated_keys = [
+            codes.setdefault(updated.code_for_node(statement), len(codes))
+            for statement in updated.body
+        ]
+        hunks = myers_hunks(
+            original_keys, updated_keys, len(original_keys) + len(updated_keys)
+        )
+
+    # insertions after the last statement go before the footer
+    body_end = len(original_text) - len(
+        "".join(original.code_for_node(line) for line in original.footer)
+    )
+    blocks: list[EditBlock] = []
+    for a_start, a_end, b_start, b_end in hunks:
+        if a_start < len(original.body):
+            position = positions[original.body[a_start]].start
+            start = offset(position.line, position.column)
+        else:
+            start = body_end
+        if a_end > a_start:
+            position = positions[original.body[a_end - 1]].end
+            end = offset(position.line, position.column)
+        else:
+            end = start
+        code = "".join(
+            updated.code_for_node(statement)
+            for statement in updated.body[b_start:b_end]
+        )
+        if not updated.body and not updated.header and not updated.footer:
+            # like libcst, an empty module still ends with a newline
+            code = updated.default_newline
+        blocks.extend(refine_hunk(start, original_text[start:end], code))
+    return blocks
+
+
+def _same_code(
+    a_module: libcst.Module,
+    a: Sequence[libcst.CSTNode],
+    b_module: libcst.Module,
+    b: Sequence[libcst.CSTNode],
+) -> bool:
+    if len(a) == len(b) and all(x is y for x, y in zip(a, b)):
+        return True
+    return "".join(a_module.code_for_node(node) for node in a) == "".join(
+        b_module.code_for_node(node) for node in b
+    )
+
+
+def get_module_edits(
+    module: Module,
+    document_text: str,
+    max_cost: int = DIFF_MAX_COST,
+    tree: libcst.Module | str | None = None,
+) -> list[EditBlock]:
+    """
+    Blocks of the document of a refactored module to replace to get the code
+    of its tree. When the document is the text the tree was parsed from, they
+    come from the changed statements (`get_statement_edits`), otherwise from
+    diffing the whole code.
+
+    Args:
+        module (`Module`): refactored module
+        document_text (`str`): text of the module in the editor
+        max_cost (`int`): see `get_diffs`
+        tree (`libcst.Module | str | None`): new tree of the module, not
+            assigned to it yet, or its new code, which is diffed. Defaults to
+            the modified `Module.cst`.
+
+    Returns:
+        `list[EditBlock]`:
+    """
+    if isinstance(tree, str):
+        return get_diffs(document_text, tree, max_cost)
+    if tree is None:
+        base, tree, base_code = module.base_cst, module.cst, module.text
+    else:
+        base, base_code = module.cst, module.code
+    if base is not None and base_code == document_text:
+        blocks = get_statement_edits(document_text, base, tree)
+        if blocks is not None:
+            return blocks
+    return get_diffs(document_text, tree.code, max_cost)
+
+
+def apply_edit_blocks(text: str, blocks: Sequence[EditBlock]) -> str:
+    """
+    Apply edit blocks to a text.
+
+    Args:
+        text (`str`):
+        blocks (`Sequence[EditBlock]`): non-overlapping blocks of `text`,
+            sorted by start
+
+    Returns:
+        `str`: edited text
+    """
+    parts: list[str] = []
+    position = 0
+    for block in blocks:
+        parts.append(text[position : block.start])
+        parts.append(block.replacement)
+        position = block.start + block.length
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def replaced_spans(blocks: Sequence[EditBlock]) -> list[tuple[int, int]]:
+    """
+    Spans of the replacement texts of edit blocks, in the edited text.
+    Deletions have no span.
+
+    Args:
+        blocks (`Sequence[EditBlock]`): non-overlapping blocks, sorted by start
+
+    Returns:
+        `list[tuple[int, int]]`: start and end offsets, sorted
+    """
+    spans: list[tuple[int, int]] = []
+    shift = 0
+    for block in blocks:
+        if block.replacement:
+            start = block.start + shift
+            spans.append((start, start + len(block.replacement)))
+        shift += len(block.replacement) - block.length
+    return spans
 
 
 def str_index_to_line_offset(
     text: str, idx: Sequence[int]
 ) -> dict[int, tuple[int, int]]:
-    locations: dict[int, tuple[int, int]] = {}
-    cur_line, cur_offset = 0, 0
-    for k, c in enumerate(text):
-        if k in idx:
-            locations[k] = (cur_line, cur_offset)
-        if c == "\n":
-            cur_line += 1
-            cur_offset = 0
-            continue
-        cur_offset += 1
-    return locations
-
-
-def get_text_edits(original: str, update: str) -> list[TextEdit | AnnotatedTextEdit]:
-    edit_blocks = get_diffs(original, update)
-    print(edit_blocks)
-    idx = []
-    for block in edit_blocks:
-        idx.append(block.start)
-        idx.append(block.start + block.length)
-    locations = str_index_to_line_offset(original, idx)
+    line_index = LineIndex(text)
+    return {k: line_index.line_col(k) for k in idx}
+
+
+def get_text_edits(
+    original: str,
+    update: str,
+    encoding: PositionEncodingKind | str = PositionEncodingKind.Utf16,
+    max_cost: int = DIFF_MAX_COST,
+) -> list[TextEdit | AnnotatedTextEdit]:
+    """
+    Text edits turning `original` into `update`.
+
+    Args:
+        original (`str`): current text of the document
+        update (`str`): new text of the document
+        encoding (`PositionEncodingKind | str`): position encoding negotiated
+            with the client
+        max_cost (`int`): see `get_diffs`
+
+    Returns:
+        `list[TextEdit | AnnotatedTextEdit]`:
+    """
+    return blocks_to_text_edits(
+        original, get_diffs(original, update, max_cost), encoding
+    )
+
+
+def blocks_to_text_edits(
+    original: str,
+    blocks: Sequence[EditBlock],
+    encoding: PositionEncodingKind | str = PositionEncodingKind.Utf16,
+) -> list[TextEdit | AnnotatedTextEdit]:
+    """
+    Convert edit blocks of a text to LSP text edits.
+
+    Args:
+        original (`str`): current text of the document
+        blocks (`Sequence[EditBlock]`): edits of `original`
+        encoding (`PositionEncodingKind | str`): position encoding negotiated
+            with the client
 
+    Returns:
+        `list[TextEdit | AnnotatedTextEdit]`:
+    """
+    line_index = LineIndex(original, encoding)
     return [
         TextEdit(
             new_text=block.replacement,
             range=Range(
-                start=Position(
-                    line=locations[block.start][0], character=locations[block.start][1]
-                ),
-                end=Position(
-                    line=locations[block.start + block.length][0],
-                    character=locations[block.start + block.length][1],
-                ),
+                start=line_index.position(block.start),
+                end=line_index.position(block.start + block.length),
             ),
         )
-        for block in edit_blocks
+        for block in blocks
     ]
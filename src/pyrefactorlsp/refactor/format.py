@@ -0,0 +1,343 @@
+import os
+import tempfile
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from subprocess import PIPE, Popen, run
+
+from pyrefactorlsp.constants import LOGGER
+from pyrefactorlsp.refactor.index import hash_text
+from pyrefactorlsp.refactor.lines import LineIndex
+
+RUFF_CONFIG_FILES = (".ruff.toml", "ruff.toml", "pyproject.toml")
+
+RANGE_FORMAT_MAX_RANGES = 8
+"""Number of changed line ranges above which they are formatted as one"""
+
+
+@dataclass
+class ProcessOutput:
+    stdout: str
+    stderr: str
+    statuscode: int
+
+
+FormatKey = tuple[str, str, str, str]
+"""Ruff version, hash of the ruff configuration, file name and hash of the
+source"""
+
+
+class FormatCache:
+    """
+    Least-recently-used cache of the code formatted by ruff, keyed by the
+    source and everything else the result depends on (see `format_key`).
+    When the number of entries or the size of the formatted code goes over the
+    limits, the oldest entries are evicted.
+    """
+
+    def __init__(self, max_entries: int | None = 256, max_bytes: int | None = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[FormatKey, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: FormatKey) -> str | None:
+        formatted = self._entries.get(key)
+        if formatted is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return formatted
+
+    def put(self, key: FormatKey, formatted: str) -> None:
+        if self.max_entries == 0:
+            return
+        self.total_bytes -= len(self._entries.pop(key, ""))
+        self._entries[key] = formatted
+        self.total_bytes += len(formatted)
+        while self._entries and self._is_full():
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def _is_full(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+
+@cache
+def ruff_version() -> str:
+    return execute_ruff(["ruff", "--version"], "").stdout.strip()
+
+
+def format_key(document_uri: str, source: str, config: Path | None) -> FormatKey:
+    """
+    Key of the formatted code of a source in `FormatCache`.
+
+    Args:
+        document_uri (`str`): name given to ruff for the code
+        source (`str`): code
+        config (`Path | None`): ruff configuration file used, if any
+
+    Returns:
+        `FormatKey`:
+    """
+    config_hash = hash_text(config.read_text()) if config is not None else ""
+    return (ruff_version(), config_hash, document_uri, hash_text(source))
+
+
+def execute_ruff(
+    args: Sequence[str], source: str, cwd: str | Path | None = None
+) -> ProcessOutput:
+    process = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    (out, err) = process.communicate(bytes(source, encoding="utf-8"))
+    code = process.wait()
+    return ProcessOutput(
+        statuscode=code, stdout=bytes.decode(out), stderr=bytes.decode(err)
+    )
+
+
+def _config_args(config: Path | None) -> list[str]:
+    return ["--config", str(config)] if config is not None else []
+
+
+def reformat_code(
+    document_uri: str,
+    source: str,
+    cache: FormatCache | None = None,
+    root: str | Path | None = None,
+) -> str:
+    """
+    Format a code with ruff through pipes, and sort its imports.
+
+    Args:
+        document_uri (`str`): name given to ruff for the code
+        source (`str`): code
+        cache (`FormatCache | None`): formatted code of previous calls
+        root (`str | Path | None`): root of the project, whose ruff
+            configuration is used. Defaults to the working directory.
+
+    Returns:
+        `str`: formatted code
+    """
+    root = root if root is not None else Path.cwd()
+    config = find_ruff_config(root)
+    key: FormatKey | None = None
+    if cache is not None:
+        key = format_key(document_uri, source, config)
+        formatted = cache.get(key)
+        if formatted is not None:
+            return formatted
+    reformat_out = execute_ruff(
+        [
+            "ruff",
+            "format",
+            *_config_args(config),
+            "--stdin-filename",
+            document_uri,
+        ],
+        source,
+        root,
+    )
+    formatted = execute_ruff(
+        [
+            "ruff",
+            "check",
+            "--fix-only",
+            "--quiet",
+            "--select",
+            "I",
+            *_config_args(config),
+            "--stdin-filename",
+            document_uri,
+        ],
+        reformat_out.stdout,
+        root,
+    ).stdout
+    if cache is not None and key is not None:
+        cache.put(key, formatted)
+    return formatted
+
+
+def reformat_ranges(
+    document_uri: str,
+    source: str,
+    spans: Sequence[tuple[int, int]],
+    root: str | Path | None = None,
+) -> str:
+    """
+    Format only the statements overlapping some spans of a code with ruff, and
+    sort its imports.
+
+    Spans are grouped by lines, and each group is formatted with ruff's range
+    formatting, from the last one to the first so that the line numbers of
+    the remaining ones stay valid. Lines outside of the groups are left as
+    they are, even when they are not ruff-clean.
+
+    Args:
+        document_uri (`str`): name given to ruff for the code
+        source (`str`): code
+        spans (`Sequence[tuple[int, int]]`): start and end offsets of the
+            changed regions of `source`, sorted
+        root (`str | Path | None`): root of the project, whose ruff
+            configuration is used. Defaults to the working directory.
+
+    Returns:
+        `str`: formatted code
+    """
+    line_index = LineIndex(source)
+    line_ranges: list[tuple[int, int]] = []
+    for start, end in spans:
+        first = line_index.line_col(start)[0] + 1
+        # a region ending with a newline ends on the previous line
+        last = max(first, line_index.line_col(max(start, end - 1))[0] + 1)
+        if line_ranges and first <= line_ranges[-1][1] + 1:
+            first = line_ranges.pop()[0]
+        line_ranges.append((first, last))
+    if len(line_ranges) > RANGE_FORMAT_MAX_RANGES:
+        line_ranges = [(line_ranges[0][0], line_ranges[-1][1])]
+
+    root = root if root is not None else Path.cwd()
+    config_args = _config_args(find_ruff_config(root))
+
+    for first, last in reversed(line_ranges):
+        formatted = execute_ruff(
+            [
+                "ruff",
+                "format",
+                "--range",
+                f"{first}-{last + 1}",
+                *config_args,
+                "--stdin-filename",
+                document_uri,
+            ],
+            source,
+            root,
+        )
+        if formatted.statuscode != 0:
+            LOGGER.warning("Range formatting failed: %s", formatted.stderr)
+            return source
+        source = formatted.stdout
+    return execute_ruff(
+        [
+            "ruff",
+            "check",
+            "--fix-only",
+            "--quiet",
+            "--select",
+            "I",
+            *config_args,
+            "--stdin-filename",
+            document_uri,
+        ],
+        source,
+        root,
+    ).stdout
+
+
+def find_ruff_config(root: str | Path) -> Path | None:
+    """
+    Ruff configuration file applying to a project: the closest `ruff.toml`,
+    or `pyproject.toml` with a `[tool.ruff]` section, in its root or parents.
+
+    Args:
+        root (`str | Path`): root of the project
+
+    Returns:
+        `Path | None`: None when ruff uses its defaults
+    """
+    for folder in [Path(root).resolve(), *Path(root).resolve().parents]:
+        for name in RUFF_CONFIG_FILES:
+            path = folder / name
+            if not path.is_file():
+                continue
+            if name != "pyproject.toml" or "[tool.ruff" in path.read_text():
+                return path
+    return None
+
+
+def reformat_modules(
+    sources: Mapping[str, str],
+    root: str | Path | None = None,
+    cache: FormatCache | None = None,
+) -> dict[str, str]:
+    """
+    Format the code of several modules with ruff, and sort their imports.
+
+    The modules missing from the cache are written to a scratch tree, so that
+    each step is a single ruff invocation whatever the number of modules. The
+    configuration of the project is passed explicitly, as the scratch tree is
+    outside of it. A single module, or the modules of a failed batch, are
+    formatted through pipes with the same configuration (`reformat_code`).
+
+    Args:
+        sources (`Mapping[str, str]`): code of the modules by full module name
+        root (`str | Path | None`): root of the project, to find its ruff
+            configuration. Defaults to the working directory.
+        cache (`FormatCache | None`): formatted code of previous calls
+
+    Returns:
+        `dict[str, str]`: formatted code by full module name
+    """
+    root = root if root is not None else Path.cwd()
+    config = find_ruff_config(root)
+    formatted: dict[str, str] = {}
+    keys: dict[str, FormatKey] = {}
+    if cache is not None:
+        for name, source in sources.items():
+            keys[name] = format_key(name, source, config)
+            cached = cache.get(keys[name])
+            if cached is not None:
+                formatted[name] = cached
+    missing = {
+        name: source for name, source in sources.items() if name not in formatted
+    }
+    if len(missing) <= 1:
+        batch = {
+            name: reformat_code(name, source, root=root)
+            for name, source in missing.items()
+        }
+    else:
+        batch = _reformat_batch(missing, root, config)
+    if cache is not None:
+        for name, code in batch.items():
+            cache.put(keys[name], code)
+    formatted.update(batch)
+    return formatted
+
+
+def _reformat_batch(
+    sources: Mapping[str, str], root: str | Path, config: Path | None
+) -> dict[str, str]:
+    config_args = _config_args(config)
+    with tempfile.TemporaryDirectory(prefix="pyrefactorlsp-") as scratch:
+        paths = {
+            name: Path(scratch, *name.split(".")).with_suffix(".py") for name in sources
+        }
+        for name, path in paths.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(sources[name], encoding="utf-8", newline="")
+        files = [os.fspath(path) for path in paths.values()]
+        for args in (
+            ["ruff", "format", *config_args],
+            ["ruff", "check", "--fix-only", "--quiet", "--select", "I", *config_args],
+        ):
+            process = run([*args, *files], capture_output=True, check=False, cwd=root)
+            if process.returncode != 0:
+                LOGGER.warning(
+                    "Batch formatting failed, formatting modules one by one: %s",
+                    process.stderr.decode(errors="replace"),
+                )
+                return {
+                    name: reformat_code(name, source, root=root)
+                    for name, source in sources.items()
+                }
+        return {name: path.read_bytes().decode("utf-8") for name, path in paths.items()}
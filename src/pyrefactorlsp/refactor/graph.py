@@ -1,88 +1,286 @@
+import os
+from collections.abc import Iterable, Sequence
 from importlib.util import resolve_name
+from os import PathLike
 from pathlib import Path
 
+from pyrefactorlsp.refactor.cache import index_modules_cached
 from pyrefactorlsp.refactor.config import Config
-from pyrefactorlsp.refactor.imports import find_imports
-from pyrefactorlsp.refactor.module import Module, Symbol, get_module
+from pyrefactorlsp.refactor.imports import STAR_IMPORT, find_imports
+from pyrefactorlsp.refactor.index import ProgressCallback, hash_text, index_modules
+from pyrefactorlsp.refactor.module import Module, Symbol, TreeCache, get_module
 
 
 class Graph:
+    """
+    Dependency graph of a project.
+
+    Modules are indexed by their full module name, and edges are stored as
+    forward (module -> imported modules) and reverse (module -> importers)
+    adjacency sets, so lookups are O(1) and removals O(degree).
+
+    The names imported by each module are kept, indexed by the module path
+    they are looked up in, even when no such module exists. When modules are
+    added, removed or renamed, only the importers of these names have to be
+    resolved again (see `update_project_files`). They are also indexed by
+    qualified name, so that refactors of a symbol only visit the modules using
+    it (see `symbol_users`).
+    """
+
     def __init__(
         self,
         nodes: list[Module] | None = None,
         edges: list[tuple[Module, Module]] | None = None,
+        tree_cache: TreeCache | None = None,
     ):
-        self.nodes: list[Module] = nodes or []
-        self.edges: list[tuple[Module, Module]] = edges or []
+        self.tree_cache = tree_cache
+        self._nodes: dict[str, Module] = {}
+        # normalized path -> module
+        self._paths: dict[str, Module] = {}
+        # dicts are used as insertion-ordered sets of module names
+        self._children: dict[str, dict[str, None]] = {}
+        self._parents: dict[str, dict[str, None]] = {}
+        # module -> {imported name: path it is looked up in}
+        self._imports: dict[str, dict[str, str]] = {}
+        # path -> modules importing names from it
+        self._importers: dict[str, dict[str, None]] = {}
+        # qualified name, and each of its prefixes -> modules using it
+        self._users: dict[str, dict[str, None]] = {}
+        for node in nodes or []:
+            self.add_node(node)
+        for edge in edges or []:
+            self.add_edge(edge)
+
+    @property
+    def nodes(self) -> list[Module]:
+        return list(self._nodes.values())
+
+    @property
+    def edges(self) -> list[tuple[Module, Module]]:
+        return [
+            (self._nodes[source], self._nodes[target])
+            for source, targets in self._children.items()
+            for target in targets
+        ]
+
+    def get_node(self, name: str) -> Module | None:
+        return self._nodes.get(name)
 
     def node_from_path(self, path: str) -> Module | None:
-        for mod in self.nodes:
-            if mod.full_mod_name == path or mod.full_mod_name == path + ".__init__":
-                return mod
+        mod = self._nodes.get(path)
+        if mod is None:
+            mod = self._nodes.get(path + ".__init__")
+        return mod
+
+    def node_from_file(self, path: str | PathLike) -> Module | None:
+        """
+        Module of a file, in constant time.
+
+        Args:
+            path (`str | PathLike`): path to the file, absolute or relative to
+                the working directory
+
+        Returns:
+            `Module | None`: None if the file is not a module of the graph
+        """
+        return self._paths.get(os.path.abspath(path))
 
     def add_node(self, node: Module) -> None:
-        self.nodes.append(node)
+        name = node.full_mod_name
+        previous = self._nodes.get(name)
+        if previous is not None and previous is not node:
+            self._paths.pop(os.path.abspath(previous.url), None)
+        self._nodes[name] = node
+        self._paths[os.path.abspath(node.url)] = node
+        node.tree_cache = self.tree_cache
+        if self.tree_cache is not None and node.is_loaded:
+            self.tree_cache.touch(node)
+        self._children.setdefault(name, {})
+        self._parents.setdefault(name, {})
 
     def add_edge(self, edge: tuple[Module, Module]) -> None:
-        self.edges.append(edge)
+        source, target = edge[0].full_mod_name, edge[1].full_mod_name
+        if source not in self._nodes:
+            self.add_node(edge[0])
+        if target not in self._nodes:
+            self.add_node(edge[1])
+        self._children[source][target] = None
+        self._parents[target][source] = None
 
     def remove_edge(self, edge: tuple[Module, Module]) -> None:
-        return self.edges.remove(edge)
+        source, target = edge[0].full_mod_name, edge[1].full_mod_name
+        self._children.get(source, {}).pop(target, None)
+        self._parents.get(target, {}).pop(source, None)
 
     def remove_nodes(self, nodes: list[Module]) -> None:
-        for k in reversed(range(len(self.edges))):
-            if self.edges[k][0] in nodes or self.edges[k][1] in nodes:
-                self.edges.remove(self.edges[k])
         for node in nodes:
-            self.nodes.remove(node)
+            name = node.full_mod_name
+            if name not in self._nodes:
+                continue
+            for target in self._children.pop(name):
+                self._parents[target].pop(name, None)
+            for source in self._parents.pop(name):
+                self._children[source].pop(name, None)
+            self.set_imports(node, {})
+            del self._nodes[name]
+            path = os.path.abspath(node.url)
+            if self._paths.get(path) is node:
+                del self._paths[path]
+            if self.tree_cache is not None:
+                self.tree_cache.discard(node)
+            node.tree_cache = None
 
     def reset_dependencies(self, node: Module) -> None:
-        for k in reversed(range(len(self.edges))):
-            if self.edges[k][0] == node:
-                self.edges.remove(self.edges[k])
+        name = node.full_mod_name
+        targets = self._children.get(name)
+        if not targets:
+            return
+        for target in targets:
+            self._parents[target].pop(name, None)
+        targets.clear()
+
+    def rename_node(self, node: Module, package: str, name: str, url: Path) -> None:
+        """
+        Move a module to a new name, keeping the `Module` object and its tree.
+        Its edges are removed: imports from and of the module must be resolved
+        again.
+
+        Args:
+            node (`Module`): module to rename
+            package (`str`): new package
+            name (`str`): new name
+            url (`Path`): new path to the module
+        """
+        self.remove_nodes([node])
+        node.package = package
+        node.name = name
+        node.url = url
+        self.add_node(node)
+
+    def set_imports(self, node: Module, imports: dict[str, str]) -> None:
+        """
+        Record the names imported by a module.
+
+        Args:
+            node (`Module`): importing module
+            imports (`dict[str, str]`): imported names, and the module path
+                each one is looked up in (see `get_import_path`)
+        """
+        name = node.full_mod_name
+        for imported, path in self._imports.pop(name, {}).items():
+            for key, index in [(path, self._importers)] + [
+                (prefix, self._users) for prefix in _prefixes(imported, path)
+            ]:
+                modules = index.get(key)
+                if modules is not None:
+                    modules.pop(name, None)
+                    if not modules:
+                        del index[key]
+        if not imports:
+            return
+        self._imports[name] = imports
+        for imported, path in imports.items():
+            self._importers.setdefault(path, {})[name] = None
+            for prefix in _prefixes(imported, path):
+                self._users.setdefault(prefix, {})[name] = None
+
+    def get_imports(self, node: Module) -> list[str]:
+        return list(self._imports.get(node.full_mod_name, {}))
+
+    def importers(self, name: str) -> list[Module]:
+        """
+        Modules importing names from the module `name`, which does not have to
+        be in the graph.
+
+        Args:
+            name (`str`): full module name
+
+        Returns:
+            `list[Module]`:
+        """
+        importers = dict(self._importers.get(name, {}))
+        # see `node_from_path`
+        if name.endswith(".__init__"):
+            importers.update(self._importers.get(name.removesuffix(".__init__"), {}))
+        return [self._nodes[importer] for importer in importers]
+
+    def symbol_users(self, symbol: str) -> list[Module]:
+        """
+        Modules using a symbol, or one of its attributes, and modules star
+        importing the module of the symbol. Names imported but never used are
+        not recorded (see `find_imports`).
+
+        Args:
+            symbol (`str`): qualified name of the symbol, e.g. `pkg.mod.T`
+
+        Returns:
+            `list[Module]`:
+        """
+        module, _, name = symbol.rpartition(".")
+        modules = [module]
+        # see `node_from_path`
+        if module.endswith(".__init__"):
+            modules.append(module.removesuffix(".__init__"))
+        users: dict[str, None] = {}
+        for module in modules:
+            users.update(self._users.get(f"{module}.{name}", {}))
+            users.update(self._users.get(f"{module}.{STAR_IMPORT}", {}))
+        return [self._nodes[user] for user in users]
 
     def has_edge_from(self, node: Module) -> bool:
-        for source_node, _ in self.edges:
-            if source_node == node:
-                return True
-        return False
+        return bool(self._children.get(node.full_mod_name))
 
     def has_edge_to(self, node: Module) -> bool:
-        for _, target_node in self.edges:
-            if target_node == node:
-                return True
-        return False
+        return bool(self._parents.get(node.full_mod_name))
 
     def children(self, node: Module) -> list[Module]:
-        children: list[Module] = []
-        for source_node, target_node in self.edges:
-            if source_node == node and target_node not in children:
-                children.append(target_node)
-        return children
+        return [
+            self._nodes[target] for target in self._children.get(node.full_mod_name, {})
+        ]
 
     def parents(self, node: Module) -> list[Module]:
-        parents: list[Module] = []
-        for source_node, target_node in self.edges:
-            if target_node == node and source_node not in parents:
-                parents.append(source_node)
-        return parents
+        return [
+            self._nodes[source] for source in self._parents.get(node.full_mod_name, {})
+        ]
+
+
+def _prefixes(name: str, path: str) -> list[str]:
+    """Qualified name of an imported name looked up in `path`, and its prefixes"""
+    qualified_name = f"{path}.{name.rpartition('.')[2]}"
+    parts = qualified_name.split(".")
+    return [".".join(parts[:k]) for k in range(len(parts), 0, -1)]
+
+
+def get_import_path(name: str, current_pkg: str | None) -> str:
+    """Module path an imported name is looked up in, see `Graph.node_from_path`"""
+    return resolve_name(name.rpartition(".")[0], current_pkg)
 
 
 def get_node_from_name(
     graph: Graph, name: str, current_pkg: str | None
 ) -> tuple[Module, str] | tuple[None, None]:
-    mod, _, symbol = name.rpartition(".")
-    mod = resolve_name(mod, current_pkg)
-    for node in graph.nodes:
-        if node.full_mod_name == mod:
-            return node, symbol
-        if node.full_mod_name == mod + ".__init__":
-            return node, symbol
+    symbol = name.rpartition(".")[2]
+    node = graph.node_from_path(get_import_path(name, current_pkg))
+    if node is not None:
+        return node, symbol
     return None, None
 
 
-def get_module_dependencies(graph: Graph, module: Module) -> list[Module]:
-    dependency_names = find_imports(module)
+def resolve_dependencies(
+    graph: Graph, module: Module, dependency_names: Iterable[str]
+) -> list[Module]:
+    """
+    Resolve imported names of a module into graph nodes.
+
+    Args:
+        graph (`Graph`): dependency graph
+        module (`Module`): importing module
+        dependency_names (`Iterable[str]`): imported names, as given by
+            `find_imports`
+
+    Returns:
+        `list[Module]`: modules the names resolve to
+    """
     dependencies: list[Module] = []
     for name in dependency_names:
         node, symbol = get_node_from_name(graph, name, module.package)
@@ -92,17 +290,88 @@ def get_module_dependencies(graph: Graph, module: Module) -> list[Module]:
     return dependencies
 
 
-def add_nodes_to_graph(graph: Graph, path: Path, package: str | None = None) -> None:
+def update_module_dependencies(
+    graph: Graph, module: Module, dependency_names: Iterable[str]
+) -> None:
+    """
+    Replace the outgoing edges of a module. Edges of other modules, including
+    the ones pointing to this module, are left untouched.
+
+    Args:
+        graph (`Graph`): dependency graph
+        module (`Module`): updated module
+        dependency_names (`Iterable[str]`): imported names, as given by
+            `find_imports`
+    """
+    names = sorted(dependency_names)
+    graph.reset_dependencies(module)
+    graph.set_imports(
+        module, {name: get_import_path(name, module.package) for name in names}
+    )
+    module.symbols.clear()
+    for dependency in resolve_dependencies(graph, module, names):
+        graph.add_edge((module, dependency))
+
+
+def move_symbol_imports(graph: Graph, module: Module, old: str, new: str) -> None:
+    """
+    Record that a module now imports a symbol, and its attributes, from its
+    new location, and update its edges.
+
+    Args:
+        graph (`Graph`): dependency graph
+        module (`Module`): module using the symbol
+        old (`str`): previous qualified name of the symbol
+        new (`str`): new qualified name of the symbol
+    """
+    old_module, _, symbol = old.rpartition(".")
+    old_names = [old]
+    # see `node_from_path`
+    if old_module.endswith(".__init__"):
+        old_names.append(f"{old_module.removesuffix('.__init__')}.{symbol}")
+    names = []
+    for name in graph.get_imports(module):
+        path = get_import_path(name, module.package)
+        qualified_name = f"{path}.{name.rpartition('.')[2]}"
+        for old_name in old_names:
+            if qualified_name == old_name or qualified_name.startswith(old_name + "."):
+                name = new + qualified_name[len(old_name) :]
+                break
+        names.append(name)
+    update_module_dependencies(graph, module, names)
+
+
+def get_module_dependencies(graph: Graph, module: Module) -> list[Module]:
+    return resolve_dependencies(graph, module, find_imports(module))
+
+
+def find_module_files(path: Path, package: str | None = None) -> list[tuple[Path, str]]:
+    """
+    List python files of a folder, recursively.
+
+    Args:
+        path (`Path`): folder
+        package (`str | None`): package of the folder
+
+    Returns:
+        `list[tuple[Path, str]]`: path and package of each module
+    """
     if package is None:
         package = ""
+    files: list[tuple[Path, str]] = []
     for file in path.iterdir():
         file_package = package.split(".")
         file_package.append(file.name)
         if file.is_dir():
-            add_nodes_to_graph(graph, file, ".".join(file_package))
+            files.extend(find_module_files(file, ".".join(file_package)))
         elif file.suffix == ".py":
-            mod = get_module(file, package)
-            graph.add_node(mod)
+            files.append((file, package))
+    return files
+
+
+def add_nodes_to_graph(graph: Graph, path: Path, package: str | None = None) -> None:
+    for file, file_package in find_module_files(path, package):
+        graph.add_node(get_module(file, file_package))
 
 
 def add_edges_to_graph(graph: Graph):
@@ -112,22 +381,156 @@ def add_edges_to_graph(graph: Graph):
             graph.add_edge((mod, dependency))
 
 
-def build_project_graph(config: Config) -> Graph:
+def project_files(config: Config) -> list[tuple[Path, str]]:
+    root = Path(config.root)
+    if config.folders is None:
+        return find_module_files(root)
+    files: list[tuple[Path, str]] = []
+    for folder in config.folders:
+        files.extend(find_module_files(root / folder, folder))
+    return files
+
+
+def project_file_package(config: Config, path: Path) -> str | None:
     """
-    Build dependency graph of a project
+    Package of a python file of the project, as given by `project_files`.
 
     Args:
         config (`Config`):
+        path (`Path`): path to the file, which may not exist anymore
 
     Returns:
-        `Graph`:
+        `str | None`: None if the file is not part of the project
     """
+    if path.suffix != ".py":
+        return None
     root = Path(config.root)
-    graph: Graph = Graph()
-    if config.folders is not None:
-        for folder in config.folders:
-            add_nodes_to_graph(graph, root / folder, folder)
+    for folder in [""] if config.folders is None else config.folders:
+        try:
+            relative = path.relative_to(root / folder)
+        except ValueError:
+            continue
+        return (
+            ".".join([folder, *relative.parent.parts])
+            if relative.parent.parts
+            else folder
+        )
+    return None
+
+
+def build_project_graph(
+    config: Config, use_cache: bool = False, progress: ProgressCallback | None = None
+) -> Graph:
+    """
+    Build dependency graph of a project.
+    Files are read, parsed and their imports extracted by `index_modules`,
+    possibly in parallel (see `Config.workers`). Edges are then resolved
+    serially, so the graph does not depend on the number of workers.
+
+    Args:
+        config (`Config`):
+        use_cache (`bool`): only reparse files that changed since the last
+            cached build
+        progress (`ProgressCallback | None`): called as files are indexed
+
+    Returns:
+        `Graph`:
+    """
+    tree_cache = TreeCache(
+        max_trees=config.tree_cache_size,
+        max_bytes=config.tree_cache_bytes,
+        keep_text=config.tree_cache_keep_text,
+    )
+    graph: Graph = Graph(tree_cache=tree_cache)
+    files = project_files(config)
+    if use_cache:
+        indexes = index_modules_cached(config, files, progress)
     else:
-        add_nodes_to_graph(graph, root)
-    add_edges_to_graph(graph)
+        indexes = index_modules(files, config.workers, config.fast_imports, progress)
+    for index in indexes:
+        graph.add_node(index.module)
+    for index in indexes:
+        # names are sorted so that edge order does not depend on string
+        # hashing, which differs between worker processes
+        update_module_dependencies(graph, index.module, index.imports)
     return graph
+
+
+PARALLEL_UPDATE_MIN_FILES = 64
+"""Smallest batch of files `update_project_files` indexes over a process pool"""
+
+
+def update_project_files(
+    graph: Graph, config: Config, paths: Sequence[Path]
+) -> list[Module]:
+    """
+    Apply a batch of file system changes to the graph. Existing files are
+    indexed again, or added to the graph. Modules whose file does not exist
+    anymore are removed, or renamed if a new file has the same content.
+
+    Besides the changed modules, only the importers of modules that were
+    added, removed or renamed are resolved again.
+
+    Args:
+        graph (`Graph`): dependency graph
+        config (`Config`): project config
+        paths (`Sequence[Path]`): created, changed or deleted files, in any
+            order
+
+    Returns:
+        `list[Module]`: modules whose dependencies were updated
+    """
+    files: list[tuple[Path, str]] = []
+    removed: dict[str, Module] = {}
+    for path in sorted(set(paths)):
+        package = project_file_package(config, path)
+        if package is None:
+            continue
+        if path.is_file():
+            files.append((path, package))
+            continue
+        node = graph.get_node(f"{package}.{path.stem}")
+        if node is not None:
+            removed[node.full_mod_name] = node
+
+    removed_hashes: dict[str, Module] = {}
+    for node in removed.values():
+        try:
+            removed_hashes[hash_text(node.text)] = node
+        except OSError:
+            # the text was released, the module cannot be matched to a new file
+            continue
+
+    workers = config.workers if len(files) >= PARALLEL_UPDATE_MIN_FILES else 1
+    updated: dict[str, tuple[Module, set[str]]] = {}
+    moved: set[str] = set(removed)
+    for index in index_modules(files, workers, config.fast_imports):
+        node = graph.get_node(index.module.full_mod_name)
+        if node is not None:
+            node.text = index.module.text
+            node.definitions = index.module.definitions
+            node.spans = index.module.spans
+        else:
+            node = removed_hashes.pop(index.sha256, None)
+            if node is not None:
+                del removed[node.full_mod_name]
+                graph.rename_node(
+                    node, index.module.package, index.module.name, index.module.url
+                )
+            else:
+                node = index.module
+                graph.add_node(node)
+            moved.add(node.full_mod_name)
+        updated[node.full_mod_name] = (node, index.imports)
+    graph.remove_nodes(list(removed.values()))
+
+    for name in sorted(moved):
+        for importer in graph.importers(name):
+            if importer.full_mod_name not in updated:
+                updated[importer.full_mod_name] = (
+                    importer,
+                    set(graph.get_imports(importer)),
+                )
+    for node, imports in updated.values():
+        update_module_dependencies(graph, node, imports)
+    return [node for node, _ in updated.values()]
@@ -1,6 +1,8 @@
+import ast
+from collections.abc import Iterable, Iterator, Sequence
+
 import libcst
 from libcst.metadata import (
-    MetadataWrapper,
     QualifiedNameProvider,
     QualifiedNameSource,
 )
@@ -18,31 +20,495 @@ def get_module_name(node: libcst.BaseExpression) -> str:
     raise ValueError
 
 
+STAR_IMPORT = "*"
+"""Last part of the name recorded for `from module import *`"""
+
+
 class ImportedSymbolsCollector(libcst.CSTVisitor):
     METADATA_DEPENDENCIES = (QualifiedNameProvider,)
 
     def __init__(self):
         self.imported_symbols: set[str] = set()
 
-    def visit_Name(self, node: libcst.Name) -> bool:
+    def _add_imported_names(self, node: libcst.CSTNode) -> bool:
+        # a name bound by several imports (e.g. in try/except ImportError)
+        # depends on all of them
         qualified_names = self.get_metadata(QualifiedNameProvider, node, default=set())
-        for name in qualified_names:
-            if name.source == QualifiedNameSource.IMPORT:
-                self.imported_symbols.add(name.name)
-                return False
-        return True
+        imported = {
+            name.name
+            for name in qualified_names
+            if name.source == QualifiedNameSource.IMPORT
+        }
+        self.imported_symbols |= imported
+        return not imported
+
+    def visit_Name(self, node: libcst.Name) -> bool:
+        return self._add_imported_names(node)
 
     def visit_Attribute(self, node: libcst.Attribute) -> bool:
-        qualified_names = self.get_metadata(QualifiedNameProvider, node, default=set())
-        for name in qualified_names:
-            if name.source == QualifiedNameSource.IMPORT:
-                self.imported_symbols.add(name.name)
-                return False
-        return True
+        return self._add_imported_names(node)
+
+    def visit_ImportFrom(self, node: libcst.ImportFrom) -> None:
+        # the names bound by a star import are unknown, the module is recorded
+        if isinstance(node.names, libcst.ImportStar):
+            module = get_module_name(node.module) if node.module is not None else ""
+            self.imported_symbols.add(
+                "." * len(node.relative) + module + "." + STAR_IMPORT
+            )
 
 
 def find_imports(module: Module) -> set[str]:
-    wrapper = MetadataWrapper(module.cst)
     imported_symbols = ImportedSymbolsCollector()
-    wrapper.visit(imported_symbols)
+    module.metadata.visit(imported_symbols)
     return imported_symbols.imported_symbols
+
+
+# Fast import extraction.
+#
+# `find_imports` resolves the qualified name of every Name and Attribute with
+# libcst's `QualifiedNameProvider`, which needs a full scope analysis of the
+# CST. To build the dependency graph we only need the names bound by import
+# statements and where they are used, so `find_imports_fast` does the same
+# analysis on a stdlib `ast` tree, restricted to import bindings. It follows
+# the rules of libcst's `ScopeProvider` (scope visibility, global/nonlocal
+# overwrites, accesses only seeing earlier assignments of their own scope, all
+# the imports binding a name) so that both functions return the same names.
+
+
+class _Assignment:
+    def __init__(
+        self,
+        scope: "_Scope",
+        index: int,
+        statement: ast.Import | ast.ImportFrom | None = None,
+    ):
+        self.scope = scope
+        self.index = index
+        self.statement = statement
+
+
+class _Scope:
+    def __init__(self, kind: str, parent: "_Scope | None"):
+        self.kind = kind
+        self.parent = parent
+        self.assignments: dict[str, list[_Assignment]] = {}
+        self.overwrites: dict[str, _Scope] = {}
+        self.count = 0
+
+    @property
+    def globals(self) -> "_Scope":
+        scope = self
+        while scope.parent is not None:
+            scope = scope.parent
+        return scope
+
+    def _is_visible_from(self, from_scope: "_Scope") -> bool:
+        if self.kind == "class":
+            return from_scope.parent is self and from_scope.kind == "annotation"
+        return True
+
+    def _next_visible_parent(
+        self, from_scope: "_Scope", first: "_Scope | None" = None
+    ) -> "_Scope | None":
+        parent = first if first is not None else self.parent
+        while parent is not None and not parent._is_visible_from(from_scope):
+            parent = parent.parent
+        return parent
+
+    def _assignment_target(self, name: str) -> "_Scope":
+        if name in self.overwrites:
+            scope = self._next_visible_parent(self, self.overwrites[name])
+            if scope is not None:
+                return scope._assignment_target(name)
+        return self
+
+    def record(
+        self, name: str, statement: ast.Import | ast.ImportFrom | None = None
+    ) -> None:
+        target = self._assignment_target(name)
+        target.assignments.setdefault(name, []).append(
+            _Assignment(target, target.count, statement)
+        )
+
+    def contains(self, name: str) -> bool:
+        if name in self.overwrites:
+            return self.overwrites[name].contains(name)
+        if self.assignments.get(name):
+            return True
+        parent = self._next_visible_parent(self)
+        return parent is not None and parent.contains(name)
+
+    def resolve(self, name: str, from_scope: "_Scope") -> list[_Assignment]:
+        if self.parent is None:
+            return self.assignments.get(name, [])
+        if name in self.overwrites:
+            scope = self._next_visible_parent(from_scope, self.overwrites[name])
+            return scope.resolve(name, from_scope) if scope is not None else []
+        if self.assignments.get(name):
+            return self.assignments[name]
+        parent = self._next_visible_parent(from_scope)
+        return parent.resolve(name, from_scope) if parent is not None else []
+
+
+def _gen_dotted_names(node: ast.expr) -> Iterator[tuple[str, ast.expr]]:
+    if isinstance(node, ast.Name):
+        yield node.id, node
+    elif isinstance(node, ast.Attribute):
+        value = node.value
+        is_call = isinstance(value, ast.Call)
+        if is_call:
+            value = value.func
+        if not isinstance(value, (ast.Attribute, ast.Name)):
+            return
+        name_values = _gen_dotted_names(value)
+        first = next(name_values, None)
+        if first is None:
+            return
+        if not is_call:
+            yield f"{first[0]}.{node.attr}", node
+        yield first
+        yield from name_values
+
+
+def _get_full_name(node: ast.AST) -> str | None:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        value = _get_full_name(node.value)
+        return None if value is None else f"{value}.{node.attr}"
+    if isinstance(node, ast.Call):
+        return _get_full_name(node.func)
+    if isinstance(node, ast.Subscript):
+        return _get_full_name(node.value)
+    return None
+
+
+def _import_qualified_names(
+    statement: ast.Import | ast.ImportFrom, full_name: str
+) -> set[str]:
+    module = ""
+    if isinstance(statement, ast.ImportFrom):
+        module = "." * statement.level + (statement.module or "")
+    names: set[str] = set()
+    for alias in statement.names:
+        if alias.name == "*":
+            continue
+        parts = alias.name.split(".")
+        for k in range(len(parts), 0, -1):
+            real_name = as_name = ".".join(parts[:k])
+            if module.endswith("."):
+                real_name = f"{module}{real_name}"
+            elif module:
+                real_name = f"{module}.{real_name}"
+            if alias.asname:
+                as_name = alias.asname
+            if not full_name.startswith(as_name):
+                continue
+            remaining_name = full_name.split(as_name, 1)[1]
+            if remaining_name and not remaining_name.startswith("."):
+                continue
+            remaining_name = remaining_name.lstrip(".")
+            names.add(f"{real_name}.{remaining_name}" if remaining_name else real_name)
+            break
+    return names
+
+
+def _assignments_qualified_names(
+    assignments: Iterable[_Assignment], full_name: str
+) -> set[str]:
+    names: set[str] = set()
+    for assignment in assignments:
+        if assignment.statement is not None:
+            names |= _import_qualified_names(assignment.statement, full_name)
+    return names
+
+
+class _ImportScopeVisitor(ast.NodeVisitor):
+    """
+    Builds the scopes of a module and records the assignments and accesses of
+    every name, mirroring libcst's `ScopeVisitor`.
+    """
+
+    def __init__(self):
+        self.scope = _Scope("global", None)
+        self.node_scopes: dict[int, _Scope] = {}
+        self.accesses: list[tuple[ast.Name, _Scope, int, ast.Attribute | None]] = []
+        self._top_level_attributes: list[ast.Attribute | None] = [None]
+
+    def _new_scope(self, kind: str) -> _Scope:
+        self.scope = _Scope(kind, self.scope)
+        return self.scope
+
+    def _visit_in(self, scope: _Scope, nodes: Iterable[ast.AST | None]) -> None:
+        current_scope = self.scope
+        self.scope = scope
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+        self.scope = current_scope
+
+    def _visit_import(self, node: ast.Import | ast.ImportFrom) -> None:
+        for alias in node.names:
+            if alias.name == "*":
+                return
+            if alias.asname is not None:
+                self.scope.record(alias.asname, node)
+                continue
+            parts = alias.name.split(".")
+            for k in range(len(parts), 0, -1):
+                self.scope.record(".".join(parts[:k]), node)
+        self.scope.count += 1
+
+    def visit_Import(self, node: ast.Import) -> None:
+        self._visit_import(node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        self._visit_import(node)
+
+    def visit_Name(self, node: ast.Name) -> None:
+        self.node_scopes[id(node)] = self.scope
+        if isinstance(node.ctx, ast.Store):
+            self.scope.record(node.id)
+        else:
+            self.accesses.append(
+                (node, self.scope, self.scope.count, self._top_level_attributes[-1])
+            )
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        self.node_scopes[id(node)] = self.scope
+        if self._top_level_attributes[-1] is None:
+            self._top_level_attributes[-1] = node
+        self.visit(node.value)
+        if self._top_level_attributes[-1] is node:
+            self._top_level_attributes[-1] = None
+
+    def visit_Call(self, node: ast.Call) -> None:
+        self._top_level_attributes.append(None)
+        self.generic_visit(node)
+        self._top_level_attributes.pop()
+
+    def _visit_arguments(self, args: ast.arguments, outer_scope: _Scope) -> None:
+        all_args = [*args.posonlyargs, *args.args, *args.kwonlyargs]
+        if args.vararg is not None:
+            all_args.append(args.vararg)
+        if args.kwarg is not None:
+            all_args.append(args.kwarg)
+        for arg in all_args:
+            self.scope.record(arg.arg)
+            self._visit_in(outer_scope, [arg.annotation])
+        self._visit_in(outer_scope, [*args.defaults, *args.kw_defaults])
+        self.scope.count += 1
+
+    def _visit_type_params(self, type_params: Sequence[ast.AST]) -> None:
+        for type_param in type_params:
+            self.scope.record(type_param.name)  # type: ignore[attr-defined]
+            bound = getattr(type_param, "bound", None)
+            if bound is not None:
+                self.visit(bound)
+            self.scope.count += 1
+
+    def visit_FunctionDef(self, node: ast.FunctionDef | ast.AsyncFunctionDef) -> None:
+        outer_scope = self.scope
+        self.node_scopes[id(node)] = outer_scope
+        outer_scope.record(node.name)
+        type_params = getattr(node, "type_params", [])
+        if type_params:
+            self._new_scope("annotation")
+            self._visit_type_params(type_params)
+        decorator_scope = self.scope
+        self._new_scope("function")
+        self._visit_arguments(node.args, decorator_scope)
+        for statement in node.body:
+            self.visit(statement)
+        self.scope = decorator_scope
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        if node.returns is not None:
+            self.visit(node.returns)
+        self.scope = outer_scope
+        outer_scope.count += 1
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node: ast.Lambda) -> None:
+        outer_scope = self.scope
+        self._new_scope("function")
+        self._visit_arguments(node.args, outer_scope)
+        self.visit(node.body)
+        self.scope = outer_scope
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        outer_scope = self.scope
+        self.node_scopes[id(node)] = outer_scope
+        outer_scope.record(node.name)
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        type_params = getattr(node, "type_params", [])
+        if type_params:
+            self._new_scope("annotation")
+            self._visit_type_params(type_params)
+        for base in node.bases:
+            self.visit(base)
+        for keyword in node.keywords:
+            self.visit(keyword)
+        self._new_scope("class")
+        for statement in node.body:
+            self.visit(statement)
+        self.scope = outer_scope
+        outer_scope.count += 1
+
+    def _visit_comprehension(
+        self, node: ast.ListComp | ast.SetComp | ast.DictComp | ast.GeneratorExp
+    ) -> None:
+        outer_scope = self.scope
+        first, *others = node.generators
+        self.visit(first.iter)
+        self._new_scope("comprehension")
+        self.visit(first.target)
+        self.scope.count += 1
+        for condition in first.ifs:
+            self.visit(condition)
+        for generator in others:
+            self.visit(generator.target)
+            self.visit(generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+            self.scope.count += 1
+        if isinstance(node, ast.DictComp):
+            self.visit(node.key)
+            self.visit(node.value)
+        else:
+            self.visit(node.elt)
+        self.scope = outer_scope
+
+    visit_ListComp = visit_SetComp = visit_GeneratorExp = _visit_comprehension
+    visit_DictComp = _visit_comprehension
+
+    def visit_For(self, node: ast.For | ast.AsyncFor) -> None:
+        self.visit(node.target)
+        self.scope.count += 1
+        self.visit(node.iter)
+        for statement in [*node.body, *node.orelse]:
+            self.visit(statement)
+
+    visit_AsyncFor = visit_For
+
+    def visit_Global(self, node: ast.Global) -> None:
+        for name in node.names:
+            self.scope.overwrites[name] = self.scope.globals
+        self.scope.count += 1
+
+    def visit_Nonlocal(self, node: ast.Nonlocal) -> None:
+        for name in node.names:
+            if self.scope.parent is not None:
+                self.scope.overwrites[name] = self.scope.parent
+        self.scope.count += 1
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name is not None:
+            self.scope.record(node.name)
+            self.scope.count += 1
+        for statement in node.body:
+            self.visit(statement)
+
+    def visit_TypeAlias(self, node: ast.AST) -> None:
+        outer_scope = self.scope
+        self.visit(node.name)  # type: ignore[attr-defined]
+        self._new_scope("annotation")
+        self._visit_type_params(node.type_params)  # type: ignore[attr-defined]
+        self.visit(node.value)  # type: ignore[attr-defined]
+        self.scope = outer_scope
+        outer_scope.count += 1
+
+    def _visit_assignment(self, node: ast.AST) -> None:
+        self.generic_visit(node)
+        self.scope.count += 1
+
+    visit_Assign = visit_AugAssign = visit_AnnAssign = _visit_assignment
+    visit_NamedExpr = visit_withitem = _visit_assignment
+
+
+class _FastImportsCollector:
+    def __init__(self, tree: ast.Module):
+        scope_visitor = _ImportScopeVisitor()
+        scope_visitor.visit(tree)
+        self.node_scopes = scope_visitor.node_scopes
+        self.access_names: dict[int, tuple[str, list[_Assignment]]] = {}
+        for node, scope, index, attribute in scope_visitor.accesses:
+            self._resolve_access(node, scope, index, attribute)
+        self.imported_symbols: set[str] = set()
+        self._collect(tree)
+
+    def _resolve_access(
+        self,
+        node: ast.Name,
+        scope: _Scope,
+        index: int,
+        attribute: ast.Attribute | None,
+    ) -> None:
+        name: str = node.id
+        access_node: ast.expr = node
+        if attribute is not None:
+            for attr_name, attr_node in _gen_dotted_names(attribute):
+                if scope.contains(attr_name):
+                    name, access_node = attr_name, attr_node
+                    break
+        assignments = scope.resolve(name, scope)
+        previous_assignments = [
+            assignment
+            for assignment in assignments
+            if assignment.scope is not scope or assignment.index < index
+        ]
+        if not previous_assignments and assignments and scope.parent is not None:
+            previous_assignments = scope.parent.resolve(name, scope)
+        _, referents = self.access_names.setdefault(id(access_node), (name, []))
+        referents.extend(previous_assignments)
+
+    def _lookup(self, scope: _Scope, full_name: str | None) -> set[str]:
+        prefix = full_name
+        while prefix:
+            if scope.contains(prefix):
+                return _assignments_qualified_names(
+                    scope.resolve(prefix, scope), full_name or ""
+                )
+            prefix, _, _ = prefix.rpartition(".")
+        return set()
+
+    def _imported_names(self, node: ast.Name | ast.Attribute) -> set[str]:
+        access = self.access_names.get(id(node))
+        if access is not None:
+            name, referents = access
+            return _assignments_qualified_names(referents, name)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            return set()
+        return self._lookup(self.node_scopes[id(node)], _get_full_name(node))
+
+    def _collect(self, node: ast.AST) -> None:
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            names = self._imported_names(node)
+            if names:
+                self.imported_symbols |= names
+                return
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            self.imported_symbols |= self._lookup(self.node_scopes[id(node)], node.name)
+        elif isinstance(node, ast.ImportFrom) and node.names[0].name == STAR_IMPORT:
+            module = "." * node.level + (node.module or "")
+            self.imported_symbols.add(module + "." + STAR_IMPORT)
+        for child in ast.iter_child_nodes(node):
+            self._collect(child)
+
+
+def find_imports_fast(tree: ast.Module) -> set[str]:
+    """
+    Same as `find_imports`, computed from the stdlib `ast` tree of the module
+    instead of a libcst metadata pass.
+
+    Args:
+        tree (`ast.Module`): parsed module
+
+    Returns:
+        `set[str]`: qualified names of the imported symbols used in the module
+    """
+    return _FastImportsCollector(tree).imported_symbols
@@ -0,0 +1,172 @@
+import ast
+import hashlib
+import multiprocessing
+import os
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from pyrefactorlsp.refactor.imports import find_imports, find_imports_fast
+from pyrefactorlsp.refactor.module import (
+    DefinitionSpan,
+    Module,
+    get_definition_spans,
+    get_definitions,
+    get_module,
+)
+
+ProgressCallback = Callable[[int, int], None]
+"""Called with the number of files indexed so far, and the total number of files"""
+
+
+@dataclass
+class ModuleIndex:
+    """
+    Result of indexing a single file: the parsed module, the names it
+    imports and the state of the file when it was read.
+    """
+
+    module: Module
+    imports: set[str]
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class SourceIndex:
+    """Imports and definitions extracted from the source of an edited module"""
+
+    text: str
+    imports: set[str]
+    definitions: list[str]
+    spans: list[DefinitionSpan]
+    sha256: str
+
+
+def index_source(text: str) -> SourceIndex | None:
+    """
+    Extract imports and definitions of a module's source, without building
+    its libcst tree. Safe to run outside of the server's event loop.
+
+    Args:
+        text (`str`): source of the module
+
+    Returns:
+        `SourceIndex | None`: None if the source is not valid python, as
+            happens while the user is typing
+    """
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return None
+    return SourceIndex(
+        text=text,
+        imports=find_imports_fast(tree),
+        definitions=get_definitions(tree),
+        spans=get_definition_spans(tree),
+        sha256=hash_text(text),
+    )
+
+
+def index_module(path: Path, package: str, fast_imports: bool = True) -> ModuleIndex:
+    """
+    Read, parse and extract imports of a module.
+
+    Args:
+        path (`Path`): path to the python file
+        package (`str`): package of the module
+        fast_imports (`bool`): extract imports from the stdlib `ast` tree
+            instead of resolving the qualified names of the libcst tree
+
+    Returns:
+        `ModuleIndex`:
+    """
+    stat = path.stat()
+    module = get_module(path, package)
+    try:
+        tree = ast.parse(module.text)
+    except SyntaxError:
+        # let libcst report the error, or parse what ast does not support
+        tree = None
+    if fast_imports and tree is not None:
+        imports = find_imports_fast(tree)
+    else:
+        imports = find_imports(module)
+        # The tree is parsed again on demand, see `Module.cst`
+        module.release()
+    if tree is not None:
+        module.definitions = get_definitions(tree)
+        module.spans = get_definition_spans(tree)
+    return ModuleIndex(
+        module=module,
+        imports=imports,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        sha256=hash_text(module.text),
+    )
+
+
+def _index_module_star(args: tuple[Path, str, bool]) -> ModuleIndex:
+    return index_module(*args)
+
+
+def resolve_workers(workers: int) -> int:
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def index_modules(
+    files: Sequence[tuple[Path, str]],
+    workers: int = 1,
+    fast_imports: bool = True,
+    progress: ProgressCallback | None = None,
+) -> list[ModuleIndex]:
+    """
+    Index all given files. With more than one worker, files are spread over a
+    process pool. Results are returned in the same order as `files` in both
+    cases.
+
+    Args:
+        files (`Sequence[tuple[Path, str]]`): (path, package) of each module
+        workers (`int`): number of processes. 0 uses all CPUs.
+        fast_imports (`bool`): see `index_module`
+        progress (`ProgressCallback | None`): called after each indexed file
+
+    Returns:
+        `list[ModuleIndex]`:
+    """
+    workers = min(resolve_workers(workers), len(files))
+    if workers <= 1:
+        return _collect_indexes(
+            (index_module(path, package, fast_imports) for path, package in files),
+            len(files),
+            progress,
+        )
+    chunksize = max(1, len(files) // (workers * 4))
+    # spawn: the server is multi-threaded and forking it is not safe
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        args = [(path, package, fast_imports) for path, package in files]
+        return _collect_indexes(
+            executor.map(_index_module_star, args, chunksize=chunksize),
+            len(files),
+            progress,
+        )
+
+
+def _collect_indexes(
+    indexes: Iterable[ModuleIndex], total: int, progress: ProgressCallback | None
+) -> list[ModuleIndex]:
+    collected: list[ModuleIndex] = []
+    for index in indexes:
+        collected.append(index)
+        if progress is not None:
+            progress(len(collected), total)
+    return collected
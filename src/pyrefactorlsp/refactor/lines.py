@@ -0,0 +1,94 @@
+import re
+from bisect import bisect_right
+
+from lsprotocol.types import Position, PositionEncodingKind
+
+# Line terminators of the LSP specification
+NEWLINE = re.compile(r"\r\n|\r|\n")
+
+
+class LineIndex:
+    """
+    Converts offsets of a text to LSP positions and back.
+
+    The offsets of line starts are computed once, and each conversion is a
+    binary search over them. Columns are counted in code units of the position
+    encoding: UTF-16 by default, as required by LSP.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        encoding: PositionEncodingKind | str = PositionEncodingKind.Utf16,
+    ):
+        self.text = text
+        self.encoding = PositionEncodingKind(encoding)
+        self.line_starts = [0]
+        self.line_starts.extend(match.end() for match in NEWLINE.finditer(text))
+        # columns are plain offsets when no character needs several code units
+        self._is_ascii = text.isascii()
+
+    def __len__(self) -> int:
+        """Number of lines"""
+        return len(self.line_starts)
+
+    def line_col(self, offset: int) -> tuple[int, int]:
+        """
+        Line and column of an offset of the text.
+
+        Args:
+            offset (`int`): offset in the text, between 0 and its length
+
+        Returns:
+            `tuple[int, int]`: line, and column in code units
+        """
+        if not 0 <= offset <= len(self.text):
+            raise IndexError(f"Offset {offset} is out of the text")
+        line = bisect_right(self.line_starts, offset) - 1
+        line_start = self.line_starts[line]
+        if self._is_ascii or self.encoding == PositionEncodingKind.Utf32:
+            return line, offset - line_start
+        return line, self._code_units(self.text[line_start:offset])
+
+    def position(self, offset: int) -> Position:
+        line, character = self.line_col(offset)
+        return Position(line=line, character=character)
+
+    def offset(self, position: Position) -> int:
+        """
+        Offset of a position. Like LSP clients, positions after the end of a
+        line are clamped to the line end, and lines after the end of the text
+        to the text end.
+
+        Args:
+            position (`Position`):
+
+        Returns:
+            `int`: offset in the text
+        """
+        if position.line >= len(self.line_starts):
+            return len(self.text)
+        line_start = self.line_starts[position.line]
+        line_end = self._line_end(position.line)
+        if self._is_ascii or self.encoding == PositionEncodingKind.Utf32:
+            return min(line_start + position.character, line_end)
+        units = 0
+        for offset in range(line_start, line_end):
+            units += self._code_units(self.text[offset])
+            if units > position.character:
+                return offset
+        return line_end
+
+    def _line_end(self, line: int) -> int:
+        """Offset of the line terminator of a line, or of the text end"""
+        if line + 1 == len(self.line_starts):
+            return len(self.text)
+        match = NEWLINE.search(self.text, self.line_starts[line])
+        return match.start() if match is not None else len(self.text)
+
+    def _code_units(self, text: str) -> int:
+        if self.encoding == PositionEncodingKind.Utf8:
+            return len(text.encode("utf-8"))
+        if self.encoding == PositionEncodingKind.Utf16:
+            return len(text.encode("utf-16-le")) // 2
+        return len(text)
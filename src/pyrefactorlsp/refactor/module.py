@@ -1,7 +1,11 @@
+import ast
+from bisect import bisect_right
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from pathlib import Path
 
 import libcst
+from libcst.metadata import MetadataWrapper
 
 from pyrefactorlsp.constants import LOGGER
 
@@ -11,10 +15,81 @@ class Symbol:
     name: str
 
 
-@dataclass
+@dataclass(frozen=True)
+class DefinitionSpan:
+    """Lines of a function or class defined at the top-level of a module"""
+
+    name: str
+
+    start_line: int
+    """First line, including decorators, starting at 1 like libcst positions"""
+
+    line: int
+    """Line of the `def` or `class` keyword"""
+
+    end_line: int
+    """Last line, included"""
+
+
+TREE_BYTES_PER_CHAR = 40
+"""Rough memory footprint of a libcst tree per character of source"""
+
+
+class TreeCache:
+    """
+    Least-recently-used set of modules whose syntax tree is in memory.
+    When the number of trees or their estimated size goes over the limits,
+    the oldest trees are released (see `Module.release`).
+    """
+
+    def __init__(
+        self,
+        max_trees: int | None = None,
+        max_bytes: int | None = None,
+        keep_text: bool = True,
+    ):
+        self.max_trees = max_trees
+        self.max_bytes = max_bytes
+        self.keep_text = keep_text
+        self.total_bytes = 0
+        self._sizes: OrderedDict[Module, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def touch(self, module: "Module") -> None:
+        """Mark the tree of the module as the most recently used one."""
+        if module in self._sizes:
+            self._sizes.move_to_end(module)
+            return
+        size = len(module._text or "") * TREE_BYTES_PER_CHAR
+        self._sizes[module] = size
+        self.total_bytes += size
+        self._evict()
+
+    def discard(self, module: "Module") -> None:
+        self.total_bytes -= self._sizes.pop(module, 0)
+
+    def _is_full(self) -> bool:
+        if self.max_trees is not None and len(self._sizes) > self.max_trees:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def _evict(self) -> None:
+        # The most recent tree is always kept, even if it is too large
+        while len(self._sizes) > 1 and self._is_full():
+            module, size = self._sizes.popitem(last=False)
+            self.total_bytes -= size
+            module._drop(self.keep_text)
+
+
+@dataclass(eq=False, init=False)
 class Module:
     """
-    Graph nodes are Modules.
+    Graph nodes are Modules. They compare by identity.
+
+    The text and syntax tree are loaded lazily, and can be released to save
+    memory. Symbols and definitions always stay in memory.
     """
 
     url: Path
@@ -26,22 +101,230 @@ class Module:
     name: str
     """Name of the module"""
 
-    text: str
-    """Text content of the module"""
+    symbols: set[Symbol]
+
+    definitions: list[str]
+    """Names defined at the top-level of the module"""
+
+    spans: list[DefinitionSpan]
+    """Top-level functions and classes of the module, sorted by line"""
+
+    tree_cache: TreeCache | None
+    """LRU the syntax tree is registered in, if any"""
+
+    _text: str | None = field(repr=False)
+    _cst: libcst.Module | None = field(repr=False)
+    _is_modified: bool = field(repr=False)
+    _base_cst: libcst.Module | None = field(repr=False)
+    _metadata: MetadataWrapper | None = field(repr=False)
+
+    def __init__(
+        self,
+        url: Path,
+        package: str,
+        name: str,
+        text: str | None = None,
+        symbols: set[Symbol] | None = None,
+        definitions: list[str] | None = None,
+        spans: list[DefinitionSpan] | None = None,
+    ):
+        self.url = url
+        self.package = package
+        self.name = name
+        self.symbols = symbols if symbols is not None else set()
+        self.definitions = definitions if definitions is not None else []
+        self.spans = spans if spans is not None else []
+        self.tree_cache = None
+        self._text = text
+        self._cst = None
+        self._is_modified = False
+        self._base_cst = None
+        self._metadata = None
+
+    def __getstate__(self) -> dict:
+        # Modules are sent to and from indexing processes without their LRU
+        return {**self.__dict__, "tree_cache": None, "_metadata": None}
+
+    @property
+    def text(self) -> str:
+        """Text content of the module, read from `url` if it was released"""
+        if self._text is None:
+            with open(self.url, "r") as f:
+                self._text = f.read()
+        return self._text
+
+    @text.setter
+    def text(self, text: str) -> None:
+        """Replace the text of the module, the tree is parsed again on demand"""
+        self._text = text
+        self._cst = None
+        self._is_modified = False
+        self._base_cst = None
+        self._metadata = None
+        if self.tree_cache is not None:
+            self.tree_cache.discard(self)
+
+    @property
+    def cst(self) -> libcst.Module:
+        """Concrete syntax tree of the module, parsed from `text` on first access"""
+        if self._cst is None:
+            self._cst = libcst.parse_module(self.text)
+            self._is_modified = False
+        if self.tree_cache is not None:
+            self.tree_cache.touch(self)
+        return self._cst
+
+    @cst.setter
+    def cst(self, cst: libcst.Module) -> None:
+        if not self._is_modified:
+            self._base_cst = self._cst
+        self._cst = cst
+        self._is_modified = True
+        self._metadata = None
+        if self.tree_cache is not None:
+            self.tree_cache.touch(self)
+
+    @property
+    def code(self) -> str:
+        """Current code of the module: its text, or the code of its modified tree"""
+        if self._cst is not None and self._is_modified:
+            return self._cst.code
+        return self.text
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the syntax tree is in memory"""
+        return self._cst is not None
+
+    @property
+    def metadata(self) -> MetadataWrapper:
+        """
+        Metadata of `cst`, shared by all the visitors and transformers of the
+        module so that each provider is resolved once per tree. The tree is not
+        copied, and the metadata is dropped when the tree is replaced or
+        released.
+        """
+        cst = self.cst
+        if self._metadata is None or self._metadata.module is not cst:
+            self._metadata = MetadataWrapper(cst, unsafe_skip_copy=True)
+        return self._metadata
+
+    @property
+    def base_cst(self) -> libcst.Module | None:
+        """
+        Tree parsed from `text`, before it was modified. Statements the
+        refactors did not touch are shared with `cst`. None if the tree was not
+        modified, or if the changes were written back to `text`.
+        """
+        return self._base_cst
+
+    def release(self, keep_text: bool = True) -> None:
+        """
+        Drop the syntax tree, and the text if `keep_text` is False. A tree that
+        was modified is first written back to the text, which is then kept.
+
+        Args:
+            keep_text (`bool`): keep the text in memory
+        """
+        self._drop(keep_text)
+        if self.tree_cache is not None:
+            self.tree_cache.discard(self)
 
-    cst: libcst.Module
+    def _drop(self, keep_text: bool) -> None:
+        if self._cst is not None and self._is_modified:
+            self._text = self._cst.code
+            keep_text = True
+        self._cst = None
+        self._is_modified = False
+        self._base_cst = None
+        self._metadata = None
+        if not keep_text:
+            self._text = None
 
-    symbols: set[Symbol] = field(default_factory=set)
+    def definition_at(self, line: int) -> DefinitionSpan | None:
+        """
+        Top-level function or class containing a line, found by binary search
+        in `spans`.
+
+        Args:
+            line (`int`): line number, starting at 1
+
+        Returns:
+            `DefinitionSpan | None`:
+        """
+        index = bisect_right(self.spans, line, key=lambda span: span.start_line)
+        if index == 0:
+            return None
+        span = self.spans[index - 1]
+        return span if line <= span.end_line else None
 
     @property
     def full_mod_name(self):
         return f"{self.package}.{self.name}"
 
 
+def get_definitions(tree: ast.Module) -> list[str]:
+    """
+    Names of the functions, classes and variables defined at the top-level of
+    a module.
+
+    Args:
+        tree (`ast.Module`): parsed module
+
+    Returns:
+        `list[str]`:
+    """
+    definitions: list[str] = []
+    for statement in tree.body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions.append(statement.name)
+            continue
+        if isinstance(statement, ast.Assign):
+            targets = statement.targets
+        elif isinstance(statement, ast.AnnAssign):
+            targets = [statement.target]
+        else:
+            continue
+        for target in targets:
+            if isinstance(target, ast.Name):
+                definitions.append(target.id)
+            elif isinstance(target, ast.Tuple):
+                definitions.extend(
+                    element.id
+                    for element in target.elts
+                    if isinstance(element, ast.Name)
+                )
+    return definitions
+
+
+def get_definition_spans(tree: ast.Module) -> list[DefinitionSpan]:
+    """
+    Lines of the functions and classes defined at the top-level of a module.
+
+    Args:
+        tree (`ast.Module`): parsed module
+
+    Returns:
+        `list[DefinitionSpan]`: sorted by line
+    """
+    return [
+        DefinitionSpan(
+            name=statement.name,
+            start_line=min(
+                [statement.lineno]
+                + [decorator.lineno for decorator in statement.decorator_list]
+            ),
+            line=statement.lineno,
+            end_line=statement.end_lineno or statement.lineno,
+        )
+        for statement in tree.body
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+
+
 def get_module(path: Path, package: str) -> Module:
     LOGGER.debug(path)
     with open(path, "r") as f:
         text = f.read()
-        cst = libcst.parse_module(text)
 
-    return Module(url=path, package=package, name=path.stem, text=text, cst=cst)
+    return Module(url=path, package=package, name=path.stem, text=text)
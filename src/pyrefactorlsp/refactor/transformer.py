@@ -0,0 +1,40 @@
+from libcst import CSTNode, CSTTransformer, FlattenSentinel, RemovalSentinel
+
+
+class KeepUnchangedTransformer(CSTTransformer):
+    """
+    Transformer returning the original nodes of the subtrees it did not
+    change.
+
+    libcst rebuilds every node it visits, even when no `leave_` method touched
+    it. With this base class, untouched statements keep their identity across
+    refactors, so their code does not have to be generated and diffed again
+    (see `get_statement_edits`). Subclasses calling `__init__` must call
+    `super().__init__()`.
+
+    Trees are shared between modules and refactors instead of being copied:
+    metadata is computed on them with `unsafe_skip_copy` (see
+    `Module.metadata`). Metadata is keyed by node identity, so a node must not
+    appear twice in a tree. Nodes built by transformers must not reuse libcst
+    default nodes, like the `dot` of `Attribute`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # whether a node was replaced in each subtree being visited
+        self._changed: list[bool] = []
+
+    def on_visit(self, node: CSTNode) -> bool:
+        self._changed.append(False)
+        return super().on_visit(node)
+
+    def on_leave(
+        self, original_node: CSTNode, updated_node: CSTNode
+    ) -> CSTNode | RemovalSentinel | FlattenSentinel[CSTNode]:
+        changed = self._changed.pop()
+        result = super().on_leave(original_node, updated_node)
+        if result is updated_node and not changed:
+            return original_node
+        if self._changed:
+            self._changed[-1] = True
+        return result
@@ -0,0 +1,18 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.generate import IMPORT_STYLES, ProjectSpec, generate_project
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+
+
+@pytest.mark.parametrize("style", IMPORT_STYLES)
+def test_generated_project_graph(tmp_path: Path, style: str):
+    spec = ProjectSpec(modules=30, modules_per_package=10, import_styles=[style])
+    project = generate_project(tmp_path / "project", spec)
+    graph = build_project_graph(get_project_config(project.root))
+
+    edges = {(a.full_mod_name, b.full_mod_name) for a, b in graph.edges}
+    assert edges == project.edges
+    assert len(graph.nodes) == spec.modules + 4  # __init__ of bench and pkg_<n>
@@ -1,6 +1,7 @@
 from pathlib import Path
 
-from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.graph import build_project_graph, update_module_dependencies
+from pyrefactorlsp.refactor.index import index_source
 from pyrefactorlsp.refactor.load import get_project_config
 
 here = Path(__file__).parent
@@ -28,3 +29,58 @@ def test_add_nodes():
     for edge_start, edge_end in graph.edges:
         graph_edges.add((edge_start.full_mod_name, edge_end.full_mod_name))
     assert expected_graph_edges == graph_edges
+
+
+def test_parallel_build_matches_serial():
+    config = get_project_config(here / "sample_project")
+    serial_graph = build_project_graph(config)
+    parallel_graph = build_project_graph(config.model_copy(update={"workers": 2}))
+
+    def named_edges(graph):
+        return [(a.full_mod_name, b.full_mod_name) for a, b in graph.edges]
+
+    assert [mod.full_mod_name for mod in parallel_graph.nodes] == [
+        mod.full_mod_name for mod in serial_graph.nodes
+    ]
+    assert named_edges(parallel_graph) == named_edges(serial_graph)
+    for serial_mod, parallel_mod in zip(serial_graph.nodes, parallel_graph.nodes):
+        assert parallel_mod.text == serial_mod.text
+        assert parallel_mod.symbols == serial_mod.symbols
+
+
+def test_update_module_dependencies():
+    config = get_project_config(here / "sample_project")
+    graph = build_project_graph(config)
+    mod2 = graph.get_node("sample_project.pkg.mod2")
+    assert mod2 is not None
+
+    index = index_source("from sample_project.mod4 import b\n\nb\n")
+    assert index is not None
+    mod2.text = index.text
+    update_module_dependencies(graph, mod2, index.imports)
+
+    assert [child.full_mod_name for child in graph.children(mod2)] == [
+        "sample_project.mod4"
+    ]
+    # edges pointing to the module are kept
+    assert {parent.full_mod_name for parent in graph.parents(mod2)} == {
+        "sample_project.mod1",
+        "sample_project.mod1_2",
+        "sample_project.mod1_3",
+    }
+    assert mod2.cst.code == index.text
+
+
+def test_index_source_with_syntax_error():
+    assert index_source("from sample_project import (\n") is None
+
+
+def test_build_progress():
+    config = get_project_config(here / "sample_project")
+    reports: list[tuple[int, int]] = []
+    graph = build_project_graph(
+        config, progress=lambda done, total: reports.append((done, total))
+    )
+    assert reports == [
+        (done, len(graph.nodes)) for done in range(1, len(graph.nodes) + 1)
+    ]
@@ -0,0 +1,68 @@
+import shutil
+from pathlib import Path
+
+import libcst
+import pytest
+
+from pyrefactorlsp.refactor.actions.move_symbol_source import move_symbol_source
+from pyrefactorlsp.refactor.actions.move_symbol_target import move_symbol_target
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+
+here = Path(__file__).parent
+
+
+class NodeCounter(libcst.CSTVisitor):
+    def __init__(self):
+        self.seen: set[int] = set()
+        self.shared: list[libcst.CSTNode] = []
+
+    def on_visit(self, node: libcst.CSTNode) -> bool:
+        if id(node) in self.seen:
+            self.shared.append(node)
+        self.seen.add(id(node))
+        return True
+
+
+def shared_nodes(tree: libcst.Module) -> list[libcst.CSTNode]:
+    counter = NodeCounter()
+    tree.visit(counter)
+    return counter.shared
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    shutil.copytree(here / "sample_project", tmp_path / "sample_project")
+    package = tmp_path / "sample_project" / "sample_project"
+    (package / "user.py").write_text(
+        "from sample_project.mod1 import test_func, z\n\nx = 1\ntest_func(z)\n"
+    )
+    return tmp_path / "sample_project"
+
+
+def test_move_does_not_copy_trees(project: Path):
+    graph = build_project_graph(get_project_config(project))
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    user = graph.get_node("sample_project.user")
+    assert mod1 is not None and mod4 is not None and user is not None
+    trees = {mod: mod.cst for mod in (mod1, mod4, user)}
+
+    move = move_symbol_source(mod1, 13, 3)
+    # the symbol is the node of the module's tree, so `original_node ==
+    # self.symbol` identifies it while removing it
+    assert any(statement is move.symbol for statement in trees[mod1].body)
+    assert not any(statement is move.symbol for statement in move.updated_source.body)
+    assert mod1.metadata.module is trees[mod1]
+
+    updated = move_symbol_target(graph, mod4, move, 2)
+
+    assert updated == [mod1, mod4, user]
+    assert any(statement is move.symbol for statement in mod4.cst.body)
+    for mod, tree in trees.items():
+        # refactors start from the parsed tree, and keep its untouched nodes
+        assert mod.base_cst is tree
+        kept = [s for s in tree.body if any(s is t for t in mod.cst.body)]
+        assert kept
+        assert mod.metadata.module is mod.cst
+        assert shared_nodes(mod.cst) == []
@@ -1,8 +1,17 @@
+import random
+from itertools import pairwise
+
+import pytest
+from lsprotocol.types import Position, PositionEncodingKind
+
 from pyrefactorlsp.refactor.diffs import (
+    EditBlock,
     get_diffs,
     get_text_edits,
+    myers_hunks,
     str_index_to_line_offset,
 )
+from pyrefactorlsp.refactor.lines import LineIndex
 
 
 def update_str(s, r, start, end):
@@ -47,3 +56,91 @@ def test_get_text_edits():
     s2 = "This is a text\nwith many lines\nand some differences\n sometimes."
     text_edits = get_text_edits(s1, s2)
     print(text_edits)
+
+
+def test_line_index():
+    text = "a = 1\r\nb = 2\rc = 3\n"
+    line_index = LineIndex(text)
+    assert len(line_index) == 4
+    assert line_index.line_col(0) == (0, 0)
+    assert line_index.line_col(text.index("b")) == (1, 0)
+    assert line_index.line_col(text.index("c") + 2) == (2, 2)
+    assert line_index.line_col(len(text)) == (3, 0)
+    for offset in range(len(text) + 1):
+        if text[offset - 1 : offset + 1] != "\r\n":
+            assert line_index.offset(line_index.position(offset)) == offset
+
+
+@pytest.mark.parametrize(
+    ("encoding", "column"),
+    [
+        (PositionEncodingKind.Utf8, 13),
+        (PositionEncodingKind.Utf16, 10),
+        (PositionEncodingKind.Utf32, 9),
+    ],
+)
+def test_line_index_encodings(encoding: PositionEncodingKind, column: int):
+    text = "x\ns = '😀é' + y\n"
+    line_index = LineIndex(text, encoding)
+    offset = text.index("+")
+    assert line_index.line_col(offset) == (1, column)
+    assert line_index.offset(Position(line=1, character=column)) == offset
+
+
+def apply_blocks(s: str, blocks) -> str:
+    for block in reversed(blocks):
+        s = update_str(s, block.replacement, block.start, block.start + block.length)
+    return s
+
+
+def test_get_text_edits_at_end_of_text():
+    text_edits = get_text_edits("a = 1\n", "a = 1\nb = 2\n")
+    assert [
+        (edit.range.start, edit.range.end, edit.new_text) for edit in text_edits
+    ] == [(Position(line=1, character=0), Position(line=1, character=0), "b = 2\n")]
+
+
+def test_diffs_are_refined_per_character():
+    s1 = "a = 1\nb = 2\nc = 3\n"
+    s2 = "a = 1\nb = 22\nc = 3\n"
+    assert get_diffs(s1, s2) == [EditBlock(start=11, length=0, replacement="2")]
+
+
+def test_myers_hunks():
+    assert myers_hunks([1, 2, 3, 4], [1, 5, 3, 4, 6], 10) == [
+        (1, 2, 1, 2),
+        (4, 4, 4, 5),
+    ]
+    assert myers_hunks([1, 2, 3, 4], [5, 6, 7, 8], 7) is None
+
+
+def test_diffs_over_max_cost():
+    s1 = "head\na\nb\nc\ntail\n"
+    s2 = "head\nx\ny\nz\ntail\n"
+    assert get_diffs(s1, s2, max_cost=2) == [
+        EditBlock(start=5, length=6, replacement="x\ny\nz\n")
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_diffs(seed: int):
+    rng = random.Random(seed)
+    lines = [
+        rng.choice(["a = 1\n", "b = 2\n", "\n", "def f():\n", "    pass\n"])
+        for _ in range(30)
+    ]
+    updated = list(lines)
+    for _ in range(rng.randrange(1, 8)):
+        position = rng.randrange(len(updated))
+        operation = rng.randrange(3)
+        if operation == 0:
+            del updated[position]
+        elif operation == 1:
+            updated.insert(position, rng.choice(["c = 3\n", "pass\n"]))
+        else:
+            updated[position] = updated[position].replace("=", "==")
+    s1, s2 = "".join(lines), "".join(updated).rstrip("\n")
+    for max_cost in (1000, 1):
+        blocks = get_diffs(s1, s2, max_cost)
+        assert apply_blocks(s1, blocks) == s2
+        assert all(a.start + a.length <= b.start for a, b in pairwise(blocks))
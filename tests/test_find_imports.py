@@ -0,0 +1,89 @@
+import ast
+from pathlib import Path
+
+import pytest
+
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.imports import find_imports, find_imports_fast
+from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.module import Module
+
+here = Path(__file__).parent
+
+snippets = {
+    "dotted_import": "import a.b\na.b.c\na.x\n",
+    "dotted_import_alias": "import a.b as c\nc.d.e\n",
+    "from_import_alias": "from a.b import c as d\nd.e\n",
+    "relative_imports": "from . import m\nfrom .. import n as nn\nfrom ..q import r\nm.a\nnn\nr.s\n",
+    "call_in_chain": "from p import m\nm.f().g\nm.f(m.g)\n",
+    "subscript_in_chain": "from p import m\nm.T[int].x\n",
+    "complex_base": "from p import m\n(m or 1).x\n",
+    "param_shadows_import": "from p import x\ndef f(x):\n    return x\n",
+    "module_reassignment": "from p import x\nx = 1\nprint(x)\n",
+    "store_only": "from p import x\nx = 1\n",
+    "aug_assign": "from p import x\nx += 1\n",
+    "attribute_target": "from p import x\nx.y = 1\ndel x.z\n",
+    "class_scope": "class A:\n    from p import x\n    def f(self):\n        return x\n    y = x\n",
+    "class_scope_default": "class A:\n    from p import x\n    def f(self, a: x = x): pass\n",
+    "method_skips_class": "from p import m\nclass A:\n    m = 1\n    def f(self):\n        return m\n",
+    "comprehension_target": "from p import x\n[x for x in range(3)]\n",
+    "comprehension_iter": "from p import x, y\n[k for k in x]\n{k: x for k in y}\n",
+    "global": "def f():\n    global x\n    from p import x\ndef g():\n    return x\n",
+    "nonlocal": "def f():\n    from p import x\n    def g():\n        nonlocal x\n        return x\n",
+    "local_assigned_later": "from p import x\ndef f():\n    y = x\n    x = 2\n",
+    "nested_function": "from p import x\ndef f():\n    x = 1\n    def g():\n        return x\n",
+    "lambda": "from p import x\nf = lambda x: x\ng = lambda: x\nh = lambda a=x: a\n",
+    "decorators": "import p\n@p.deco\ndef f(): pass\n@p.cls_deco\nclass A(p.Base): pass\n",
+    "star_import": "from p import *\nx\n",
+    "relative_star_import": "from . import *\nfrom ..q import *\n",
+    "del": "import p\ndel p\n",
+    "except_as": "from p import e\ntry: pass\nexcept Exception as e: e\n",
+    "with_as": "from p import x\nwith open() as x: x\n",
+    "type_params": "from p import T\ndef f[T](a: T): pass\ntype X = list[T]\n",
+    "f_string": "from p import x\nf'{x.y}'\n",
+    "string_annotation": "from p import T\ndef f(a: 'T'): pass\n",
+    "keyword_argument": "from p import x\nf(x=x)\n",
+    "try_except_imports": (
+        "try:\n    from _p import x\nexcept ImportError:\n    from p import x\nx.y\n"
+    ),
+    "conditional_imports": (
+        "if a:\n    import p as m\nelse:\n    import q as m\nm.f()\n"
+    ),
+    "import_then_assignment": (
+        "try:\n    import p\nexcept ImportError:\n    p = None\np.x\n"
+    ),
+}
+
+
+def exact_imports(text: str) -> set[str]:
+    return find_imports(
+        Module(url=Path("mod.py"), package="pkg", name="mod", text=text)
+    )
+
+
+@pytest.mark.parametrize("text", snippets.values(), ids=snippets.keys())
+def test_fast_imports_match_find_imports(text: str):
+    assert find_imports_fast(ast.parse(text)) == exact_imports(text)
+
+
+def test_fast_imports_match_find_imports_on_project():
+    config = get_project_config(here / "sample_project")
+    graph = build_project_graph(config)
+    for mod in graph.nodes:
+        assert find_imports_fast(ast.parse(mod.text)) == find_imports(mod)
+
+
+def test_find_imports_records_every_binding():
+    text = snippets["try_except_imports"]
+    assert exact_imports(text) == {"_p.x.y", "p.x.y"}
+
+
+def test_fast_and_exact_graphs_are_equal():
+    config = get_project_config(here / "sample_project")
+    fast_graph = build_project_graph(config)
+    exact_graph = build_project_graph(config.model_copy(update={"fast_imports": False}))
+
+    def named_edges(graph):
+        return [(a.full_mod_name, b.full_mod_name) for a, b in graph.edges]
+
+    assert named_edges(fast_graph) == named_edges(exact_graph)
@@ -0,0 +1,128 @@
+from pathlib import Path
+
+import pytest
+
+from pyrefactorlsp.refactor.format import (
+    FormatCache,
+    find_ruff_config,
+    format_key,
+    reformat_code,
+    reformat_modules,
+    reformat_ranges,
+)
+
+here = Path(__file__).parent
+
+sources = {
+    "pkg.mod1": "import sys\nimport os\nx=[1,\n2]\n",
+    "pkg.__init__": "def f( a ):\n  return a\n",
+    "pkg.sub.mod2": "from pkg import mod1\nimport abc\ny = {'a':1}\n",
+}
+
+
+def test_reformat_modules():
+    formatted = reformat_modules(sources, here.parent)
+    assert formatted == {
+        name: reformat_code(name, source) for name, source in sources.items()
+    }
+    assert formatted["pkg.mod1"] == "import os\nimport sys\n\nx = [1, 2]\n"
+
+
+def test_reformat_modules_fallback():
+    invalid = dict(sources, **{"pkg.invalid": "def f(:\n"})
+    formatted = reformat_modules(invalid, here.parent)
+    assert formatted["pkg.mod1"] == reformat_code("pkg.mod1", sources["pkg.mod1"])
+    assert set(formatted) == set(invalid)
+
+
+def test_find_ruff_config():
+    assert find_ruff_config(here / "sample_project") == here.parent / "pyproject.toml"
+
+
+def test_reformat_ranges():
+    source = (
+        "import sys\nimport os\nx=[1,\n2]\n\n\ndef f( a ):\n  return a\ny={ 1:2 }\n"
+    )
+    sorted_imports = "import os\nimport sys\n\n"
+    start = source.index("def")
+    end = source.index("y=")
+    assert reformat_ranges("mod.py", source, [(start, end)]) == (
+        sorted_imports + "x=[1,\n2]\n\n\ndef f(a):\n    return a\n\n\ny={ 1:2 }\n"
+    )
+    assert reformat_ranges("mod.py", source, [(0, 1), (end, len(source))]) == (
+        sorted_imports + "x=[1,\n2]\n\n\ndef f( a ):\n  return a\ny = {1: 2}\n"
+    )
+    assert reformat_ranges("mod.py", source, []) == (
+        sorted_imports + source[source.index("x=") :]
+    )
+
+
+def test_format_cache():
+    cache = FormatCache(max_entries=2)
+    assert reformat_modules(sources, here.parent, cache) == reformat_modules(sources)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 3, 2)
+    # the two most recent modules are formatted again without ruff
+    names = list(sources)[1:]
+    reformat_modules({name: sources[name] for name in names}, here.parent, cache)
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    key = format_key("pkg.mod1", sources["pkg.mod1"], None)
+    assert cache.get(key) is None
+    cache.put(key, "formatted")
+    assert cache.get(key) == "formatted"
+    assert format_key("pkg.mod1", "x = 2\n", None) != key
+
+    assert reformat_code("mod.py", "x=1\n", cache) == "x = 1\n"
+    assert reformat_code("mod.py", "x=1\n", cache) == "x = 1\n"
+    assert cache.hits == 4
+
+    sized = FormatCache(max_entries=None, max_bytes=10)
+    sized.put(key, "a" * 6)
+    sized.put(format_key("b", "", None), "b" * 6)
+    assert len(sized) == 1 and sized.total_bytes == 6
+
+    disabled = FormatCache(max_entries=0)
+    disabled.put(key, "formatted")
+    assert len(disabled) == 0
+
+
+@pytest.fixture
+def single_quotes_project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "ruff.toml").write_text('[format]\nquote-style = "single"\n')
+    # ruff must not pick the configuration of the working directory
+    monkeypatch.chdir(here)
+    return project
+
+
+def test_reformat_one_module_with_project_config(single_quotes_project: Path):
+    source = 'x = "a"\n'
+    single = reformat_modules({"pkg.a": source}, single_quotes_project)
+    batch = reformat_modules({"pkg.a": source, "pkg.b": "y=1\n"}, single_quotes_project)
+    assert single["pkg.a"] == batch["pkg.a"] == "x = 'a'\n"
+
+
+def test_format_cache_key_uses_project_config(single_quotes_project: Path):
+    cache = FormatCache()
+    source = 'x = "a"\n'
+    reformat_modules({"pkg.a": source}, single_quotes_project, cache)
+    key = format_key("pkg.a", source, single_quotes_project / "ruff.toml")
+    assert cache.get(key) == "x = 'a'\n"
+    batch = reformat_modules(
+        {"pkg.a": source, "pkg.b": "y=1\n"}, single_quotes_project, cache
+    )
+    assert batch["pkg.a"] == "x = 'a'\n"
+    assert reformat_code("pkg.a", source, cache) == 'x = "a"\n'
+
+    piped = FormatCache()
+    reformat_code("pkg.c", source, piped, root=single_quotes_project)
+    key = format_key("pkg.c", source, single_quotes_project / "ruff.toml")
+    assert piped.get(key) == "x = 'a'\n"
+
+
+def test_reformat_ranges_with_project_config(single_quotes_project: Path):
+    source = 'import b\nimport a\nx = "a"\n'
+    assert reformat_ranges("mod.py", source, [(18, 25)], single_quotes_project) == (
+        "import a\nimport b\n\nx = 'a'\n"
+    )
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+from pyrefactorlsp.refactor.graph import Graph
+from pyrefactorlsp.refactor.module import Module
+
+
+def make_module(package: str, name: str) -> Module:
+    return Module(url=Path(f"{name}.py"), package=package, name=name, text="")
+
+
+def test_edges_are_deduplicated():
+    a, b = make_module("pkg", "a"), make_module("pkg", "b")
+    graph = Graph([a, b])
+    graph.add_edge((a, b))
+    graph.add_edge((a, b))
+    assert graph.edges == [(a, b)]
+    assert graph.children(a) == [b]
+    assert graph.parents(b) == [a]
+
+
+def test_node_lookup():
+    init, mod = make_module("pkg", "__init__"), make_module("pkg", "mod")
+    graph = Graph([init, mod])
+    assert graph.node_from_path("pkg.mod") is mod
+    assert graph.node_from_path("pkg") is init
+    assert graph.node_from_path("other") is None
+
+
+def test_node_from_file():
+    a, b = make_module("pkg", "a"), make_module("pkg", "b")
+    graph = Graph([a, b])
+    assert graph.node_from_file(Path("a.py").absolute()) is a
+    assert graph.node_from_file("./b.py") is b
+    graph.rename_node(b, "pkg", "c", Path("c.py"))
+    assert graph.node_from_file("b.py") is None
+    assert graph.node_from_file("c.py") is b
+    graph.remove_nodes([a])
+    assert graph.node_from_file("a.py") is None
+
+
+def test_remove_nodes_and_reset_dependencies():
+    a, b, c = make_module("pkg", "a"), make_module("pkg", "b"), make_module("pkg", "c")
+    graph = Graph([a, b, c], [(a, b), (b, c), (a, c)])
+    graph.reset_dependencies(a)
+    assert not graph.has_edge_from(a)
+    assert graph.parents(c) == [b]
+    graph.remove_nodes([c])
+    assert graph.nodes == [a, b]
+    assert not graph.has_edge_from(b)
+    assert not graph.has_edge_to(c)
+
+
+def test_symbol_users():
+    a, b, c, d = (make_module("pkg", name) for name in "abcd")
+    graph = Graph([a, b, c, d])
+    graph.set_imports(b, {"pkg.a.f": "pkg.a", "pkg.a.g.x": "pkg.a.g"})
+    graph.set_imports(c, {".a.g": "pkg.a"})
+    graph.set_imports(d, {"pkg.a.*": "pkg.a"})
+    assert graph.symbol_users("pkg.a.f") == [b, d]
+    assert graph.symbol_users("pkg.a.g") == [b, c, d]
+    assert graph.symbol_users("pkg.b.f") == []
+
+    graph.set_imports(b, {})
+    assert graph.symbol_users("pkg.a.f") == [d]
+    graph.remove_nodes([d])
+    assert graph.symbol_users("pkg.a.f") == []
+    assert graph.symbol_users("pkg.a.g") == [c]
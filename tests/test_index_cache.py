@@ -0,0 +1,92 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pyrefactorlsp.refactor import cache
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+
+here = Path(__file__).parent
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    shutil.copytree(here / "sample_project", tmp_path / "sample_project")
+    with open(tmp_path / "sample_project" / "pyproject.toml", "a") as f:
+        f.write('cache_dir = ".pyrefactor"\n')
+    return tmp_path / "sample_project"
+
+
+@pytest.fixture
+def indexed_files(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    indexed: list[str] = []
+    index_modules = cache.index_modules
+
+    def recording_index_modules(files, workers=1, fast_imports=True, progress=None):
+        indexed.extend(path.name for path, _ in files)
+        return index_modules(files, workers, fast_imports, progress)
+
+    monkeypatch.setattr(cache, "index_modules", recording_index_modules)
+    return indexed
+
+
+def named_edges(graph) -> set[tuple[str, str]]:
+    return {(a.full_mod_name, b.full_mod_name) for a, b in graph.edges}
+
+
+def test_warm_build_uses_cache(project: Path, indexed_files: list[str]):
+    config = get_project_config(project)
+    cold_graph = build_project_graph(config, use_cache=True)
+    assert (project / ".pyrefactor" / "index.json").exists()
+    assert len(indexed_files) == len(cold_graph.nodes)
+
+    indexed_files.clear()
+    warm_graph = build_project_graph(config, use_cache=True)
+    assert indexed_files == []
+    assert named_edges(warm_graph) == named_edges(cold_graph)
+    mod1 = warm_graph.get_node("sample_project.mod1")
+    assert mod1 is not None
+    assert mod1._cst is None
+    assert "test_func" in mod1.definitions
+
+
+def test_changed_file_is_reparsed(project: Path, indexed_files: list[str]):
+    config = get_project_config(project)
+    build_project_graph(config, use_cache=True)
+
+    (project / "sample_project" / "mod4.py").write_text(
+        "from sample_project.pkg.subpkg.mod3 import a\n\nb = a\n"
+    )
+    indexed_files.clear()
+    graph = build_project_graph(config, use_cache=True)
+    assert indexed_files == ["mod4.py"]
+    assert ("sample_project.mod4", "sample_project.pkg.subpkg.mod3") in named_edges(
+        graph
+    )
+
+
+def test_config_change_invalidates_cache(project: Path, indexed_files: list[str]):
+    config = get_project_config(project)
+    build_project_graph(config, use_cache=True)
+
+    indexed_files.clear()
+    other_config = config.model_copy(update={"project_name": "renamed_project"})
+    graph = build_project_graph(other_config, use_cache=True)
+    assert len(indexed_files) == len(graph.nodes)
+
+
+def test_server_settings_keep_cache(project: Path, indexed_files: list[str]):
+    config = get_project_config(project)
+    build_project_graph(config, use_cache=True)
+
+    indexed_files.clear()
+    other_config = config.model_copy(
+        update={"workers": 2, "reindex_delay": 1.0, "format_edits": "none"}
+    )
+    build_project_graph(other_config, use_cache=True)
+    assert indexed_files == []
+
+    exact_config = config.model_copy(update={"fast_imports": False})
+    graph = build_project_graph(exact_config, use_cache=True)
+    assert len(indexed_files) == len(graph.nodes)
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from pyrefactorlsp.lsp.registry import IndexRegistry
+
+here = Path(__file__).parent
+
+
+def test_index_is_shared_until_last_session_leaves():
+    registry = IndexRegistry()
+    root = str(here / "sample_project")
+    first, second = object(), object()
+
+    index, created = registry.acquire(root, first)
+    assert created
+    assert registry.acquire(root, second) == (index, False)
+    assert registry.acquire(root, second) == (index, False)
+    assert registry.sessions() == {first, second}
+
+    registry.release(root, first)
+    assert registry.get(root) is index
+    registry.release(root, second)
+    assert registry.get(root) is None
+    assert len(registry) == 0
+    assert registry.acquire(root, first)[1]
@@ -0,0 +1,160 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import pyrefactorlsp.refactor.actions.move_symbol_target as move_symbol_target_module
+from pyrefactorlsp.refactor.actions.move_symbol_source import move_symbol_source
+from pyrefactorlsp.refactor.actions.move_symbol_target import (
+    apply_move_symbol_target,
+    move_symbol_target,
+    plan_move_symbol_target,
+)
+from pyrefactorlsp.refactor.cancel import CancellationToken, RefactorCancelled
+from pyrefactorlsp.refactor.diffs import apply_edit_blocks, get_module_edits
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+
+here = Path(__file__).parent
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    shutil.copytree(here / "sample_project", tmp_path / "sample_project")
+    package = tmp_path / "sample_project" / "sample_project"
+    (package / "user.py").write_text(
+        "from sample_project.mod1 import test_func\n\ntest_func(1)\n"
+    )
+    (package / "other.py").write_text("from sample_project import mod1\n\nmod1.z\n")
+    (package / "star.py").write_text("from sample_project.mod1 import *\n")
+    return tmp_path / "sample_project"
+
+
+def test_move_only_rewrites_symbol_users(project: Path):
+    graph = build_project_graph(get_project_config(project))
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    user = graph.get_node("sample_project.user")
+    assert mod1 is not None and mod4 is not None and user is not None
+    assert {mod.name for mod in graph.parents(mod1)} == {"user", "other", "star"}
+
+    move = move_symbol_source(mod1, 13, 3)
+    updated = move_symbol_target(graph, mod4, move, 2)
+
+    assert [mod.name for mod in updated] == ["mod1", "mod4", "user", "star"]
+    assert "from sample_project.mod4 import test_func" in user.cst.code
+    assert graph.children(user) == [mod4]
+    assert graph.symbol_users("sample_project.mod4.test_func") == [user]
+    assert graph.symbol_users("sample_project.mod1.test_func") == [
+        graph.get_node("sample_project.star")
+    ]
+
+
+def test_parallel_rewrite_matches_sequential(
+    project: Path, monkeypatch: pytest.MonkeyPatch
+):
+    def move(workers: int) -> dict[str, str]:
+        graph = build_project_graph(get_project_config(project))
+        mod1 = graph.get_node("sample_project.mod1")
+        mod4 = graph.get_node("sample_project.mod4")
+        assert mod1 is not None and mod4 is not None
+        planned = plan_move_symbol_target(
+            graph, mod4, move_symbol_source(mod1, 13, 3), 2, workers
+        )
+        assert planned is not None
+        for module, tree in planned.trees:
+            blocks = get_module_edits(module, module.text, tree=tree)
+            assert (
+                apply_edit_blocks(module.text, blocks)
+                == planned.codes[module.full_mod_name]
+            )
+        updated = apply_move_symbol_target(graph, planned)
+        return {module.name: module.cst.code for module in updated}
+
+    sequential = move(1)
+    monkeypatch.setattr(move_symbol_target_module, "PARALLEL_REWRITE_MIN_MODULES", 1)
+    assert move(2) == sequential
+    executor = move_symbol_target_module.get_rewrite_executor(2)
+    # the process pool is kept for the next moves
+    assert move(2) == sequential
+    assert move_symbol_target_module.get_rewrite_executor(2) is executor
+
+
+def test_parallel_rewrite_returns_code(project: Path, monkeypatch: pytest.MonkeyPatch):
+    graph = build_project_graph(get_project_config(project))
+    users = [
+        graph.get_node("sample_project.user"),
+        graph.get_node("sample_project.star"),
+    ]
+    assert all(users)
+    monkeypatch.setattr(move_symbol_target_module, "PARALLEL_REWRITE_MIN_MODULES", 1)
+    codes = move_symbol_target_module.replace_imports_in_modules(
+        users, "sample_project.mod1.test_func", "sample_project.mod4.test_func", 2
+    )
+    assert codes[0] == ("from sample_project.mod4 import test_func\n\ntest_func(1)\n")
+    assert all(isinstance(code, str) for code in codes)
+
+
+def test_cancelled_move_leaves_modules_unchanged(project: Path):
+    graph = build_project_graph(get_project_config(project))
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    user = graph.get_node("sample_project.user")
+    assert mod1 is not None and mod4 is not None and user is not None
+    move = move_symbol_source(mod1, 13, 3)
+    token = CancellationToken()
+    token.cancel()
+
+    with pytest.raises(RefactorCancelled):
+        move_symbol_target(graph, mod4, move, 2, token=token)
+
+    assert [mod.code for mod in (mod1, mod4, user)] == [
+        mod.text for mod in (mod1, mod4, user)
+    ]
+    assert graph.children(user) == [mod1]
+    assert graph.symbol_users("sample_project.mod1.test_func") == [
+        user,
+        graph.get_node("sample_project.star"),
+    ]
+
+
+def test_planned_move_leaves_modules_unchanged(project: Path):
+    graph = build_project_graph(get_project_config(project))
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    user = graph.get_node("sample_project.user")
+    assert mod1 is not None and mod4 is not None and user is not None
+    move = plan_move_symbol_target(graph, mod4, move_symbol_source(mod1, 13, 3), 2)
+    assert move is not None
+
+    assert move.modules == [mod1, mod4, user, graph.get_node("sample_project.star")]
+    assert [mod.code for mod in move.modules] == [mod.text for mod in move.modules]
+    assert graph.children(user) == [mod1]
+    planned_edits = [
+        get_module_edits(module, module.text, tree=tree) for module, tree in move.trees
+    ]
+
+    apply_move_symbol_target(graph, move)
+    assert graph.children(user) == [mod4]
+    assert planned_edits == [
+        get_module_edits(module, module.text) for module in move.modules
+    ]
+
+
+def test_move_writes_nothing_to_stdout(
+    project: Path, capsys: pytest.CaptureFixture[str]
+):
+    # stdout carries the LSP messages of `prlsp attach`
+    graph = build_project_graph(get_project_config(project))
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    assert mod1 is not None and mod4 is not None
+    move_symbol_target(graph, mod4, move_symbol_source(mod1, 13, 3), 2)
+    assert capsys.readouterr().out == ""
+
+
+def test_refactor_deadline():
+    assert not CancellationToken(60).cancelled
+    token = CancellationToken(0)
+    with pytest.raises(RefactorCancelled, match="deadline"):
+        token.check()
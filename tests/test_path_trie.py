@@ -0,0 +1,26 @@
+from pyrefactorlsp.lsp.paths import PathTrie, uri_to_path
+
+
+def test_find_containing_folders():
+    trie: PathTrie[str] = PathTrie()
+    trie["/work/project"] = "project"
+    trie["file:///work/project/sub"] = "sub"
+    trie["/work/proj"] = "proj"
+    assert len(trie) == 3
+
+    assert trie.find("file:///work/project/sub/mod.py") == ["project", "sub"]
+    assert trie.find("/work/project/mod.py") == ["project"]
+    assert trie.find("/work/project") == ["project"]
+    # folders are matched by path parts, not string prefixes
+    assert trie.find("/work/projects/mod.py") == []
+
+    del trie["/work/project"]
+    assert trie.find("/work/project/sub/mod.py") == ["sub"]
+    del trie["/work/project/sub"]
+    assert trie.find("/work/project/sub/mod.py") == []
+    assert len(trie) == 1
+
+
+def test_uri_to_path():
+    assert uri_to_path("file:///work/my%20project/a.py") == "/work/my project/a.py"
+    assert uri_to_path("/work/./project/../a.py") == "/work/a.py"
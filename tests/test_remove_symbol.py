@@ -1,3 +1,4 @@
+import ast
 from pathlib import Path
 
 from pyrefactorlsp.refactor.actions.move_symbol_source import (
@@ -6,6 +7,7 @@ from pyrefactorlsp.refactor.actions.move_symbol_source import (
 )
 from pyrefactorlsp.refactor.graph import build_project_graph
 from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.module import DefinitionSpan, Module, get_definition_spans
 
 here = Path(__file__).parent
 
@@ -29,3 +31,27 @@ def test_remove_symbol():
             ImportPath("sample_project.mod1.y", None),
         }
         assert moved_symbol.needed_imports == expected_needed_imports
+
+
+def test_definition_spans():
+    text = "import x\n\n\n@deco\n@deco(\n    1\n)\ndef f():\n    pass\n\n\nclass A:\n    def g(self):\n        pass\n"
+    module = Module(url=Path("mod.py"), package="pkg", name="mod", text=text)
+    module.spans = get_definition_spans(ast.parse(text))
+    assert module.spans == [
+        DefinitionSpan(name="f", start_line=4, line=8, end_line=9),
+        DefinitionSpan(name="A", start_line=12, line=12, end_line=14),
+    ]
+    names = [getattr(module.definition_at(line), "name", None) for line in range(16)]
+    assert names == [None] * 4 + ["f"] * 6 + [None] * 2 + ["A"] * 3 + [None]
+
+
+def test_move_symbol_source_from_span():
+    config = get_project_config(here / "sample_project")
+    graph = build_project_graph(config)
+    mod1 = graph.get_node("sample_project.mod1")
+    assert mod1 is not None
+    # inside the body of the function
+    assert move_symbol_source(mod1, 14, 0).symbol_name == "test_func"
+    outside = move_symbol_source(mod1, 8, 0)
+    assert outside.symbol is None
+    assert outside.updated_source is mod1.cst
@@ -0,0 +1,350 @@
+import asyncio
+import shutil
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from pathlib import Path
+
+import pytest
+from lsprotocol.types import (
+    ApplyWorkspaceEditResult,
+    ClientCapabilities,
+    CodeAction,
+    CodeActionClientCapabilities,
+    CodeActionClientCapabilitiesResolveSupportType,
+    CodeActionContext,
+    CodeActionParams,
+    InitializeParams,
+    Position,
+    Range,
+    TextDocumentClientCapabilities,
+    TextDocumentContentChangeEvent_Type1,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    TextEdit,
+    WorkspaceEdit,
+    WorkspaceFolder,
+)
+from pygls.workspace import TextDocument
+
+from pyrefactorlsp.lsp import server
+from pyrefactorlsp.lsp.paths import uri_to_path
+from pyrefactorlsp.lsp.registry import IndexRegistry
+from pyrefactorlsp.lsp.server import (
+    RefactorServer,
+    code_actions,
+    create_server,
+    finish_move_symbol_command,
+    move_symbol_command,
+    resolve_code_action,
+)
+from pyrefactorlsp.refactor.graph import Graph
+from pyrefactorlsp.refactor.index import index_source
+
+here = Path(__file__).parent
+
+RESOLVE_EDITS = ClientCapabilities(
+    text_document=TextDocumentClientCapabilities(
+        code_action=CodeActionClientCapabilities(
+            resolve_support=CodeActionClientCapabilitiesResolveSupportType(
+                properties=["edit"]
+            )
+        )
+    )
+)
+
+
+def wait_for(ls: RefactorServer, condition: Callable[[], bool]) -> None:
+    async def wait() -> None:
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    ls.loop.run_until_complete(asyncio.wait_for(wait(), 30))
+
+
+def start_session(
+    project: Path, capabilities: ClientCapabilities | None = None, **kwargs
+) -> RefactorServer:
+    ls = create_server(**kwargs)
+    ls.lsp.lsp_initialize(
+        InitializeParams(
+            process_id=None,
+            root_uri=project.as_uri(),
+            capabilities=capabilities or ClientCapabilities(),
+            workspace_folders=[WorkspaceFolder(uri=project.as_uri(), name="project")],
+        )
+    )
+    ls.build_graph(project.as_uri())
+    wait_for(ls, lambda: not ls.indexing and bool(ls.dependency_graphs))
+    return ls
+
+
+def location(line: int) -> dict:
+    position = {"line": line, "character": 4}
+    return {"start": position, "end": position}
+
+
+def start_move(ls: RefactorServer, project: Path) -> tuple[str, str]:
+    """Start moving `test_func` out of mod1, returns the uris of mod1 and mod4"""
+    mod1 = (project / "sample_project" / "mod1.py").as_uri()
+    mod4 = (project / "sample_project" / "mod4.py").as_uri()
+    ls.loop.run_until_complete(move_symbol_command(ls, [mod1, location(12)]))
+    assert [move.symbol_name for _, move in ls.get_ongoing_moves(mod4)] == ["test_func"]
+    return mod1, mod4
+
+
+def finish_action(ls: RefactorServer, uri: str, line: int) -> CodeAction:
+    position = Position(line=line, character=0)
+    params = CodeActionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        range=Range(start=position, end=position),
+        context=CodeActionContext(diagnostics=[]),
+    )
+    [action] = [
+        action
+        for action in code_actions(ls, params)
+        if action.title.startswith("Finish moving")
+    ]
+    return action
+
+
+def resolve(ls: RefactorServer, action: CodeAction) -> WorkspaceEdit | None:
+    # clients send a copy of the action
+    action = CodeAction(title=action.title, kind=action.kind, data=action.data)
+    return ls.loop.run_until_complete(resolve_code_action(ls, action)).edit
+
+
+def open_document(ls: RefactorServer, path: Path, text: str, version: int) -> str:
+    """Open a module with unsaved changes in the client, and index them"""
+    uri = path.as_uri()
+    ls.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="python", version=version, text=text)
+    )
+    index = index_source(text)
+    assert index is not None
+    ls.apply_source_index(uri, index)
+    return uri
+
+
+def apply_text_edits(text: str, edits: Sequence[TextEdit]) -> str:
+    document = TextDocument("file:///edited.py", text)
+    for edit in reversed(edits):
+        document.apply_change(
+            TextDocumentContentChangeEvent_Type1(range=edit.range, text=edit.new_text)
+        )
+    return document.source
+
+
+def graph_state(graph: Graph) -> tuple[dict[str, str], list[tuple[str, str]]]:
+    codes = {mod.full_mod_name: mod.code for mod in graph.nodes}
+    edges = [(a.full_mod_name, b.full_mod_name) for a, b in graph.edges]
+    return codes, edges
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    # the space is percent-encoded in uris
+    shutil.copytree(here / "sample_project", tmp_path / "sample project")
+    return tmp_path / "sample project"
+
+
+@pytest.fixture
+def ls(project: Path) -> Iterator[RefactorServer]:
+    ls = start_session(project)
+    yield ls
+    ls.close_session()
+
+
+def test_modules_of_percent_encoded_uris(ls: RefactorServer, project: Path):
+    mod4 = project / "sample_project" / "mod4.py"
+    [(root, graph, mod)] = ls.get_mods(mod4.as_uri())
+    assert root == str(project)
+    assert mod.full_mod_name == "sample_project.mod4"
+
+    mod4.unlink()
+    ls.schedule_files_update([mod4.as_uri()])
+    ls.update_files()
+    assert graph.get_node("sample_project.mod4") is None
+    assert list(ls.get_mods(mod4.as_uri())) == []
+
+
+def test_new_open_modules_join_the_graph(ls: RefactorServer, project: Path):
+    mod5 = project / "sample_project" / "mod5.py"
+    mod5.write_text("from sample_project import mod4\n\nmod4.b\n")
+    uri = mod5.as_uri()
+    # unsaved content of the document
+    text = "from sample_project import mod1, mod4\n\nmod4.b\nmod1.z\n"
+    ls.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="python", version=2, text=text)
+    )
+    ls.schedule_files_update([uri])
+    ls.update_files()
+
+    [(_, graph, mod)] = ls.get_mods(uri)
+    assert mod.full_mod_name == "sample_project.mod5"
+    wait_for(ls, lambda: mod.text == text)
+    assert sorted(child.name for child in graph.children(mod)) == ["mod1", "mod4"]
+
+
+def test_sessions_do_not_leak_threads(project: Path):
+    registry = IndexRegistry()
+    ls = start_session(project, registry=registry)
+    ls.close_session()
+    threads = threading.active_count()
+    for _ in range(5):
+        ls = start_session(project, registry=registry)
+        assert len(registry) == 1
+        ls.close_session()
+    wait_for(ls, lambda: threading.active_count() <= threads)
+    assert len(registry) == 0
+
+
+def test_cancelled_formatting_leaves_graph_unchanged(
+    ls: RefactorServer, project: Path, monkeypatch: pytest.MonkeyPatch
+):
+    _, mod4 = start_move(ls, project)
+    [(root, graph, _)] = ls.get_mods(mod4)
+    before = graph_state(graph)
+    index = ls.workspaces[root]
+    index.config = index.config.model_copy(update={"refactor_timeout": 0.5})
+    formatted: list[dict[str, str]] = []
+
+    def slow_reformat_modules(sources, *args):
+        formatted.append(sources)
+        time.sleep(1)
+        return sources
+
+    monkeypatch.setattr(server, "reformat_modules", slow_reformat_modules)
+    result = ls.loop.run_until_complete(
+        finish_move_symbol_command(ls, [mod4, location(1)])
+    )
+
+    assert result is None
+    assert formatted
+    assert graph_state(graph) == before
+
+
+def test_resolve_does_not_apply_the_move(project: Path):
+    ls = start_session(project, RESOLVE_EDITS)
+    _, mod4 = start_move(ls, project)
+    [(_, graph, _)] = ls.get_mods(mod4)
+    before = graph_state(graph)
+    action = finish_action(ls, mod4, 1)
+    other_line = finish_action(ls, mod4, 2)
+
+    edit = resolve(ls, action)
+    assert edit is not None and edit.document_changes is not None
+    [mod4_edit] = [
+        change
+        for change in edit.document_changes
+        if uri_to_path(change.text_document.uri) == uri_to_path(mod4)
+    ]
+    assert sum(e.new_text.count("def test_func") for e in mod4_edit.edits) == 1
+    assert graph_state(graph) == before
+    assert list(ls.get_ongoing_moves(mod4)) == []
+
+    # resolved again to apply it, or for another line once the move is over
+    assert resolve(ls, action) is edit
+    assert resolve(ls, other_line) is None
+    assert graph_state(graph) == before
+    ls.close_session()
+
+
+def test_finish_move_applies_one_workspace_edit(
+    ls: RefactorServer, project: Path, monkeypatch: pytest.MonkeyPatch
+):
+    mod1, mod4 = start_move(ls, project)
+    [(_, graph, _)] = ls.get_mods(mod4)
+    before = graph_state(graph)
+    applied: list[WorkspaceEdit] = []
+    response = ApplyWorkspaceEditResult(applied=False)
+
+    async def apply_edit_async(edit: WorkspaceEdit, label: str | None = None):
+        applied.append(edit)
+        return response
+
+    monkeypatch.setattr(ls, "apply_edit_async", apply_edit_async)
+    result = ls.loop.run_until_complete(
+        finish_move_symbol_command(ls, [mod4, location(1)])
+    )
+    assert result is not None and not result["applied"]
+    assert graph_state(graph) == before
+    assert list(ls.get_ongoing_moves(mod4))
+
+    response.applied = True
+    result = ls.loop.run_until_complete(
+        finish_move_symbol_command(ls, [mod4, location(1)])
+    )
+    assert result is not None and result["applied"]
+    [_, edit] = applied
+    assert edit.document_changes is not None
+    uris = [uri_to_path(change.text_document.uri) for change in edit.document_changes]
+    assert result["modules"] == len(uris)
+    assert uris[:2] == [uri_to_path(mod1), uri_to_path(mod4)]
+    mod4_node = graph.get_node("sample_project.mod4")
+    assert mod4_node is not None and "def test_func" in mod4_node.code
+    assert graph_state(graph) != before
+    assert list(ls.get_ongoing_moves(mod4)) == []
+
+
+def test_finish_move_edits_open_documents(
+    ls: RefactorServer, project: Path, monkeypatch: pytest.MonkeyPatch
+):
+    _, mod4 = start_move(ls, project)
+    path = project / "sample_project" / "mod4.py"
+    text = "# unsaved\n" + path.read_text()
+    uri = open_document(ls, path, text, 3)
+    applied: list[WorkspaceEdit] = []
+
+    async def apply_edit_async(edit: WorkspaceEdit, label: str | None = None):
+        applied.append(edit)
+        return ApplyWorkspaceEditResult(applied=True)
+
+    monkeypatch.setattr(ls, "apply_edit_async", apply_edit_async)
+    ls.loop.run_until_complete(finish_move_symbol_command(ls, [mod4, location(1)]))
+
+    [edit] = applied
+    assert edit.document_changes is not None
+    [change] = [
+        change
+        for change in edit.document_changes
+        if uri_to_path(change.text_document.uri) == str(path)
+    ]
+    assert change.text_document.uri == uri
+    assert change.text_document.version == 3
+    edited = apply_text_edits(text, change.edits)
+    assert edited.count("# unsaved") == 1
+    assert edited.count("def test_func") == 1
+
+
+def test_edits_of_documents_changed_during_the_move_are_dropped(
+    ls: RefactorServer, project: Path, monkeypatch: pytest.MonkeyPatch
+):
+    _, mod4 = start_move(ls, project)
+    path = project / "sample_project" / "mod4.py"
+    # encoded differently from the uris of the edits
+    uri = path.as_uri().replace("sample_project/mod4", "sample%5Fproject/mod4")
+    applied: list[WorkspaceEdit] = []
+    finish_move = server.finish_move
+
+    def open_during_move(*args, **kwargs):
+        result = finish_move(*args, **kwargs)
+        ls.workspace.put_text_document(
+            TextDocumentItem(
+                uri=uri, language_id="python", version=1, text=path.read_text()
+            )
+        )
+        return result
+
+    async def apply_edit_async(edit: WorkspaceEdit, label: str | None = None):
+        applied.append(edit)
+        return ApplyWorkspaceEditResult(applied=True)
+
+    monkeypatch.setattr(server, "finish_move", open_during_move)
+    monkeypatch.setattr(ls, "apply_edit_async", apply_edit_async)
+    result = ls.loop.run_until_complete(
+        finish_move_symbol_command(ls, [mod4, location(1)])
+    )
+
+    assert result is None
+    assert applied == []
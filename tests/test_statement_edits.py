@@ -0,0 +1,134 @@
+from pathlib import Path
+
+import libcst
+
+from pyrefactorlsp.refactor.actions.move_symbol_source import move_symbol_source
+from pyrefactorlsp.refactor.actions.move_symbol_target import move_symbol_target
+from pyrefactorlsp.refactor.diffs import (
+    apply_edit_blocks,
+    get_module_edits,
+    get_statement_edits,
+    replaced_spans,
+)
+from pyrefactorlsp.refactor.graph import build_project_graph
+from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.transformer import KeepUnchangedTransformer
+
+here = Path(__file__).parent
+
+source = (
+    "# header\n\nimport a\n\n# comment\ndef f():\n    pass\n\n\nx = 1  # c\n# footer\n"
+)
+
+
+def test_statement_edits():
+    original = libcst.parse_module(source)
+    import_a, function, assign = original.body
+    new_assign = assign.with_changes(
+        body=[assign.body[0].with_changes(value=libcst.Integer("3"))]
+    )
+    for body in [
+        [import_a, libcst.parse_statement("import b\n"), function, assign],
+        [import_a, assign],
+        [import_a, function, assign, libcst.parse_statement("y = 2\n")],
+        [import_a, function, new_assign],
+        [],
+    ]:
+        updated = original.with_changes(body=body)
+        blocks = get_statement_edits(source, original, updated)
+        assert blocks is not None
+        assert apply_edit_blocks(source, blocks) == updated.code
+
+
+class RenameX(KeepUnchangedTransformer):
+    def leave_Name(self, original_node, updated_node):
+        if original_node.value == "x":
+            return updated_node.with_changes(value="z")
+        return updated_node
+
+
+def test_keep_unchanged_transformer():
+    original = libcst.parse_module(source)
+    updated = original.visit(RenameX())
+    assert updated.body[0] is original.body[0]
+    assert updated.body[1] is original.body[1]
+    assert updated.body[2] is not original.body[2]
+    blocks = get_statement_edits(source, original, updated)
+    assert blocks is not None
+    assert [(block.start, block.length, block.replacement) for block in blocks] == [
+        (source.index("x = 1"), 1, "z")
+    ]
+
+
+def test_statement_edits_only_cover_changes():
+    original = libcst.parse_module(source)
+    import_a, function, assign = original.body
+    updated = original.with_changes(
+        body=[import_a, function, libcst.parse_statement("y = 2\n"), assign]
+    )
+    blocks = get_statement_edits(source, original, updated)
+    assert blocks is not None
+    assert [(block.start, block.length, block.replacement) for block in blocks] == [
+        (source.index("\n\nx = 1"), 0, "y = 2\n")
+    ]
+
+
+def test_statement_edits_need_unchanged_header():
+    original = libcst.parse_module(source)
+    assert (
+        get_statement_edits(source, original, original.with_changes(header=[])) is None
+    )
+    without_newline = libcst.parse_module("x = 1")
+    assert get_statement_edits("x = 1", without_newline, without_newline) is None
+
+
+def test_move_edits():
+    config = get_project_config(here / "sample_project")
+    graph = build_project_graph(config)
+    mod1 = graph.get_node("sample_project.mod1")
+    mod4 = graph.get_node("sample_project.mod4")
+    assert mod1 is not None and mod4 is not None
+    move = move_symbol_source(mod1, 13, 3)
+    updated_modules = move_symbol_target(graph, mod4, move, 2)
+
+    assert updated_modules
+    for module in updated_modules:
+        assert module.base_cst is not None
+        blocks = get_statement_edits(module.text, module.base_cst, module.cst)
+        assert blocks is not None
+        assert apply_edit_blocks(module.text, blocks) == module.cst.code
+        assert get_module_edits(module, module.text) == blocks
+
+
+def test_replaced_spans():
+    original = libcst.parse_module(source)
+    _import_a, function, assign = original.body
+    updated = original.with_changes(
+        body=[libcst.parse_statement("import b\n"), function, assign]
+    )
+    blocks = get_statement_edits(source, original, updated)
+    assert blocks is not None
+    updated_code = apply_edit_blocks(source, blocks)
+    assert [updated_code[start:end] for start, end in replaced_spans(blocks)] == ["b"]
+
+
+def test_emptied_module_keeps_newline():
+    original = libcst.parse_module("def f():\n    pass\n")
+    updated = original.with_changes(body=[])
+    blocks = get_statement_edits(original.code, original, updated)
+    assert blocks is not None
+    assert apply_edit_blocks(original.code, blocks) == updated.code == "\n"
+
+
+def test_statement_edits_of_parsed_trees():
+    updated_code = source.replace("import a\n", "import b\nimport a\n").replace(
+        "x = 1", "x = 2"
+    )
+    blocks = get_statement_edits(
+        source, libcst.parse_module(source), libcst.parse_module(updated_code)
+    )
+    assert blocks is not None
+    assert [(block.start, block.length, block.replacement) for block in blocks] == [
+        (source.index("import a"), 0, "import b\n"),
+        (source.index("1  # c"), 1, "2"),
+    ]
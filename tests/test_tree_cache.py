@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import libcst
+from libcst.metadata import QualifiedNameProvider
+
+from pyrefactorlsp.refactor.graph import Graph, build_project_graph
+from pyrefactorlsp.refactor.imports import find_imports
+from pyrefactorlsp.refactor.load import get_project_config
+from pyrefactorlsp.refactor.module import TREE_BYTES_PER_CHAR, Module, TreeCache
+
+here = Path(__file__).parent
+
+
+def write_module(tmp_path: Path, name: str, text: str) -> Module:
+    path = tmp_path / f"{name}.py"
+    path.write_text(text)
+    return Module(url=path, package="pkg", name=name, text=text)
+
+
+def test_cst_is_lazy():
+    config = get_project_config(here / "sample_project")
+    graph = build_project_graph(config)
+    assert all(not mod.is_loaded for mod in graph.nodes)
+    assert graph.edges
+
+    mod1 = graph.get_node("sample_project.mod1")
+    assert mod1 is not None
+    assert mod1.cst.code == mod1.text
+    assert mod1.is_loaded
+
+
+def test_evicts_least_recently_used(tmp_path: Path):
+    graph = Graph(tree_cache=TreeCache(max_trees=2))
+    a, b, c = (write_module(tmp_path, name, "x = 1\n") for name in "abc")
+    for mod in (a, b, c):
+        graph.add_node(mod)
+    for mod in (a, b, a, c):
+        assert mod.cst
+    assert a.is_loaded and c.is_loaded
+    assert not b.is_loaded
+    assert b.cst.code == "x = 1\n"
+
+
+def test_evicts_by_estimated_bytes(tmp_path: Path):
+    text = "x = 1\n"
+    cache = TreeCache(max_bytes=len(text) * TREE_BYTES_PER_CHAR * 2, keep_text=False)
+    graph = Graph(tree_cache=cache)
+    a, b, c = (write_module(tmp_path, name, text) for name in "abc")
+    for mod in (a, b, c):
+        graph.add_node(mod)
+        assert mod.cst
+    assert len(cache) == 2
+    assert not a.is_loaded
+    assert a._text is None
+    assert a.text == text
+
+
+def test_modified_tree_is_written_back(tmp_path: Path):
+    graph = Graph(tree_cache=TreeCache(max_trees=1, keep_text=False))
+    a, b = write_module(tmp_path, "a", "x = 1\n"), write_module(tmp_path, "b", "")
+    graph.add_node(a)
+    graph.add_node(b)
+    a.cst = libcst.parse_module("x = 2\n")
+    assert b.cst
+    assert not a.is_loaded
+    assert a.text == "x = 2\n"
+    assert a.cst.code == "x = 2\n"
+
+
+def test_metadata_is_shared_until_tree_changes(tmp_path: Path):
+    module = write_module(tmp_path, "a", "from p import x\nx\n")
+    assert find_imports(module) == {"p.x"}
+    metadata = module.metadata
+    assert metadata.module is module.cst
+    assert QualifiedNameProvider in metadata._metadata
+    # the scope analysis of `find_imports` is reused
+    assert find_imports(module) == {"p.x"}
+    assert module.metadata is metadata
+
+    module.cst = libcst.parse_module("from q import y\ny\n")
+    assert module.metadata is not metadata
+    assert find_imports(module) == {"q.y"}
+
+    metadata = module.metadata
+    module.text = "import z\nz\n"
+    assert module.metadata is not metadata
+    assert find_imports(module) == {"z"}
+
+    module.release()
+    assert module._metadata is None
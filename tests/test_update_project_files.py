@@ -0,0 +1,73 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pyrefactorlsp.refactor.graph import build_project_graph, update_project_files
+from pyrefactorlsp.refactor.load import get_project_config
+
+here = Path(__file__).parent
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    shutil.copytree(here / "sample_project", tmp_path / "sample_project")
+    return tmp_path / "sample_project"
+
+
+def named_edges(graph) -> set[tuple[str, str]]:
+    return {(a.full_mod_name, b.full_mod_name) for a, b in graph.edges}
+
+
+def test_created_module_resolves_existing_importers(project: Path):
+    config = get_project_config(project)
+    graph = build_project_graph(config)
+    mod4 = project / "sample_project" / "mod4.py"
+    mod4.write_text("from sample_project.mod5 import c\n\nb = c\n")
+    update_project_files(graph, config, [mod4])
+    assert not graph.has_edge_from(graph.get_node("sample_project.mod4"))
+
+    mod5 = project / "sample_project" / "mod5.py"
+    mod5.write_text("c = 1\n")
+    updated = update_project_files(graph, config, [mod5])
+
+    assert [mod.full_mod_name for mod in updated] == [
+        "sample_project.mod5",
+        "sample_project.mod4",
+    ]
+    assert ("sample_project.mod4", "sample_project.mod5") in named_edges(graph)
+    assert named_edges(graph) == named_edges(build_project_graph(config))
+
+
+def test_deleted_module(project: Path):
+    config = get_project_config(project)
+    graph = build_project_graph(config)
+    mod3 = project / "sample_project" / "pkg" / "subpkg" / "mod3.py"
+    mod3.unlink()
+    updated = update_project_files(graph, config, [mod3])
+
+    assert graph.get_node("sample_project.pkg.subpkg.mod3") is None
+    assert [mod.full_mod_name for mod in updated] == ["sample_project.pkg.mod2"]
+    assert named_edges(graph) == named_edges(build_project_graph(config))
+
+
+def test_renamed_module_keeps_module(project: Path):
+    config = get_project_config(project)
+    graph = build_project_graph(config)
+    mod4 = graph.get_node("sample_project.mod4")
+    old_path = project / "sample_project" / "mod4.py"
+    new_path = project / "sample_project" / "pkg" / "mod4.py"
+    old_path.rename(new_path)
+    update_project_files(graph, config, [new_path, old_path])
+
+    assert graph.get_node("sample_project.mod4") is None
+    assert graph.get_node("sample_project.pkg.mod4") is mod4
+    assert mod4.url == new_path
+    assert named_edges(graph) == named_edges(build_project_graph(config))
+
+
+def test_files_outside_of_project_are_ignored(project: Path):
+    config = get_project_config(project)
+    graph = build_project_graph(config)
+    (project / "notes.txt").write_text("")
+    assert update_project_files(graph, config, [project / "notes.txt"]) == []